@@ -0,0 +1,67 @@
+'''Benchmarks of searching and importing synthetic treebanks, which need a
+running BaseX server'''
+
+import pytest
+
+from search.basex_search import (generate_xquery_metadata_count,
+                                 parse_metadata_count_result)
+from search.models import ComponentSearchResult, SearchQuery
+from services.basex import basex
+from .loader import load_treebank, delete_treebank
+from .synthetic import SyntheticTreebank
+
+XPATH = '//node[@cat="np" and node[@rel="det" and @pt="lid"]]'
+
+pytestmark = pytest.mark.django_db
+
+
+def test_perform_search(benchmark, synthetic_treebank):
+    def setup():
+        # Do not use results cached by a previous round
+        ComponentSearchResult.objects.filter(xpath=XPATH).delete()
+        query = SearchQuery.objects.create(xpath=XPATH)
+        query.components.add(*synthetic_treebank.components.all())
+        query.initialize()
+        return (query,), {}
+
+    def search(query):
+        query.perform_search()
+        return query
+
+    query = benchmark.pedantic(search, setup=setup, rounds=5)
+    results, percentage, _ = query.get_results()
+    assert percentage == 100
+    assert len(results) > 0
+
+
+def test_metadata_count(benchmark, synthetic_treebank):
+    databases = [database.dbname for component in
+                 synthetic_treebank.components.all()
+                 for database in component.databases.all()]
+
+    def count():
+        return [parse_metadata_count_result(basex.perform_query(
+            generate_xquery_metadata_count(database, XPATH)
+        )) for database in databases]
+
+    counts = benchmark.pedantic(count, rounds=5)
+    assert any(counts)
+
+
+def test_import(benchmark, basex_connection, tmp_path):
+    synthetic = SyntheticTreebank(components=2, files_per_component=4,
+                                  sentences_per_file=250)
+    treebanks = []
+
+    def load():
+        treebank = load_treebank(synthetic, tmp_path / 'benchmark_import')
+        treebanks.append(treebank)
+        return treebank
+
+    try:
+        treebank = benchmark.pedantic(load, rounds=3)
+        assert sum(component.nr_sentences for component in
+                   treebank.components.all()) == 2000
+    finally:
+        # upload-lassy replaces the treebank of the previous round
+        delete_treebank(treebanks[-1])
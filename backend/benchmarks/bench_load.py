@@ -0,0 +1,82 @@
+'''Throughput and tail latency of concurrent searches, using the fake BaseX
+server with injected latency so that results are reproducible and do not
+depend on a BaseX installation'''
+
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from search.basex_search import generate_xquery_search, parse_search_result
+from services.basex import basex
+from services.testing import FakeBaseXServer
+from .synthetic import SyntheticTreebank
+
+XPATH = '//node[@cat="np" and node[@rel="det" and @pt="lid"]]'
+# Number of simultaneous clients and searches per client
+CLIENTS = 8
+SEARCHES_PER_CLIENT = 4
+
+
+@pytest.fixture(scope='module')
+def fake_basex():
+    synthetic = SyntheticTreebank(components=1, files_per_component=8,
+                                  sentences_per_file=200)
+    with FakeBaseXServer(latency=0.002) as server, server.settings():
+        for filename in synthetic.filenames:
+            server.add_database(filename.split('.')[0].upper(),
+                                synthetic.generate_database(filename))
+        yield server
+
+
+def search_concurrently(databases):
+    '''Search all databases from CLIENTS threads and return the number of
+    results and the latency of every search'''
+    def search(database):
+        start = time.perf_counter()
+        query = generate_xquery_search(database, XPATH)
+        results = parse_search_result(
+            ''.join(item for _, item in basex.perform_query_iter(query)),
+            'c00'
+        )
+        return len(results), time.perf_counter() - start
+
+    searches = [databases[i % len(databases)]
+                for i in range(CLIENTS * SEARCHES_PER_CLIENT)]
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        outcomes = list(pool.map(search, searches))
+    return (sum(number for number, _ in outcomes),
+            [latency for _, latency in outcomes])
+
+
+def record_latencies(benchmark, latencies):
+    percentiles = statistics.quantiles(latencies, n=100)
+    benchmark.extra_info.update({
+        'p50': percentiles[49],
+        'p95': percentiles[94],
+        'p99': percentiles[98],
+    })
+
+
+def test_concurrent_search(benchmark, fake_basex):
+    databases = sorted(fake_basex.databases)
+    number_of_results, latencies = benchmark.pedantic(
+        search_concurrently, args=(databases,), rounds=3
+    )
+    record_latencies(benchmark, latencies)
+    assert number_of_results > 0
+
+
+def test_concurrent_search_slow_database(benchmark, fake_basex):
+    '''One slow database should not hold up searches in other databases'''
+    databases = sorted(fake_basex.databases)
+    fake_basex.slow_down(databases[0], 0.1)
+    try:
+        _, latencies = benchmark.pedantic(
+            search_concurrently, args=(databases,), rounds=3
+        )
+    finally:
+        fake_basex.slow_down(databases[0], 0)
+    record_latencies(benchmark, latencies)
+    assert statistics.median(latencies) < 0.1
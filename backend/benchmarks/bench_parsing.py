@@ -0,0 +1,41 @@
+'''Benchmarks of processing BaseX output and input files, which do not
+need BaseX'''
+
+import io
+
+import pytest
+
+from search.basex_search import (parse_search_result,
+                                 parse_metadata_count_result)
+from upload.lassy import convert_data_dz
+from .synthetic import (SyntheticTreebank, format_search_results,
+                        format_metadata_counts)
+
+XPATH = '//node[@cat="np"]'
+
+
+@pytest.fixture(scope='module')
+def sentences():
+    synthetic = SyntheticTreebank(sentences_per_file=1000)
+    return list(synthetic.generate_file(synthetic.filenames[0]))
+
+
+def test_parse_search_result(benchmark, sentences):
+    results = format_search_results(sentences, XPATH, 'DB')
+    matches = benchmark(parse_search_result, results, 'c00')
+    assert len(matches) == results.count('<match>')
+
+
+def test_parse_metadata_count_result(benchmark, sentences):
+    counts = format_metadata_counts(sentences)
+    totals = benchmark(parse_metadata_count_result, counts)
+    assert sum(totals['year'].values()) == len(sentences)
+
+
+def test_convert_data_dz(benchmark, tmp_path):
+    synthetic = SyntheticTreebank(components=1, files_per_component=1,
+                                  sentences_per_file=1000)
+    path, = synthetic.write(tmp_path / 'convert')
+    number_of_sentences, _ = benchmark(convert_data_dz, str(path),
+                                       io.BytesIO())
+    assert number_of_sentences == 1000
@@ -0,0 +1,71 @@
+'''Benchmarks of getting the results of a search query while polling, using
+cached results of synthetic sentences so that BaseX is not needed'''
+
+import pytest
+from django.utils import timezone
+
+from search.models import ComponentSearchResult, SearchQuery
+from treebanks.models import Treebank, Component, BaseXDB
+from .synthetic import SyntheticTreebank, format_search_results
+
+XPATH = '//node[@cat="np"]'
+
+
+@pytest.fixture
+def completed_query(db):
+    '''A search query of which the results have been cached for all
+    components of a synthetic treebank'''
+    synthetic = SyntheticTreebank(components=4, files_per_component=2,
+                                  sentences_per_file=250)
+    treebank = Treebank.objects.create(slug='benchmark', title='Benchmark')
+    query = SearchQuery.objects.create(xpath=XPATH)
+    for number in range(synthetic.components):
+        slug = 'c{:02d}'.format(number)
+        component = Component.objects.create(slug=slug, title=slug,
+                                             treebank=treebank,
+                                             nr_sentences=0, nr_words=0)
+        results = ''
+        for filename in synthetic.filenames:
+            if not filename.startswith(slug):
+                continue
+            dbname = 'BENCHMARK_' + filename.split('.')[0].upper()
+            BaseXDB.objects.create(dbname=dbname, size=1000,
+                                   component=component)
+            results += format_search_results(
+                list(synthetic.generate_file(filename)), XPATH, dbname
+            )
+        result = ComponentSearchResult.objects.create(
+            xpath=XPATH, component=component,
+            search_completed=timezone.now(),
+            number_of_results=results.count('<match>'),
+            completed_part=component.total_database_size
+        )
+        result._get_cache_path().write_text(results)
+        query.components.add(component)
+    query.initialize()
+    return query
+
+
+def test_get_results(benchmark, completed_query):
+    results, percentage, _ = benchmark(completed_query.get_results)
+    assert percentage == 100
+
+
+def test_get_results_polling(benchmark, completed_query):
+    '''Later polls exclude the results that have already been returned'''
+    results, _, _ = completed_query.get_results(max_results=500)
+    returned = {result.id for result in results}
+    results, _, _ = benchmark(completed_query.get_results, max_results=500,
+                              exclude=returned)
+    assert returned.isdisjoint(result.id for result in results)
+
+
+def test_get_results_filtered(benchmark, completed_query):
+    def filter_year(matches):
+        return [match for match in matches
+                if 'value="year1"' in match.as_dict()['meta']]
+
+    completed_query.add_filter(filter_year)
+    results, _, counts = benchmark(completed_query.get_results)
+    assert all('value="year1"' in result.as_dict()['meta']
+               for result in results)
@@ -0,0 +1,46 @@
+import pytest
+
+from services.basex import basex
+from services.testing import FakeBaseXServer
+from .loader import load_treebank, delete_treebank
+from .synthetic import SyntheticTreebank
+
+# Treebank that is searched by the benchmarks that need BaseX
+SEARCH_TREEBANK = SyntheticTreebank(components=4, files_per_component=4,
+                                    sentences_per_file=500)
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--fake-basex', action='store_true',
+        help='run the benchmarks that need BaseX against an in-process fake '
+             'BaseX server instead of the configured BaseX server'
+    )
+
+
+@pytest.fixture(autouse=True)
+def caching_dir(settings, tmp_path):
+    settings.CACHING_DIR = tmp_path / 'query_result_cache'
+
+
+@pytest.fixture(scope='session')
+def basex_connection(request):
+    if request.config.getoption('--fake-basex'):
+        with FakeBaseXServer() as server, server.settings():
+            yield server
+        return
+    if not basex.test_connection():
+        pytest.skip('requires running BaseX server')
+    yield None
+
+
+@pytest.fixture(scope='session')
+def synthetic_treebank(basex_connection, django_db_setup, django_db_blocker,
+                       tmp_path_factory):
+    '''SEARCH_TREEBANK, added to BaseX once for all benchmarks'''
+    directory = tmp_path_factory.mktemp('treebanks') / 'benchmark_search'
+    with django_db_blocker.unblock():
+        treebank = load_treebank(SEARCH_TREEBANK, directory)
+    yield treebank
+    with django_db_blocker.unblock():
+        delete_treebank(treebank)
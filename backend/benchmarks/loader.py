@@ -0,0 +1,31 @@
+'''Adding synthetic treebanks to BaseX for benchmarks'''
+
+import io
+from pathlib import Path
+
+from django.core.management import call_command
+from django.utils.text import slugify
+
+from treebanks.models import Treebank
+from .synthetic import SyntheticTreebank
+
+
+def load_treebank(synthetic: SyntheticTreebank, directory: Path,
+                  jobs: int = 1) -> Treebank:
+    '''Write a synthetic treebank to the given directory (which should be
+    named after the treebank) and add it to BaseX using upload-lassy,
+    replacing any existing treebank with the same name. Return the
+    Treebank object.'''
+    synthetic.write(directory)
+    call_command('upload-lassy', str(directory), '--group-by', '3',
+                 '--defaults', '--jobs', str(jobs), stdout=io.StringIO())
+    return Treebank.objects.get(slug=slugify(Path(directory).name))
+
+
+def delete_treebank(treebank: Treebank) -> None:
+    '''Delete a treebank including its BaseX databases, regardless of the
+    DELETE_COMPONENTS_FROM_BASEX setting'''
+    for component in treebank.components.all():
+        for database in component.databases.all():
+            database.delete_basex_db()
+    treebank.delete()
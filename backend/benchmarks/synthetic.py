@@ -0,0 +1,224 @@
+'''Generation of synthetic Alpino treebanks for benchmarks. Treebanks are
+written as LASSY compact corpora (.data.dz files in a COMPACT directory) so
+that they can be added to BaseX with the upload-lassy command, and can also
+be used to produce search results in the format returned by BaseX without
+running BaseX. Generation is deterministic for a given seed.'''
+
+import argparse
+import gzip
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from lxml import etree
+
+CATEGORIES = ['smain', 'np', 'pp', 'ssub', 'inf', 'ppart', 'conj', 'ap']
+RELATIONS = ['su', 'obj1', 'mod', 'vc', 'predc', 'det', 'hd', 'cnj']
+# Tuples of word, lemma and part of speech tag
+WORDS = [
+    ('de', 'de', 'lid'), ('het', 'het', 'lid'), ('een', 'een', 'lid'),
+    ('huis', 'huis', 'n'), ('boek', 'boek', 'n'), ('kat', 'kat', 'n'),
+    ('stad', 'stad', 'n'), ('zin', 'zin', 'n'), ('loopt', 'lopen', 'ww'),
+    ('leest', 'lezen', 'ww'), ('is', 'zijn', 'ww'), ('heeft', 'hebben', 'ww'),
+    ('groot', 'groot', 'adj'), ('mooi', 'mooi', 'adj'), ('in', 'in', 'vz'),
+    ('op', 'op', 'vz'), ('en', 'en', 'vg'), ('dit', 'dit', 'vnw'),
+    ('zij', 'zij', 'vnw'), ('niet', 'niet', 'bw'),
+]
+# Words are chosen with a Zipfian distribution, like in real text
+WORD_WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+@dataclass
+class SyntheticTreebank:
+    '''Description of a synthetic treebank. Its files are named like
+    c00f0000.data.dz, so that upload-lassy --group-by 3 creates the given
+    number of components.'''
+    components: int = 2
+    files_per_component: int = 2
+    sentences_per_file: int = 100
+    # Minimum and maximum number of words of a sentence
+    words_per_sentence: Tuple[int, int] = (5, 20)
+    # Maximum depth of the syntax trees below the top node
+    depth: int = 6
+    # Names of metadata fields and their number of distinct values
+    metadata: Dict[str, int] = field(
+        default_factory=lambda: {'year': 10, 'genre': 4}
+    )
+    seed: int = 0
+
+    @property
+    def filenames(self) -> List[str]:
+        return ['c{:02d}f{:04d}.data.dz'.format(component, number)
+                for component in range(self.components)
+                for number in range(self.files_per_component)]
+
+    def generate_sentence(self, rng: random.Random,
+                          sentence_id: str) -> etree._Element:
+        '''Return a random alpino_ds element'''
+        length = rng.randint(*self.words_per_sentence)
+        words = rng.choices(WORDS, WORD_WEIGHTS, k=length)
+        root = etree.Element('alpino_ds', version='1.6')
+        if self.metadata:
+            metadata = etree.SubElement(root, 'metadata')
+            for name, cardinality in self.metadata.items():
+                etree.SubElement(metadata, 'meta', type='text', name=name,
+                                 value='{}{}'.format(name,
+                                                     rng.randrange(
+                                                         cardinality)))
+        top = etree.SubElement(root, 'node', cat='top', rel='top',
+                               begin='0', end=str(length))
+        self._add_node(rng, top, 0, length, words, 1)
+        for number, node in enumerate(root.iter('node')):
+            node.set('id', str(number))
+        sentence = etree.SubElement(root, 'sentence', sentid=sentence_id)
+        sentence.text = ' '.join(word for word, _, _ in words)
+        return root
+
+    def _add_node(self, rng, parent, begin, end, words, level):
+        '''Add a node spanning the words from begin to end to parent,
+        dividing it into two or three constituents until the maximum
+        depth has been reached'''
+        if end - begin == 1:
+            word, lemma, pt = words[begin]
+            etree.SubElement(parent, 'node', begin=str(begin), end=str(end),
+                             rel=rng.choice(RELATIONS), pt=pt, pos=pt,
+                             word=word, lemma=lemma)
+            return
+        node = etree.SubElement(parent, 'node', begin=str(begin),
+                                end=str(end), rel=rng.choice(RELATIONS),
+                                cat=rng.choice(CATEGORIES))
+        if level >= self.depth:
+            cuts = list(range(begin + 1, end))
+        else:
+            number_of_parts = min(end - begin, rng.randint(2, 3))
+            cuts = sorted(rng.sample(range(begin + 1, end),
+                                     number_of_parts - 1))
+        for part_begin, part_end in zip([begin] + cuts, cuts + [end]):
+            self._add_node(rng, node, part_begin, part_end, words, level + 1)
+
+    def generate_file(self, filename: str) -> Iterator[etree._Element]:
+        '''Generate the sentences of a file of this treebank'''
+        rng = random.Random('{}:{}'.format(self.seed, filename))
+        for number in range(self.sentences_per_file):
+            yield self.generate_sentence(rng, '{}:{}'.format(filename,
+                                                             number))
+
+    def generate_database(self, filename: str) -> bytes:
+        '''Return the sentences of a file of this treebank as XML document
+        like it is added to BaseX by upload-lassy'''
+        root = etree.Element('treebank')
+        for sentence in self.generate_file(filename):
+            sentence.set('id', sentence.find('sentence').get('sentid'))
+            root.append(sentence)
+        return etree.tostring(root, encoding='utf-8')
+
+    def write(self, directory: Path) -> List[Path]:
+        '''Write the treebank as LASSY compact corpus to a COMPACT
+        directory in the given directory (which should be named after the
+        treebank) and return the paths of the files.'''
+        compact = Path(directory) / 'COMPACT'
+        compact.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for filename in self.filenames:
+            path = compact / filename
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                for sentence in self.generate_file(filename):
+                    f.write(XML_DECLARATION)
+                    f.write(etree.tostring(sentence, encoding='unicode',
+                                           pretty_print=True))
+            paths.append(path)
+        return paths
+
+
+def format_match(sentence: etree._Element, node: etree._Element,
+                 database: str) -> str:
+    '''Return a match of a node in a sentence (alpino_ds element) in the
+    format of an item of the result of the XQuery generated by
+    generate_xquery_search (without variables)'''
+    # The ID attribute is added when files are converted for BaseX
+    sentid = sentence.get('id') or sentence.find('sentence').get('sentid')
+    meta = ''.join(etree.tostring(x, encoding='unicode', with_tail=False)
+                   for x in sentence.iterfind('metadata/meta'))
+    ids = '-'.join(node.xpath('descendant-or-self::node/@id'))
+    begins = '-'.join(dict.fromkeys(
+        node.xpath('descendant-or-self::node/@begin')
+    ))
+    return '<match>{}||{}||{}||{}||{}||{}||||{}</match>'.format(
+        sentid, sentence.findtext('sentence'), ids, begins,
+        etree.tostring(node, encoding='unicode', with_tail=False),
+        meta, database
+    )
+
+
+def format_search_results(sentences: List[etree._Element], xpath: str,
+                          database: str) -> str:
+    '''Return the matches of an XPath query in the given sentences, which
+    should not be part of the same document, in the format of the result
+    of the XQuery generated by generate_xquery_search'''
+    return ''.join(format_match(sentence, node, database)
+                   for sentence in sentences
+                   for node in sentence.xpath(xpath))
+
+
+def format_metadata_counts(sentences: List[etree._Element]) -> str:
+    '''Return the metadata counts of the given sentences in the format of
+    the results of the XQuery generated by generate_xquery_metadata_count,
+    as if every sentence matched once'''
+    counts = Counter(
+        (meta.get('name'), meta.get('type'), meta.get('value'))
+        for sentence in sentences
+        for meta in sentence.iterfind('metadata/meta')
+    )
+    root = etree.Element('metadata')
+    element = None
+    for (name, type_, value), count in sorted(counts.items()):
+        if element is None or element.get('name') != name:
+            element = etree.SubElement(root, 'meta', name=name, type=type_)
+        etree.SubElement(element, 'count', value=value).text = str(count)
+    return etree.tostring(root, encoding='unicode')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic treebank as LASSY compact corpus, '
+                    'which can be added to GrETEL using '
+                    'manage.py upload-lassy DIRECTORY --group-by 3'
+    )
+    parser.add_argument('directory',
+                        help='output directory, named after the treebank')
+    parser.add_argument('--components', type=int, default=2)
+    parser.add_argument('--files-per-component', type=int, default=2)
+    parser.add_argument('--sentences-per-file', type=int, default=100)
+    parser.add_argument('--min-words', type=int, default=5)
+    parser.add_argument('--max-words', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument(
+        '--metadata', nargs='*', default=['year=10', 'genre=4'],
+        help='metadata fields and their number of distinct values, '
+             'as NAME=NUMBER'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    metadata = {}
+    for argument in args.metadata:
+        name, _, cardinality = argument.partition('=')
+        metadata[name] = int(cardinality)
+    treebank = SyntheticTreebank(
+        components=args.components,
+        files_per_component=args.files_per_component,
+        sentences_per_file=args.sentences_per_file,
+        words_per_sentence=(args.min_words, args.max_words),
+        depth=args.depth,
+        metadata=metadata,
+        seed=args.seed
+    )
+    paths = treebank.write(Path(args.directory))
+    print('Wrote {} files to {}.'.format(len(paths), args.directory))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ import os
 
 from celery import Celery
 from celery.schedules import crontab
+from django.conf import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gretel.settings')
 
@@ -15,6 +16,16 @@ app.autodiscover_tasks()
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
     sender.add_periodic_task(crontab(hour=3), purge_cache.s())
+    # Queries of newly imported multi-word expressions
+    sender.add_periodic_task(
+        crontab(hour=4, minute=0),
+        sender.signature('mwe.tasks.precompute_mwe_queries')
+    )
+    sender.add_periodic_task(
+        crontab(hour=settings.CACHE_WARMING_HOUR, minute=0),
+        sender.signature('search.tasks.warm_search_cache')
+        .set(priority=settings.CACHE_WARMING_PRIORITY)
+    )
 
 
 @app.task
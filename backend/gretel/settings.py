@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'services.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -153,6 +154,17 @@ BASEX_HOST = os.getenv('BASEX_HOST', 'localhost')
 BASEX_PORT = 1984
 BASEX_USER = 'admin'
 BASEX_PASSWORD = 'admin'
+# Options for newly created BaseX databases. The attribute and text indexes
+# are used by BaseX to speed up queries on attribute values (such as @lemma)
+# and text; because GrETEL does not update databases, indexes do not have to
+# be updated incrementally.
+BASEX_DATABASE_OPTIONS = {
+    'ATTRINDEX': True,
+    'TEXTINDEX': True,
+    'TOKENINDEX': True,
+    'UPDINDEX': False,
+    'AUTOOPTIMIZE': False,
+}
 
 # Alpino connection settings
 # Provide ALPINO_HOST and ALPINO_PORT to use Alpino as a server. Provide
@@ -162,6 +174,43 @@ ALPINO_HOST = os.getenv('ALPINO_HOST', 'localhost')
 ALPINO_PORT = 7001
 ALPINO_PATH = '/opt/Alpino'
 
+# Parallel parsing of uploaded treebanks. Sentences are divided over the
+# server given by ALPINO_HOST and ALPINO_PORT and the servers in
+# ALPINO_EXTRA_SERVERS (a list of (host, port) tuples), or parsed with that
+# number of ALPINO_PATH processes at the same time.
+ALPINO_EXTRA_SERVERS = []
+ALPINO_PARSE_WORKERS = 4
+# Number of sentences that are dispatched to the workers at once
+ALPINO_PARSE_BATCH_SIZE = 200
+# Seconds after which parsing a sentence is retried (or given up on if it
+# has been tried ALPINO_PARSE_RETRIES times already)
+ALPINO_PARSE_TIMEOUT = 300
+ALPINO_PARSE_RETRIES = 2
+# Single sentences (e.g. of example-based search) are parsed by a pool of
+# ALPINO_POOL_SIZE clients for each server, or ALPINO_POOL_SIZE processes
+# if ALPINO_PATH is used. A client that takes more than ALPINO_POOL_TIMEOUT
+# seconds is stopped and restarted; requests are refused while
+# ALPINO_POOL_MAXIMUM_ABANDONED of those are still running. At most
+# ALPINO_POOL_QUEUE_SIZE requests wait for a free client, for at most
+# ALPINO_POOL_QUEUE_TIMEOUT seconds; other requests are refused. Clients
+# that have been idle for ALPINO_HEALTH_CHECK_INTERVAL seconds are checked
+# before they are used.
+ALPINO_POOL_SIZE = 2
+ALPINO_POOL_TIMEOUT = 60
+ALPINO_POOL_QUEUE_SIZE = 20
+ALPINO_POOL_QUEUE_TIMEOUT = 10
+ALPINO_HEALTH_CHECK_INTERVAL = 300
+ALPINO_POOL_MAXIMUM_ABANDONED = 10
+
+# Maximum number of parses of single sentences (e.g. of example-based
+# search) that are kept in the database to answer repeated requests; the
+# least recently used ones are removed first. 0 disables the cache.
+PARSE_CACHE_SIZE = 10000
+
+# Maximum number of sentences that can be parsed in a single request to
+# the batch parse endpoint
+PARSE_BATCH_MAXIMUM = 100
+
 MAXIMUM_RESULTS = 500
 MAXIMUM_RESULTS_ANALYSIS = 5000
 
@@ -170,7 +219,70 @@ DELETE_COMPONENTS_FROM_BASEX = False
 
 MAXIMUM_RESULTS_PER_COMPONENT = 5000
 
+# Size of the BaseX databases (shards) that are created when importing
+# treebanks: a database is complete as soon as it contains
+# DATABASE_SHARD_SIZE bytes of XML or DATABASE_SHARD_SENTENCES sentences
+# (if not None). Existing treebanks can be rebalanced with the reshard
+# command.
+DATABASE_SHARD_SIZE = 1024 * 1024 * 10  # 10 MiB
+DATABASE_SHARD_SENTENCES = None
+
+# Number of BaseX databases of which the size, number of sentences and
+# number of words are determined at the same time when importing treebanks
+DATABASE_STATISTICS_WORKERS = 8
+
+# Number of recently shown trees that are kept in memory by each process
+TREE_CACHE_SIZE = 256
+
+# Number of generated XPath queries of example-based search and total size
+# in MiB of the XML of marked trees that are kept in memory by each process
+XPATH_CACHE_SIZE = 256
+MARKED_TREE_CACHE_SIZE = 16
+
+# Number of canonical forms of multi-word expressions of which the queries
+# are generated at the same time by the precompute-mwe-queries command
+MWE_QUERY_WORKERS = 8
+
+# Number of queries generated for unknown multi-word expressions that are
+# kept in memory by each process
+MWE_QUERY_CACHE_SIZE = 256
+
+# Searches and counts in a BaseX database taking more seconds than this are
+# recorded in the slow query log (see SlowQuery), including their query
+# plan; None to disable
+SLOW_QUERY_THRESHOLD = 10.0
+
+# Confidence level of the intervals given for approximate (sampled) searches
+SAMPLE_CONFIDENCE_LEVEL = 0.95
+
 CACHING_DIR = BASE_DIR / 'query_result_cache'
 MAXIMUM_CACHE_SIZE = 256  # Maximum cache size in MiB
+
+# Pre-warming of the search result cache (see search.warming): every day at
+# CACHE_WARMING_HOUR at most CACHE_WARMING_QUERIES popular queries are
+# searched in advance, for at most CACHE_WARMING_DURATION minutes. A query
+# is skipped if more than CACHE_WARMING_MAXIMUM_ACTIVE_SEARCHES searches are
+# active, if the load average per CPU exceeds CACHE_WARMING_MAXIMUM_LOAD
+# (None to ignore) or if the cache has been filled up to
+# CACHE_WARMING_CACHE_FRACTION of MAXIMUM_CACHE_SIZE. Every query is sent as
+# a separate task with a low priority, so that searches of users go first.
+CACHE_WARMING_QUERIES = 100
+CACHE_WARMING_HOUR = 5
+CACHE_WARMING_DURATION = 60
+CACHE_WARMING_HISTORY_DAYS = 30
+CACHE_WARMING_MAXIMUM_ACTIVE_SEARCHES = 0
+CACHE_WARMING_MAXIMUM_LOAD = 1.0
+CACHE_WARMING_CACHE_FRACTION = 0.5
+CACHE_WARMING_PRIORITY = 9
+
+# Profiling of requests (see services.profiling): fraction of the requests
+# to the given paths that is profiled, and whether requests with the
+# X-Gretel-Profile header are profiled as well. Reports can be downloaded
+# from the admin; only the most recent ones are kept.
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_ALLOW_HEADER = False
+PROFILING_PATHS = ['/search/', '/parse/']
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAXIMUM_REPORTS = 100
 STATICFILES_DIRS: List[str] = []
 PROXY_FRONTEND = None
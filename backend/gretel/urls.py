@@ -3,6 +3,7 @@ from django.contrib import admin
 from django.urls import include, path, re_path
 from django.views.generic.base import RedirectView
 
+from services.views import metrics_view
 from .index import index
 from .proxy_frontend import proxy_frontend
 
@@ -17,6 +18,7 @@ urlpatterns = [
     path('search/', include('search.urls')),
 
     path('mwe/', include('mwe.urls')),
+    path('metrics', metrics_view, name='metrics'),
 
     path('admin', RedirectView.as_view(url='/admin/', permanent=True)),
     path('admin/', admin.site.urls),
@@ -10,4 +10,5 @@ class CanonicalFormAdmin(admin.ModelAdmin):
 
 @admin.register(XPathQuery)
 class XPathQueryAdmin(admin.ModelAdmin):
-    list_display = ('canonical', 'xpath', 'description')
+    list_display = ('canonical', 'xpath', 'description', 'generated')
+    list_filter = ('rank', 'generated')
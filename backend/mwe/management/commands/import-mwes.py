@@ -1,13 +1,17 @@
 from collections import Counter
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
-from mwe.models import CanonicalForm
+from mwe.models import CanonicalForm, XPathQuery
 
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('input_file',
                             help='A tab-separated file with canonical forms')
+        parser.add_argument('--precompute-queries', action='store_true',
+                            help='Generate and store the queries of the '
+                                 'imported forms afterwards')
 
     def handle(self, *args, **options):
         texts = {}
@@ -20,5 +24,9 @@ class Command(BaseCommand):
         forms = [CanonicalForm(text=text, dcmid=key) for key, text in texts.items()]
         if forms:
             # list not empty
+            # generated queries would prevent deleting the old forms
+            XPathQuery.objects.filter(generated=True).delete()
             CanonicalForm.objects.all().delete()
             CanonicalForm.objects.bulk_create(forms)
+        if options['precompute_queries']:
+            call_command('precompute-mwe-queries')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from mwe.models import CanonicalForm, precompute_queries
+
+
+class Command(BaseCommand):
+    help = 'Generate and store the queries of all canonical forms of ' \
+           'multi-word expressions, so that they do not have to be ' \
+           'generated when searching'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='also generate queries of forms that already have '
+                 'generated queries, e.g. after updating mwe-query'
+        )
+
+    def handle(self, *args, **options):
+        forms = CanonicalForm.objects.order_by('dcmid')
+        if not options['all']:
+            forms = forms.exclude(xpathquery__generated=True)
+        forms = list(forms)
+        self.stdout.write('Generating queries of {} canonical forms...'
+                          .format(len(forms)))
+        succeeded, failed = precompute_queries(forms)
+        for form in failed:
+            self.stdout.write(self.style.ERROR(
+                'Could not generate queries of {}'.format(form)
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            'Stored queries of {} canonical forms'.format(succeeded)
+        ))
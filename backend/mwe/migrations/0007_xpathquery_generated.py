@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mwe', '0006_canonicalform_dcmid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xpathquery',
+            name='generated',
+            field=models.BooleanField(default=False, help_text='Generated by precompute-mwe-queries instead of adjusted manually; replaced when generating again'),
+        ),
+    ]
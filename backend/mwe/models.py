@@ -1,4 +1,45 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple, TypedDict
+
+from mwe_query.canonicalform import generatequeries
+
+log = logging.getLogger(__name__)
+
+
+class MWEQuery(TypedDict):
+    xpath: str
+    description: str
+    rank: int
+
+
+def generate_queries(sentence: str) -> List[MWEQuery]:
+    """ Generates a set of queries using the mwe-query package.
+    (https://github.com/UUDigitalHumanitieslab/mwe-query)
+
+    This happens on the basis of an alpino parse tree and results in three
+    queries:
+    1. Multi-word expression query
+    2. "Near-miss" query
+    3. Superset query (aka major lemma query)
+
+    The superset query is special in the sense that it is executed directly on BaseX.
+    The other queries are executed against the results of the superset query.
+    This numbering scheme (1-3) is referred to as "rank" in the codebase, and reflects the idea that
+    the results of query of rank i should be included in the results of query j if j>i.
+    """
+
+    # TODO: we could maybe replace the whole rank idea with an is_superset boolean
+    generated = generatequeries(sentence)
+    assert len(generated) == 3
+    return [
+        MWEQuery(xpath=generated[0], description='Multi-word expression query', rank=1),
+        MWEQuery(xpath=generated[1], description='Near-miss query', rank=2),
+        MWEQuery(xpath=generated[2], description='Major lemma query', rank=3),
+    ]
 
 
 class CanonicalForm(models.Model):
@@ -8,6 +49,51 @@ class CanonicalForm(models.Model):
     def __str__(self):
         return self.text
 
+    def store_queries(self, queries: List[MWEQuery]) -> int:
+        """ Replace the previously generated queries of this canonical form
+        with the given ones, except for ranks that have a manually adjusted
+        query. Returns the number of stored queries. """
+        with transaction.atomic():
+            self.xpathquery_set.filter(generated=True).delete()
+            adjusted = set(self.xpathquery_set.values_list('rank', flat=True))
+            stored = XPathQuery.objects.bulk_create(
+                XPathQuery(canonical=self, generated=True, **query)
+                for query in queries if query['rank'] not in adjusted
+            )
+        return len(stored)
+
+
+def precompute_queries(forms: Iterable[CanonicalForm]) \
+        -> Tuple[int, List[CanonicalForm]]:
+    """ Generate and store the queries of the given canonical forms, so that
+    they do not have to be generated for every request. Generating the
+    queries mostly consists of waiting for Alpino to parse the canonical
+    form, so this is done concurrently for the number of forms given by the
+    MWE_QUERY_WORKERS setting. Returns the number of forms of which the
+    queries were stored and the forms for which generation failed. """
+    def generate(form):
+        try:
+            return generate_queries(form.text)
+        except Exception as err:
+            log.warning('Could not generate MWE queries for {}: {}'
+                        .format(form, err))
+            return None
+
+    forms = list(forms)
+    succeeded = 0
+    failed = []
+    if not forms:
+        return succeeded, failed
+    with ThreadPoolExecutor(settings.MWE_QUERY_WORKERS) as pool:
+        # Queries are stored as they are generated, in this thread
+        for form, queries in zip(forms, pool.map(generate, forms)):
+            if queries is None:
+                failed.append(form)
+            else:
+                form.store_queries(queries)
+                succeeded += 1
+    return succeeded, failed
+
 
 class XPathQuery(models.Model):
     class Meta:
@@ -18,3 +104,8 @@ class XPathQuery(models.Model):
     xpath = models.TextField()
     description = models.CharField(max_length=200)
     rank = models.PositiveSmallIntegerField()
+    generated = models.BooleanField(
+        default=False,
+        help_text='Generated by precompute-mwe-queries instead of adjusted '
+                  'manually; replaced when generating again'
+    )
@@ -0,0 +1,12 @@
+from celery import shared_task
+
+from .models import CanonicalForm, precompute_queries
+
+
+@shared_task
+def precompute_mwe_queries():
+    '''Generate and store the queries of canonical forms that do not have
+    generated queries yet'''
+    precompute_queries(
+        CanonicalForm.objects.exclude(xpathquery__generated=True)
+    )
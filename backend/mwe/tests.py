@@ -1,3 +1,65 @@
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+import io
+from unittest.mock import patch
+
+from .models import CanonicalForm, XPathQuery
+from .views import get_generated_queries
+
+
+def generatequeries(mwe):
+    if mwe == 'onbekend':
+        raise ValueError('cannot parse')
+    return ('//mwe[{}]'.format(mwe), '//nearmiss[{}]'.format(mwe),
+            '//superset[{}]'.format(mwe))
+
+
+@patch('mwe.models.generatequeries', side_effect=generatequeries)
+class GenerateMweQueriesTestCase(TestCase):
+    def setUp(self):
+        get_generated_queries.cache_clear()
+        self.form = CanonicalForm.objects.create(text='iemand zal de dans '
+                                                      'ontspringen')
+        CanonicalForm.objects.create(text='onbekend')
+
+    def generate(self, text):
+        response = self.client.post('/mwe/generate', {'canonical': text},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return [query['xpath'] for query in response.json()]
+
+    def test_precompute(self, mocked):
+        XPathQuery.objects.create(canonical=self.form, xpath='//adjusted',
+                                  description='Adjusted', rank=2)
+        call_command('precompute-mwe-queries', stdout=io.StringIO())
+        self.assertEqual(mocked.call_count, 2)
+        self.assertEqual(
+            sorted(self.form.xpathquery_set.values_list('xpath', 'generated')),
+            [('//adjusted', False),
+             ('//mwe[iemand zal de dans ontspringen]', True),
+             ('//superset[iemand zal de dans ontspringen]', True)]
+        )
+        # Answered from the stored queries
+        self.assertEqual(self.generate('Iemand zal de dans ontspringen'),
+                         ['//mwe[iemand zal de dans ontspringen]',
+                          '//adjusted',
+                          '//superset[iemand zal de dans ontspringen]'])
+        self.assertEqual(mocked.call_count, 2)
+        # Only forms without generated queries are generated again
+        call_command('precompute-mwe-queries', stdout=io.StringIO())
+        self.assertEqual(mocked.call_count, 3)
+        call_command('precompute-mwe-queries', '--all', stdout=io.StringIO())
+        self.assertEqual(mocked.call_count, 5)
+        self.assertEqual(self.form.xpathquery_set.count(), 3)
+
+    def test_generate_unknown(self, mocked):
+        self.assertEqual(self.generate('een nieuwe uitdrukking'),
+                         ['//mwe[een nieuwe uitdrukking]',
+                          '//nearmiss[een nieuwe uitdrukking]',
+                          '//superset[een nieuwe uitdrukking]'])
+        self.generate('een nieuwe uitdrukking')
+        self.assertEqual(mocked.call_count, 1)
+        response = self.client.post('/mwe/generate', {'canonical': 'onbekend'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 500)
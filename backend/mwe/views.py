@@ -1,14 +1,15 @@
 import logging
-from typing import List, TypedDict
+from functools import lru_cache
+from typing import Tuple
+
+from django.conf import settings
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.generics import ListAPIView
 from rest_framework.viewsets import ModelViewSet
 
-from mwe_query.canonicalform import generatequeries
-
-from .models import CanonicalForm, XPathQuery
+from .models import CanonicalForm, MWEQuery, generate_queries
 from .serializers import CanonicalFormSerializer, XPathQuerySerializer, MweQuerySerializer
 
 log = logging.getLogger(__name__)
@@ -19,59 +20,38 @@ class CanonicalFormList(ListAPIView):
     serializer_class = CanonicalFormSerializer
 
 
-class MWEQuery(TypedDict):
-    xpath: str
-    description: str
-    rank: int
-
-
-def generate_queries(sentence: str) -> List[MWEQuery]:
-    """ Generates a set of queries using the mwe-query package.
-    (https://github.com/UUDigitalHumanitieslab/mwe-query)
-
-    This happens on the basis of an alpino parse tree and results in three
-    queries:
-    1. Multi-word expression query
-    2. "Near-miss" query
-    3. Superset query (aka major lemma query)
-
-    The superset query is special in the sense that it is executed directly on BaseX.
-    The other queries are executed against the results of the superset query.
-    This numbering scheme (1-3) is referred to as "rank" in the codebase, and reflects the idea that
-    the results of query of rank i should be included in the results of query j if j>i.
-    """
-
-    # TODO: we could maybe replace the whole rank idea with an is_superset boolean
-    generated = generatequeries(sentence)
-    assert len(generated) == 3
-    return [
-        MWEQuery(xpath=generated[0], description='Multi-word expression query', rank=1),
-        MWEQuery(xpath=generated[1], description='Near-miss query', rank=2),
-        MWEQuery(xpath=generated[2], description='Major lemma query', rank=3),
-    ]
+@lru_cache(maxsize=settings.MWE_QUERY_CACHE_SIZE)
+def get_generated_queries(text: str) -> Tuple[MWEQuery, ...]:
+    """ Generated queries of a text that is not a known canonical form, or
+    whose queries have not been precomputed. Cached, because the same
+    texts are often requested repeatedly. """
+    return tuple(generate_queries(text))
 
 
 class GenerateMweQueries(APIView):
     def post(self, request, format=None):
         """ Generate XPath queries for a given canonical form of a MWE.
-        If the MWE is a known form, it may have manually adjusted stored queries.
-        Otherwise, queries are generated on-the-fly """
+        If the MWE is a known form, it may have manually adjusted or
+        precomputed stored queries. Otherwise, queries are generated
+        on-the-fly """
         text = request.data['canonical'].lower()
         canonical = CanonicalForm.objects.filter(text=text).first()
 
         queries = dict()
-        try:
-            generated = generate_queries(text)
-            # complement saved queries with newly generated ones, based on rank
-            for i in range(len(generated)):
-                queries[i] = MweQuerySerializer(generated[i]).data
-        except Exception:
-            log.exception('Could not generate MWE queries')
-            return Response('Could not generate MWE queries', status=500)
-
         if canonical:
-            # look for saved queries, replace generated with saved ones
-            for query in canonical.xpathquery_set.all():
-                queries[query.rank - 1] = XPathQuerySerializer(query).data
+            # manually adjusted queries take precedence over generated ones
+            for query in canonical.xpathquery_set.order_by('-generated'):
+                queries[query.rank] = XPathQuerySerializer(query).data
+
+        if any(rank not in queries for rank in (1, 2, 3)):
+            try:
+                generated = get_generated_queries(text)
+            except Exception:
+                log.exception('Could not generate MWE queries')
+                return Response('Could not generate MWE queries', status=500)
+            # complement saved queries with newly generated ones, based on rank
+            for query in generated:
+                if query['rank'] not in queries:
+                    queries[query['rank']] = MweQuerySerializer(query).data
 
-        return Response(queries.values())
+        return Response([queries[rank] for rank in sorted(queries)])
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParsedSentence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sentence_hash', models.CharField(help_text='SHA-256 hash of the normalized sentence', max_length=64)),
+                ('sentence', models.TextField()),
+                ('alpino_version', models.CharField(max_length=100)),
+                ('parse', models.TextField()),
+                ('last_accessed', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='parsedsentence',
+            constraint=models.UniqueConstraint(fields=('sentence_hash', 'alpino_version'), name='one_parse_per_alpino_version'),
+        ),
+    ]
@@ -0,0 +1,172 @@
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
+
+import hashlib
+import logging
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Optional, Tuple, Union
+
+from services.alpino import alpino, AlpinoError
+from services.metrics import (measure, count_parse_cache_request,
+                              ALPINO_PARSE_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+# Sentence ID given to Alpino when parsing single sentences
+SENTENCE_ID = 'zin'
+
+
+def normalize_sentence(sentence: str) -> str:
+    '''Return the sentence in Unicode normal form C with whitespace
+    collapsed, so that sentences that Alpino parses the same way are
+    cached once'''
+    return ' '.join(unicodedata.normalize('NFC', sentence).split())
+
+
+class ParsedSentence(models.Model):
+    '''Parse of a single sentence by a version of Alpino, cached to avoid
+    parsing the same (example) sentence again. The cache is limited to the
+    PARSE_CACHE_SIZE most recently used parses.'''
+    sentence_hash = models.CharField(
+        max_length=64, help_text='SHA-256 hash of the normalized sentence'
+    )
+    sentence = models.TextField()
+    alpino_version = models.CharField(max_length=100)
+    parse = models.TextField()
+    last_accessed = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sentence_hash', 'alpino_version'],
+                                    name='one_parse_per_alpino_version')
+        ]
+
+    def __str__(self):
+        return '{}… ({})'.format(self.sentence[:20], self.alpino_version)
+
+    @staticmethod
+    def get_hash(sentence: str) -> str:
+        return hashlib.sha256(sentence.encode()).hexdigest()
+
+    @classmethod
+    def lookup(cls, sentence: str, alpino_version: str) -> Optional[str]:
+        '''Return the cached parse of a normalized sentence, or None'''
+        if not settings.PARSE_CACHE_SIZE:
+            return None
+        parsed = cls.objects.filter(sentence_hash=cls.get_hash(sentence),
+                                    alpino_version=alpino_version) \
+            .values_list('id', 'parse').first()
+        count_parse_cache_request(parsed is not None)
+        if parsed is None:
+            return None
+        cls.objects.filter(id=parsed[0]).update(last_accessed=timezone.now())
+        return parsed[1]
+
+    @classmethod
+    def store(cls, sentence: str, alpino_version: str, parse: str) -> None:
+        '''Add the parse of a normalized sentence to the cache and remove
+        the least recently used parses if the cache is full'''
+        if not settings.PARSE_CACHE_SIZE:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(sentence_hash=cls.get_hash(sentence),
+                                   sentence=sentence,
+                                   alpino_version=alpino_version,
+                                   parse=parse, last_accessed=timezone.now())
+        except IntegrityError:
+            # Parsed and stored by another process in the meantime
+            return
+        cls.evict()
+
+    @classmethod
+    def evict(cls) -> int:
+        '''Remove the least recently used parses if there are more than
+        PARSE_CACHE_SIZE. A tenth of the cache is freed at once, so that
+        this does not have to be done for every new parse. Return the number
+        of removed parses.'''
+        overflow = cls.objects.count() - settings.PARSE_CACHE_SIZE
+        if overflow <= 0:
+            return 0
+        number = overflow + settings.PARSE_CACHE_SIZE // 10
+        oldest = cls.objects.order_by('last_accessed') \
+            .values_list('id', flat=True)[:number]
+        deleted, _ = cls.objects.filter(id__in=list(oldest)).delete()
+        logger.info('Removed {} parses from the parse cache'.format(deleted))
+        return deleted
+
+    @classmethod
+    def get_or_parse(cls, sentence: str) -> str:
+        '''Return the parse of a sentence from the cache, or parse it with
+        Alpino (using the client pool) and cache it. Raises AlpinoError if
+        Alpino is not available and AlpinoBusyError if all parsers are busy.
+        alpino.initialize() should be called first.'''
+        sentence = normalize_sentence(sentence)
+        version = alpino.get_cached_version()
+        parse = cls.lookup(sentence, version)
+        if parse is None:
+            with measure(ALPINO_PARSE_SECONDS, 'alpino_seconds'):
+                parse = alpino.get_client_pool().parse_line(sentence,
+                                                            SENTENCE_ID)
+            cls.store(sentence, version, parse)
+        return parse
+
+    @classmethod
+    def parse_many(cls, sentences: List[str]) \
+            -> Iterator[Tuple[int, Union[str, AlpinoError]]]:
+        '''Yield the index and the parse of every given sentence as soon as
+        it is available: cached parses first, then the parses of the other
+        sentences as they complete. These are parsed at the same time with
+        the client pool and added to the cache. The AlpinoError is given
+        instead of the parse for sentences that could not be parsed.
+        alpino.initialize() should be called first.'''
+        version = alpino.get_cached_version()
+        pool = alpino.get_client_pool()
+        # Indices of every distinct normalized sentence
+        indices = {}
+        for index, sentence in enumerate(sentences):
+            indices.setdefault(normalize_sentence(sentence), []).append(index)
+        hashes = {cls.get_hash(sentence): sentence for sentence in indices}
+        cached = {}
+        if settings.PARSE_CACHE_SIZE:
+            cached = dict(cls.objects.filter(
+                sentence_hash__in=hashes, alpino_version=version
+            ).values_list('sentence_hash', 'parse'))
+            cls.objects.filter(sentence_hash__in=cached,
+                               alpino_version=version) \
+                .update(last_accessed=timezone.now())
+        missing = []
+        for sentence_hash, sentence in hashes.items():
+            if settings.PARSE_CACHE_SIZE:
+                count_parse_cache_request(sentence_hash in cached)
+            if sentence_hash in cached:
+                for index in indices[sentence]:
+                    yield index, cached[sentence_hash]
+            else:
+                missing.append(sentence)
+
+        def parse(sentence):
+            with measure(ALPINO_PARSE_SECONDS, 'alpino_seconds'):
+                return pool.parse_line(sentence, SENTENCE_ID)
+
+        # Parses are stored in this thread, which has a database connection
+        executor = ThreadPoolExecutor(pool.size)
+        try:
+            futures = {executor.submit(parse, sentence): sentence
+                       for sentence in missing}
+            for future in as_completed(futures):
+                sentence = futures[future]
+                try:
+                    result = future.result()
+                except AlpinoError as e:
+                    result = e
+                else:
+                    cls.store(sentence, version, result)
+                for index in indices[sentence]:
+                    yield index, result
+        finally:
+            # Do not wait for parses that are no longer needed if the
+            # caller stops early
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,10 @@
 from django.test import TestCase
 
-from services.alpino import alpino, AlpinoError
+import json
+
+from services.alpino import alpino, AlpinoError, AlpinoClientPool
+from .models import ParsedSentence
+from .views import BoundedCache, marked_trees, generated_xpaths
 
 EXAMPLE_XML = '''<?xml version="1.0" encoding="UTF-8"?><alpino_ds
 version="1.6">
@@ -58,6 +62,112 @@ class ParseViewTestCase(TestCase):
             self.assertIn('error', response.json())
 
 
+class CountingAlpinoClient:
+    '''Stands in for a corpus2alpino client, counting the parsed
+    sentences'''
+    def __init__(self):
+        self.parsed = []
+
+    def parse_line(self, line, sentence_id):
+        self.parsed.append(line)
+        return '<alpino_ds version="1.6" id="{}">{}</alpino_ds>'.format(
+            sentence_id, line)
+
+
+class ParseCacheTestCase(TestCase):
+    def setUp(self):
+        for attribute in ('client', 'version', 'client_pool'):
+            self.addCleanup(setattr, alpino, attribute,
+                            getattr(alpino, attribute))
+        self.parser = CountingAlpinoClient()
+        alpino.client = self.parser
+        alpino.version = '1.6'
+        alpino.client_pool = AlpinoClientPool([lambda: self.parser], 5, 0,
+                                              5, 300)
+
+    def parse(self, sentence):
+        response = self.client.post(
+            '/parse/parse-sentence/',
+            {'sentence': sentence},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['parsed_sentence']
+
+    def test_parse_cache(self):
+        parse = self.parse('Dit is een zin.')
+        self.assertEqual(self.parse('  Dit is\teen zin. '), parse)
+        self.assertEqual(self.parser.parsed, ['Dit is een zin.'])
+        # Parses of other Alpino versions are not used
+        alpino.version = '1.7'
+        self.parse('Dit is een zin.')
+        self.assertEqual(len(self.parser.parsed), 2)
+        with self.settings(PARSE_CACHE_SIZE=0):
+            self.parse('Dit is een zin.')
+            self.assertEqual(len(self.parser.parsed), 3)
+
+    def test_eviction(self):
+        with self.settings(PARSE_CACHE_SIZE=10):
+            for number in range(10):
+                self.parse('Zin {}.'.format(number))
+            # Use the first sentence, so that it is not removed
+            self.parse('Zin 0.')
+            self.assertEqual(len(self.parser.parsed), 10)
+            self.parse('Zin 10.')
+            self.assertEqual(
+                sorted(ParsedSentence.objects.values_list('sentence',
+                                                          flat=True)),
+                ['Zin 0.', 'Zin 10.'] +
+                ['Zin {}.'.format(number) for number in range(3, 10)]
+            )
+
+    def parse_many(self, sentences):
+        response = self.client.post(
+            '/parse/parse-sentences/',
+            {'sentences': sentences},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line)
+                for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_parse_sentences(self):
+        self.parse('Zin 1.')
+        lines = self.parse_many(['Zin 1.', 'Zin 2.', 'Zin  2.', 'Zin 3.'])
+        # The cached parse is returned first
+        self.assertEqual(lines[0]['index'], 0)
+        self.assertEqual(sorted(line['index'] for line in lines),
+                         [0, 1, 2, 3])
+        parses = {line['index']: line['parsed_sentence'] for line in lines}
+        self.assertEqual(parses[1], parses[2])
+        self.assertIn('Zin 3.', parses[3])
+        self.assertEqual(sorted(self.parser.parsed),
+                         ['Zin 1.', 'Zin 2.', 'Zin 3.'])
+        self.assertEqual(ParsedSentence.objects.count(), 3)
+
+        with self.settings(PARSE_BATCH_MAXIMUM=2):
+            response = self.client.post(
+                '/parse/parse-sentences/',
+                {'sentences': ['Zin 1.', 'Zin 2.', 'Zin 3.']},
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/parse/parse-sentences/', {'sentences': 'Zin 1.'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_parse_sentences_error(self):
+        def fail(line, sentence_id):
+            raise AlpinoError('cannot parse')
+        self.parser.parse_line = fail
+        lines = self.parse_many(['Zin 1.'])
+        self.assertEqual(lines, [{'index': 0,
+                                  'error': 'Parsing error: cannot parse'}])
+        self.assertEqual(ParsedSentence.objects.count(), 0)
+
+
 class GenerateXPathViewTestCase(TestCase):
     def test_xpath_view(self):
         request_data = {
@@ -81,3 +191,62 @@ class GenerateXPathViewTestCase(TestCase):
             content_type='application/json'
         )
         self.assertEqual(response.status_code, 500)
+
+    def test_xpath_cache(self):
+        marked_trees.clear()
+        generated_xpaths.clear()
+        request_data = {
+            'xml': EXAMPLE_XML,
+            'tokens': ['Dit', 'is', 'een', 'voorbeeldzin', '.'],
+            'attributes': ['pos', 'pos', 'pos,lemma', 'pos', 'pos'],
+            'ignoreTopNode': False,
+            'respectOrder': False
+        }
+
+        def post():
+            response = self.client.post(
+                '/parse/generate-xpath/',
+                request_data,
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+            return response.json()
+
+        first = post()
+        self.assertEqual(post(), first)
+        self.assertEqual(generated_xpaths.hits, 1)
+        # The marked tree is reused when changing the other options
+        request_data['ignoreTopNode'] = True
+        post()
+        self.assertEqual(marked_trees.hits, 2)
+        self.assertEqual(marked_trees.misses, 1)
+        # Differences in formatting and in the order of attributes do not
+        # matter
+        request_data['ignoreTopNode'] = False
+        request_data['xml'] = EXAMPLE_XML.replace('  ', ' ') \
+            .replace('begin="0" cat="top"', 'cat="top" begin="0"')
+        request_data['attributes'][2] = 'lemma,pos,lemma'
+        self.assertEqual(post()['xpath'], first['xpath'])
+        self.assertEqual(generated_xpaths.hits, 2)
+        self.assertEqual(marked_trees.misses, 1)
+
+        request_data['tokens'] = 'Dit is een voorbeeldzin .'
+        response = self.client.post(
+            '/parse/generate-xpath/',
+            request_data,
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_bounded_cache(self):
+        cache = BoundedCache(10, size=len)
+        cache.put('a', 'aaaa')
+        cache.put('b', 'bbbb')
+        self.assertEqual(cache.get('a'), 'aaaa')
+        cache.put('c', 'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'aaaa')
+        self.assertEqual(cache.total_size, 8)
+        # Values larger than the cache are not stored
+        cache.put('d', 'd' * 11)
+        self.assertIsNone(cache.get('d'))
@@ -1,8 +1,11 @@
 from django.urls import path
 
-from .views import parse_view, generate_xpath_view
+from .views import (
+    parse_view, parse_sentences_view, generate_xpath_view
+)
 
 urlpatterns = [
     path('parse-sentence/', parse_view, name='parse-sentence'),
+    path('parse-sentences/', parse_sentences_view, name='parse-sentences'),
     path('generate-xpath/', generate_xpath_view, name='generate-xpath'),
 ]
@@ -7,10 +7,20 @@ from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.authentication import BasicAuthentication
 from rest_framework import status
 
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from typing import List, Tuple
 from lxml import etree
 from alpino_query import AlpinoQuery
 
-from services.alpino import alpino, AlpinoError
+from services.alpino import alpino, AlpinoError, AlpinoBusyError
+from .models import ParsedSentence
 
 
 @api_view(['POST'])
@@ -29,7 +39,12 @@ def parse_view(request):
 
     try:
         alpino.initialize()
-        parsed_sentence = alpino.client.parse_line(sentence, 'zin')
+        parsed_sentence = ParsedSentence.get_or_parse(sentence)
+    except AlpinoBusyError as err:
+        return Response(
+            {'error': 'Parser is busy: {}'.format(err)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
     except AlpinoError as err:
         return Response(
             {'error': 'Parsing error: {}'.format(err)},
@@ -38,6 +53,60 @@ def parse_view(request):
     return Response({'parsed_sentence': parsed_sentence})
 
 
+@api_view(['POST'])
+@authentication_classes([BasicAuthentication])
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer])
+@parser_classes([JSONParser])
+def parse_sentences_view(request):
+    '''Parse a list of sentences. The parses are streamed as JSON lines
+    in the order in which they become available, each having the index of
+    the sentence and either the parsed sentence or an error.'''
+    data = request.data
+    try:
+        sentences = data['sentences']
+    except KeyError as err:
+        return Response(
+            {'error': '{} is missing'.format(err)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not isinstance(sentences, list) or \
+            not all(isinstance(sentence, str) for sentence in sentences):
+        return Response(
+            {'error': 'sentences should be a list of strings'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(sentences) > settings.PARSE_BATCH_MAXIMUM:
+        return Response(
+            {'error': 'at most {} sentences can be parsed at once'
+                      .format(settings.PARSE_BATCH_MAXIMUM)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        alpino.initialize()
+        alpino.get_cached_version()
+        alpino.get_client_pool()
+    except AlpinoError as err:
+        return Response(
+            {'error': 'Parsing error: {}'.format(err)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    def stream():
+        for index, result in ParsedSentence.parse_many(sentences):
+            if isinstance(result, AlpinoBusyError):
+                line = {'index': index,
+                        'error': 'Parser is busy: {}'.format(result)}
+            elif isinstance(result, AlpinoError):
+                line = {'index': index,
+                        'error': 'Parsing error: {}'.format(result)}
+            else:
+                line = {'index': index, 'parsed_sentence': result}
+            yield json.dumps(line) + '\n'
+    return StreamingHttpResponse(stream(),
+                                 content_type='application/x-ndjson')
+
+
 @api_view(['POST'])
 @authentication_classes([BasicAuthentication])
 @renderer_classes([JSONRenderer, BrowsableAPIRenderer])
@@ -57,17 +126,21 @@ def generate_xpath_view(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    if ignore_top_node:
-        remove = ['rel', 'cat']
-    else:
-        remove = ['rel']
+    if not isinstance(xml, str) or \
+            not isinstance(tokens, list) or \
+            not isinstance(attributes, list) or \
+            not all(isinstance(x, str) for x in tokens + attributes):
+        return Response(
+            {'error': 'xml should be a string and tokens and attributes '
+                      'should be lists of strings'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
     try:
-        query = AlpinoQuery()
-        query.mark(xml, tokens, attributes)
-        marked_tree = query.marked_xml
-        query.generate_subtree([remove])
-        sub_tree = query.subtree_xml
-        xpath = query.generate_xpath(respect_order)
+        xpath, marked_tree, sub_tree = generate_xpath(
+            xml, tokens, attributes, bool(ignore_top_node),
+            bool(respect_order)
+        )
     except etree.XMLSyntaxError as err:
         return Response(
             {'error': 'syntax error in input XML: {}'.format(err)},
@@ -80,3 +153,121 @@ def generate_xpath_view(request):
         'subTree': sub_tree
     }
     return Response(response)
+
+
+class BoundedCache:
+    '''Thread-safe cache that removes the least recently used values when
+    the total size of the values exceeds the maximum size. The size of a
+    value is given by the size function, which counts values by default.'''
+
+    def __init__(self, maximum_size: int, size=lambda value: 1):
+        self.maximum_size = maximum_size
+        self.size = size
+        self.total_size = 0
+        self.hits = self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._values.move_to_end(key)
+            return value
+
+    def put(self, key: str, value) -> None:
+        size = self.size(value)
+        if size > self.maximum_size:
+            return
+        with self._lock:
+            if key in self._values:
+                self.total_size -= self.size(self._values.pop(key))
+            self._values[key] = value
+            self.total_size += size
+            while self.total_size > self.maximum_size:
+                _, removed = self._values.popitem(last=False)
+                self.total_size -= self.size(removed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self.total_size = 0
+            self.hits = self.misses = 0
+
+
+# Marked trees (as element and as XML) by hash of the canonical input, and
+# generated XPath queries and subtrees by hash of the canonical input and
+# options. Marked trees are limited by the size of their XML.
+marked_trees = BoundedCache(settings.MARKED_TREE_CACHE_SIZE * 1024 * 1024,
+                            size=lambda value: len(value[1]))
+generated_xpaths = BoundedCache(settings.XPATH_CACHE_SIZE)
+
+
+def canonicalize_xml(xml: str) -> str:
+    '''Return the canonical form (C14N) of an XML document without
+    whitespace between elements, so that documents that only differ in
+    formatting or in the order of attributes are the same. Raises
+    XMLSyntaxError if the XML is invalid.'''
+    parser = etree.XMLParser(remove_blank_text=True)
+    root = etree.fromstring(xml.encode('utf-8'), parser)
+    return etree.tostring(root, method='c14n').decode('utf-8')
+
+
+def canonicalize_attributes(attributes: str) -> str:
+    '''Return the comma-separated attributes of a token sorted and without
+    duplicates. Only the last of the (conflicting) cs and -cs options has
+    an effect, so it is kept at the end.'''
+    attributes = attributes.split(',')
+    case_sensitivity = [x for x in attributes if x in ('cs', '-cs')]
+    canonical = sorted(set(x for x in attributes if x not in ('cs', '-cs')))
+    return ','.join(canonical + case_sensitivity[-1:])
+
+
+def mark_tree(xml: str, tokens: List[str], attributes: List[str]) \
+        -> Tuple[str, Tuple[etree._Element, str]]:
+    '''Return the hash of the canonical input and the tree in which the
+    given attributes of the tokens are marked, as element and as XML.
+    Results are cached, because the same tree is marked again whenever a
+    user changes one of the other options of example-based search.'''
+    xml = canonicalize_xml(xml)
+    # Attributes of tokens beyond the last token are not used
+    attributes = [canonicalize_attributes(x)
+                  for x in attributes[:len(tokens)]]
+    key = hashlib.sha256(
+        json.dumps([xml, tokens, attributes]).encode('utf-8')
+    ).hexdigest()
+    marked = marked_trees.get(key)
+    if marked is None:
+        query = AlpinoQuery()
+        query.mark(xml, tokens, attributes)
+        marked = (query.marked, query.marked_xml)
+        marked_trees.put(key, marked)
+    return key, marked
+
+
+def generate_xpath(xml: str, tokens: List[str], attributes: List[str],
+                   ignore_top_node: bool,
+                   respect_order: bool) -> Tuple[str, str, str]:
+    '''Return the XPath query, the marked tree and the subtree of an
+    example-based search. Results are cached, because users often switch
+    between the same options. Raises XMLSyntaxError if the XML is
+    invalid.'''
+    key, (marked, marked_xml) = mark_tree(xml, tokens, attributes)
+    key += ':{:d}{:d}'.format(ignore_top_node, respect_order)
+    generated = generated_xpaths.get(key)
+    if generated is None:
+        if ignore_top_node:
+            remove = ['rel', 'cat']
+        else:
+            remove = ['rel']
+        query = AlpinoQuery()
+        # Generating the subtree changes the marked tree
+        query.marked = deepcopy(marked)
+        query.generate_subtree([remove])
+        generated = (query.generate_xpath(respect_order), query.subtree_xml)
+        generated_xpaths.put(key, generated)
+    xpath, sub_tree = generated
+    return xpath, marked_xml, sub_tree
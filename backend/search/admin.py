@@ -4,7 +4,7 @@ from django.utils import formats
 
 import pprint
 
-from .models import ComponentSearchResult, SearchQuery, SearchError
+from .models import ComponentSearchResult, SearchQuery, SearchError, SlowQuery
 
 
 @admin.action(description='Perform search')
@@ -52,7 +52,7 @@ def perform_count(modeladmin, request, queryset):
 @admin.register(SearchQuery)
 class SearchQueryAdmin(admin.ModelAdmin):
     list_display = ['id', 'xpath', 'query_of', 'total_database_size']
-    readonly_fields = ['total_database_size']
+    readonly_fields = ['total_database_size', 'estimates', 'metrics']
     actions = [perform_count]
 
     def query_of(self, obj):
@@ -67,3 +67,35 @@ class ComponentSearchResultAdmin(admin.ModelAdmin):
     readonly_fields = ['search_completed', 'last_accessed',
                        'number_of_results', 'errors', 'completed_part',
                        'cache_size']
+
+
+@admin.action(description='Replay query')
+def replay_query(modeladmin, request, queryset):
+    '''Admin action to execute slow queries again to see if they are still
+    slow'''
+    for slow_query in queryset:
+        try:
+            duration, number_of_results = slow_query.replay()
+        except OSError as err:
+            modeladmin.message_user(request,
+                                    'Could not replay {}: {}'
+                                    .format(slow_query, err),
+                                    messages.ERROR)
+            continue
+        modeladmin.message_user(request,
+                                '{}: {:.2f} s now, {} results'
+                                .format(slow_query, duration,
+                                        number_of_results))
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ['xpath', 'database', 'query_type', 'duration',
+                    'number_of_results', 'executed']
+    list_filter = ['query_type', 'executed']
+    search_fields = ['xpath', 'database']
+    # The most expensive queries first
+    ordering = ['-duration']
+    readonly_fields = ['xpath', 'database', 'query_type', 'duration',
+                       'number_of_results', 'query_plan', 'executed']
+    actions = [replay_query]
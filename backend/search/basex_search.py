@@ -3,7 +3,7 @@
 import lxml.etree
 import string
 from io import StringIO
-from typing import List
+from typing import List, Tuple
 
 from .types import BaseXMatch, Result
 
@@ -81,6 +81,18 @@ def generate_xquery_for_variables(variables=None):
     return let_fragment, return_fragment
 
 
+def generate_xquery_path(basex_db: str, xpath: str) -> str:
+    """Return the path expression selecting the nodes of an XPath query in
+    a BaseX database. Queries for descendants (starting with //) are applied
+    to the database itself instead of its treebank element, since all nodes
+    are below it anyway: for such paths BaseX rewrites equality predicates
+    on attributes and text to lookups in the attribute and text indexes (see
+    BASEX_DATABASE_OPTIONS) instead of scanning the database."""
+    if xpath.startswith('//'):
+        return 'db:open("{}"){}'.format(basex_db, xpath)
+    return 'db:open("{}")/treebank{}'.format(basex_db, xpath)
+
+
 def generate_xquery_search(basex_db: str, xpath: str, variables=None) -> str:
     """Return XQuery string for use in BaseX to get all occurances
     of a given XPath in XML format in a given BaseX database."""
@@ -88,8 +100,7 @@ def generate_xquery_search(basex_db: str, xpath: str, variables=None) -> str:
         raise ValueError('Incorrect database or malformed XPath given')
     variables_let_fragment, variables_return_fragment = \
         generate_xquery_for_variables(variables)
-    query = 'for $node in db:open("' + basex_db + '")/treebank' \
-            + xpath + \
+    query = 'for $node in ' + generate_xquery_path(basex_db, xpath) + \
             ' let $tree := ($node/ancestor::alpino_ds)' \
             ' let $sentid := ($tree/@id)' \
             ' let $sentence := ($tree/sentence)' \
@@ -115,8 +126,7 @@ def generate_xquery_count(basex_db: str, xpath: str) -> str:
     occurances of a given XPath in a given BaseX database."""
     if not check_db_name(basex_db) or not check_xpath(xpath):
         raise ValueError('Incorrect database or malformed XPath given')
-    return 'count(db:open("{}")/treebank{})' \
-        .format(basex_db, xpath)
+    return 'count({})'.format(generate_xquery_path(basex_db, xpath))
 
 
 def generate_xquery_metadata_count(basex_db: str, xpath: str) -> str:
@@ -154,13 +164,44 @@ def generate_xquery_showtree(basex_db: str, sentence_id: str) -> str:
         sentence_id + '"]'
 
 
+def generate_xquery_showtree_at(basex_db: str, pre: int,
+                                sentence_id: str) -> str:
+    '''Return XQuery to directly get a sentence of which the position
+    (pre value) in the database is known. The result is empty if the node at
+    that position is not the sentence with the given ID.'''
+    if not check_db_name(basex_db) or '"' in sentence_id:
+        raise ValueError('Incorrect database or malformed sentence ID given')
+    return 'db:open-pre("{}", {:d})[self::alpino_ds][@id="{}"]' \
+        .format(basex_db, pre, sentence_id)
+
+
+def generate_xquery_sentence_positions(basex_db: str) -> str:
+    '''Return XQuery to get the position (pre value) and ID of every
+    sentence in a database. Every item of the result is a string
+    consisting of the pre value, a space and the ID.'''
+    if not check_db_name(basex_db):
+        raise ValueError('Incorrect database name given')
+    return 'for $s in db:open("{}")/treebank/alpino_ds ' \
+           'return concat(db:node-pre($s), " ", $s/@id)'.format(basex_db)
+
+
+def generate_xquery_sentences(basex_db: str) -> str:
+    '''Return XQuery to get all sentences (alpino_ds elements) of a
+    database in document order'''
+    if not check_db_name(basex_db):
+        raise ValueError('Incorrect database name given')
+    return 'db:open("{}")/treebank/alpino_ds'.format(basex_db)
+
+
 def generate_xquery_count_words(basex_db: str) -> str:
     '''Return XQuery to get number of words in a database, calculated on
     the basis of the attribute @end in every top node (i.e. every sentence)'''
     if not check_db_name(basex_db):
         raise ValueError('Incorrect database or malformed sentence ID given')
-    return 'sum(db:open("{}")//node[@cat="top"] ! ' \
-           'data(@end))'.format(basex_db)
+    # Top nodes are always direct children of alpino_ds, so use a path
+    # without descendant steps that does not need to scan all nodes
+    return 'sum(db:open("{}")/treebank/alpino_ds/node[@cat="top"]' \
+           '/xs:integer(@end))'.format(basex_db)
 
 
 def generate_xquery_count_sentences(basex_db: str) -> str:
@@ -168,7 +209,48 @@ def generate_xquery_count_sentences(basex_db: str) -> str:
     the total number of top nodes (i.e. sentences)'''
     if not check_db_name(basex_db):
         raise ValueError('Incorrect database or malformed sentence ID given')
-    return 'count(db:open("{}")//node[@cat="top"])'.format(basex_db)
+    return 'count(db:open("{}")/treebank/alpino_ds/node[@cat="top"])' \
+        .format(basex_db)
+
+
+def generate_xquery_database_statistics(basex_db: str) -> str:
+    '''Return XQuery to get the size in bytes, the number of sentences and
+    the number of words of a database at once, separated by spaces, so that
+    the database only has to be scanned once'''
+    if not check_db_name(basex_db):
+        raise ValueError('Incorrect database name given')
+    return 'let $top := db:open("{0}")/treebank/alpino_ds/node[@cat="top"]' \
+        ' return concat(db:property("{0}", "size"), " ", count($top), " ",' \
+        ' sum($top/xs:integer(@end)))'.format(basex_db)
+
+
+def generate_xquery_attribute_counts(basex_db: str,
+                                     attributes: List[str]) -> str:
+    '''Return XQuery to get, for every value of the given attributes,
+    the number of nodes in a database having that value. Every item of the
+    result is a <count> element (see parse_attribute_count).'''
+    if not check_db_name(basex_db):
+        raise ValueError('Incorrect database name given')
+    if not all(x in ALLOWED_VARNAME_CHARS for x in ''.join(attributes)):
+        raise ValueError('Incorrect attribute name given')
+    attributes_path = '|'.join('@' + attribute for attribute in attributes)
+    return 'for $a in db:open("{}")/treebank//node/({}) ' \
+           'let $n := name($a) let $v := string($a) ' \
+           'group by $n, $v ' \
+           'return <count attribute="{{$n}}" value="{{$v}}">' \
+           '{{count($a)}}</count>'.format(basex_db, attributes_path)
+
+
+def parse_attribute_count(result_str: str) -> Tuple[str, str, int]:
+    '''Parse one item of the result of the XQuery generated by
+    generate_xquery_attribute_counts and return a tuple of the
+    attribute name, the value and the number of nodes.'''
+    try:
+        element = lxml.etree.fromstring(result_str)
+        return (element.get('attribute'), element.get('value'),
+                int(element.text))
+    except (lxml.etree.XMLSyntaxError, TypeError, ValueError) as err:
+        raise ValueError('Cannot parse attribute count: {}'.format(err))
 
 
 def generate_xquery_get_version(basex_db: str) -> str:
@@ -178,6 +260,15 @@ def generate_xquery_get_version(basex_db: str) -> str:
         .format(basex_db)
 
 
+def generate_xquery_plan(xquery: str) -> str:
+    """Generate an XQuery returning the query plan of the given XQuery
+    after compilation (which shows e.g. whether indexes are used), without
+    evaluating it."""
+    literal = xquery.replace('&', '&amp;').replace('"', '&quot;')
+    return 'xquery:parse("{}", map {{ "compile": true(), "plan": true() }})' \
+        .format(literal)
+
+
 def parse_search_result(result_str: str, component) -> List[Result]:
     """Parse the results returned by BaseX according to the searching
     XQuery generated by generate_xquery_search.
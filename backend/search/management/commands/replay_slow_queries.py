@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max
+
+import statistics
+
+from search.models import SlowQuery
+
+
+class Command(BaseCommand):
+    help = 'Execute the slowest queries in the slow query log again as ' \
+           'a benchmark, and compare their execution times with the ' \
+           'logged times'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help='number of queries to replay (default: 10)'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='number of times every query is executed (default: 3)'
+        )
+        parser.add_argument(
+            '--type', choices=['search', 'count'], dest='query_type',
+            help='only replay searches or counts'
+        )
+        parser.add_argument(
+            '--database', help='only replay queries in this database'
+        )
+
+    def handle(self, *args, **options):
+        if options['top'] < 1 or options['repeat'] < 1:
+            raise CommandError('--top and --repeat should be positive')
+        queries = SlowQuery.objects.all()
+        if options['query_type']:
+            queries = queries.filter(query_type=options['query_type'])
+        if options['database']:
+            queries = queries.filter(database=options['database'])
+        # The same query may have been logged multiple times
+        slowest = queries.values('xpath', 'database', 'query_type') \
+            .annotate(logged=Max('duration'), times=Count('id')) \
+            .order_by('-logged')[:options['top']]
+        if not slowest:
+            self.stdout.write(self.style.WARNING('No slow queries logged'))
+            return
+        logged_total = replayed_total = 0
+        for number, logged in enumerate(slowest, 1):
+            query = SlowQuery(xpath=logged['xpath'],
+                              database=logged['database'],
+                              query_type=logged['query_type'])
+            durations = []
+            try:
+                for _ in range(options['repeat']):
+                    duration, number_of_results = query.replay()
+                    durations.append(duration)
+            except OSError as err:
+                self.stdout.write(self.style.ERROR(
+                    '{}. {}: {}'.format(number, query.xpath, err)
+                ))
+                continue
+            median = statistics.median(durations)
+            logged_total += logged['logged']
+            replayed_total += median
+            self.stdout.write(
+                '{}. {} of {} in {} (logged {} times)\n'
+                '   logged: {:.2f} s, now: median {:.2f} s, '
+                'min {:.2f} s, max {:.2f} s, {} results'
+                .format(number, query.query_type, query.xpath,
+                        query.database, logged['times'], logged['logged'],
+                        median, min(durations), max(durations),
+                        number_of_results)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Total of medians: {:.2f} s (logged: {:.2f} s)'
+            .format(replayed_total, logged_total)
+        ))
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0005_remove_componentsearchresult_results_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchquery',
+            name='continue_search',
+            field=models.BooleanField(default=False, help_text='True if an exhaustive search should be performed in the background after estimating the number of results'),
+        ),
+        migrations.AddField(
+            model_name='searchquery',
+            name='estimates',
+            field=models.JSONField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='searchquery',
+            name='sample_fraction',
+            field=models.FloatField(blank=True, help_text='Fraction of the databases of every component that is searched to estimate the number of results, or empty for an exhaustive search', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0006_searchquery_sampling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchquery',
+            name='metrics',
+            field=models.JSONField(editable=False, help_text='Totals of the measurements made while searching and while retrieving results (see services.metrics)', null=True),
+        ),
+    ]
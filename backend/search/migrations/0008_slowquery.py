@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0007_searchquery_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('xpath', models.TextField()),
+                ('database', models.CharField(max_length=200)),
+                ('query_type', models.CharField(choices=[('search', 'Search'), ('count', 'Count')], max_length=10)),
+                ('duration', models.FloatField(help_text='Execution time in seconds')),
+                ('number_of_results', models.PositiveIntegerField(help_text='Number of results counted or read before the search was stopped', null=True)),
+                ('query_plan', models.TextField(blank=True, help_text='Compiled query plan reported by BaseX')),
+                ('executed', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-duration'], name='slowquery_duration')],
+            },
+        ),
+    ]
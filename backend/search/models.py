@@ -10,15 +10,25 @@ import logging
 import os
 import pathlib
 import re
+import time
 from datetime import timedelta
-from typing import List, Tuple, Iterable, Optional, Set
+from typing import Dict, List, Tuple, Iterable, Optional, Set
 from lxml import etree
 
 from treebanks.models import Component
 from services.basex import basex
+from services.metrics import (
+    Recorder, recording, measure, count_cache_requests, observe_search,
+    CACHE_READ_SECONDS, CACHE_PARSE_SECONDS, FILTER_SECONDS
+)
 from .basex_search import (generate_xquery_search,
                            parse_search_result,
-                           generate_xquery_count)
+                           generate_xquery_count,
+                           generate_xquery_plan)
+from .xpath_analysis import (get_mandatory_attribute_values,
+                             get_attribute_conditions)
+from .sampling import (choose_sample, estimate_count, combine_estimates,
+                       get_exact_estimate)
 from .types import ResultSet, Result, ResultSetFilter
 
 logger = logging.getLogger(__name__)
@@ -28,6 +38,26 @@ class SearchError(RuntimeError):
     pass
 
 
+def get_known_counts(component: Component, xpath: str) -> Dict[str, int]:
+    '''Return a dictionary of the databases of a component (keys) for which
+    the number of matches of the XPath can be derived from the stored
+    attribute counts, without querying BaseX, and these numbers (values).
+    This is only possible if the XPath matches single nodes with a condition
+    on one attribute value; for conjunctions of conditions only the databases
+    without matches are known.'''
+    conditions = get_attribute_conditions(xpath)
+    if conditions is None:
+        return {}
+    if len(conditions) == 1:
+        attribute, value = conditions[0]
+        return component.get_attribute_counts(attribute, value)
+    known_counts = {}
+    for attribute, value in conditions:
+        counts = component.get_attribute_counts(attribute, value)
+        known_counts.update({db: 0 for db in counts if counts[db] == 0})
+    return known_counts
+
+
 class ComponentSearchResult(models.Model):
     xpath = models.TextField()
     component = models.ForeignKey(Component, on_delete=models.CASCADE)
@@ -70,14 +100,16 @@ class ComponentSearchResult(models.Model):
 
     def get_results(self) -> ResultSet:
         """Return results as a dict"""
-        results = self._get_cache_path().read_text()
+        with measure(CACHE_READ_SECONDS, 'cache_read_seconds'):
+            results = self._get_cache_path().read_text()
         self.last_accessed = timezone.now()
         # This method may be called from multiple processes while the query is still
         # running. If we save the entire model, we will overwrite the progress
         # that other processes may have saved (e.g. search_completed) in case our copy
         # of the model was not refreshed in the meantime.
         self.save(update_fields=['last_accessed'])
-        return parse_search_result(results, self.component.slug)
+        with measure(CACHE_PARSE_SECONDS, 'cache_parse_seconds'):
+            return parse_search_result(results, self.component.slug)
 
     def get_completed_part(self) -> Optional[int]:
         if self.check_results():
@@ -97,6 +129,32 @@ class ComponentSearchResult(models.Model):
             'cancelled', flat=True
         ).get(id=query_id)
 
+    def _get_databases_without_matches(self) -> Set[str]:
+        """Return the names of the databases of the component that cannot
+        contain any matches, because an attribute value that every match
+        should have does not occur in them according to the stored
+        attribute counts."""
+        databases = set()
+        for attribute, value in get_mandatory_attribute_values(self.xpath):
+            counts = self.component.get_attribute_counts(attribute, value)
+            databases.update(db for db in counts if counts[db] == 0)
+        return databases
+
+    def _count_in_database(self, database: str) -> int:
+        """Count the matches in a database using BaseX. Errors are added
+        to the errors attribute."""
+        query = generate_xquery_count(database, self.xpath)
+        start = time.perf_counter()
+        try:
+            count = int(basex.perform_query(query, database, 'count'))
+        except (OSError, UnicodeDecodeError, ValueError) as err:
+            self.errors += 'Error searching database {}: ' \
+                .format(database) + str(err) + '\n'
+            return 0
+        SlowQuery.record(self.xpath, database, 'count',
+                         time.perf_counter() - start, count)
+        return count
+
     def perform_search(self, query_id=None):
         """Perform full component search and regularly update database
         with the progress so far. Saves the object if it has no value
@@ -106,8 +164,13 @@ class ComponentSearchResult(models.Model):
         if not self.id:
             # Save, because we need the id for the caching file
             self.save()
+        start = time.perf_counter()
         # Get BaseX databases belonging to component
         databases_with_size = self.component.get_databases()
+        databases_without_matches = self._get_databases_without_matches()
+        # Counts that can be determined without BaseX once the maximum
+        # number of results has been reached
+        known_counts = get_known_counts(self.component, self.xpath)
         # Initialize variables
         self.results = ''
         self.errors = ''
@@ -125,6 +188,10 @@ class ComponentSearchResult(models.Model):
                 # Go through all BaseX databases
                 for database in databases_with_size:
                     size = databases_with_size[database]
+                    if database in databases_without_matches:
+                        # No need to bother BaseX
+                        self.completed_part += size
+                        continue
                     # Check how many results we can still add to the cache file,
                     # respecting the maximum number of results per component
                     maximum_to_add = \
@@ -132,11 +199,14 @@ class ComponentSearchResult(models.Model):
                         self.number_of_results
                     if maximum_to_add > 0:
                         # We can still add, so perform a search on this database
+                        search_start = time.perf_counter()
                         try:
                             query = generate_xquery_search(
                                 database, self.xpath
                             )
-                            result = basex.perform_query_iter(query)
+                            result = basex.perform_query_iter(
+                                query, database, 'search'
+                            )
                         except (OSError, UnicodeDecodeError, ValueError) as err:
                             self.errors += 'Error searching database {}: ' \
                                 .format(database) + str(err) + '\n'
@@ -155,18 +225,18 @@ class ComponentSearchResult(models.Model):
 
                         if not did_break:
                             self.number_of_results += results_for_database
+                        SlowQuery.record(self.xpath, database, 'search',
+                                         time.perf_counter() - search_start,
+                                         results_for_database)
 
                     if maximum_to_add <= 0 or did_break:
                         # The maximum number of results per component has been
                         # reached. From now on only count the number of results,
                         # which is somewhat faster
-                        query = generate_xquery_count(database, self.xpath)
-                        try:
-                            count = int(basex.perform_query(query))
-                        except (OSError, UnicodeDecodeError, ValueError) as err:
-                            self.errors += 'Error searching database {}: ' \
-                                .format(database) + str(err) + '\n'
-                            count = 0
+                        if database in known_counts:
+                            count = known_counts[database]
+                        else:
+                            count = self._count_in_database(database)
                         self.number_of_results += count
                     self.completed_part += size
                     self.save()
@@ -178,6 +248,7 @@ class ComponentSearchResult(models.Model):
                 self.search_completed = timezone.now()
         except Exception as err:
             self.errors += f'Error searching: ${err}\n'
+        observe_search(self.number_of_results, time.perf_counter() - start)
         self.last_accessed = timezone.now()
         self.save()
 
@@ -204,6 +275,18 @@ class ComponentSearchResult(models.Model):
             count += 1
         return count
 
+    @classmethod
+    def invalidate(cls, components: Iterable[Component]) -> int:
+        '''Delete the CSR objects of the given components, e.g. because
+        databases of these components have been added or replaced, so that
+        their results will be searched again. Return number of CSR objects
+        that were deleted.'''
+        count = 0
+        for csr in cls.objects.filter(component__in=components):
+            csr.delete()
+            count += 1
+        return count
+
     @classmethod
     def purge_cache(cls):
         yesterday = timezone.now() - timedelta(days=1)
@@ -253,6 +336,78 @@ def delete_basex_db_callback(sender, instance, using, **kwargs):
     instance.delete_cache_file()
 
 
+class SlowQuery(models.Model):
+    '''A search or count of an XPath in a BaseX database that took longer
+    than the SLOW_QUERY_THRESHOLD setting, recorded to find out which
+    queries make BaseX slow (see the replay_slow_queries command).'''
+    QUERY_TYPES = [('search', 'Search'), ('count', 'Count')]
+
+    xpath = models.TextField()
+    database = models.CharField(max_length=200)
+    query_type = models.CharField(max_length=10, choices=QUERY_TYPES)
+    duration = models.FloatField(help_text='Execution time in seconds')
+    number_of_results = models.PositiveIntegerField(
+        null=True,
+        help_text='Number of results counted or read before the search '
+                  'was stopped'
+    )
+    query_plan = models.TextField(
+        blank=True, help_text='Compiled query plan reported by BaseX'
+    )
+    executed = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-duration'], name='slowquery_duration')
+        ]
+
+    def __str__(self):
+        return '"{}…" in {} ({:.1f} s)'.format(self.xpath[:10],
+                                               self.database, self.duration)
+
+    def get_xquery(self) -> str:
+        if self.query_type == 'count':
+            return generate_xquery_count(self.database, self.xpath)
+        return generate_xquery_search(self.database, self.xpath)
+
+    def replay(self) -> Tuple[float, int]:
+        '''Execute the query again, reading all results, and return the
+        execution time in seconds and the number of results. Raises
+        OSError in case of BaseX errors.'''
+        start = time.perf_counter()
+        if self.query_type == 'count':
+            number_of_results = int(basex.perform_query(
+                self.get_xquery(), self.database, 'replay'
+            ))
+        else:
+            number_of_results = sum(1 for _ in basex.perform_query_iter(
+                self.get_xquery(), self.database, 'replay'
+            ))
+        return time.perf_counter() - start, number_of_results
+
+    @classmethod
+    def record(cls, xpath: str, database: str, query_type: str,
+               duration: float,
+               number_of_results: Optional[int]) -> Optional['SlowQuery']:
+        '''Record a query and its query plan if it took longer than the
+        SLOW_QUERY_THRESHOLD setting, and return the new object'''
+        threshold = settings.SLOW_QUERY_THRESHOLD
+        if threshold is None or duration < threshold:
+            return None
+        query = cls(xpath=xpath, database=database, query_type=query_type,
+                    duration=duration, number_of_results=number_of_results)
+        logger.warning('Slow {} in database {} ({:.1f} s): {}'
+                       .format(query_type, database, duration, xpath))
+        try:
+            query.query_plan = basex.perform_query(
+                generate_xquery_plan(query.get_xquery()), database, 'plan'
+            )
+        except (OSError, ValueError) as err:
+            query.query_plan = 'Cannot get query plan: {}'.format(err)
+        query.save()
+        return query
+
+
 class SearchQuery(models.Model):
     # User-defined fields
     components = models.ManyToManyField(Component)
@@ -269,6 +424,24 @@ class SearchQuery(models.Model):
         help_text='True if the query was cancelled by the user'
     )
     last_accessed = models.DateTimeField(null=True, editable=False)
+    # Fields for approximate searches
+    sample_fraction = models.FloatField(
+        null=True, blank=True,
+        help_text='Fraction of the databases of every component that is '
+                  'searched to estimate the number of results, or empty '
+                  'for an exhaustive search'
+    )
+    continue_search = models.BooleanField(
+        default=False,
+        help_text='True if an exhaustive search should be performed in the '
+                  'background after estimating the number of results'
+    )
+    estimates = models.JSONField(null=True, editable=False)
+    metrics = models.JSONField(
+        null=True, editable=False,
+        help_text='Totals of the measurements made while searching and '
+                  'while retrieving results (see services.metrics)'
+    )
 
     # makes it possible to register extra filters (callback functions)
     # to further process the raw XPath results from BaseX
@@ -304,23 +477,55 @@ class SearchQuery(models.Model):
     def _component_results(self) -> Iterable[ComponentSearchResult]:
         return self.results.all().order_by('component')
 
+    def _filter(self, matches: ResultSet) -> ResultSet:
+        '''Apply the registered filters to a result set'''
+        if not self.filters:
+            return matches
+        with measure(FILTER_SECONDS, 'filter_seconds'):
+            for filter_ in self.filters:
+                matches = filter_(matches)
+            return list(matches)
+
     def _count_results(self, result: ComponentSearchResult) -> Optional[int]:
         if not self.filters:
             # fast path, no furether filtering necessary
             return result.number_of_results
 
         # slow path, iterate over all results and run filters
-        matches = result.get_results()
-        for filter_ in self.filters:
-            matches = filter_(matches)
-        return len(list(matches))
+        return len(self._filter(result.get_results()))
+
+    def add_metrics(self, section: str, recorder: Recorder) -> None:
+        '''Add the recorded measurements to the totals in the given section
+        of the metrics field, without saving. The field is refreshed first,
+        because searching and retrieving results happen in different
+        processes.'''
+        if self.pk:
+            self.refresh_from_db(fields=['metrics'])
+        self.metrics = self.metrics or {}
+        totals = self.metrics.setdefault(section, {})
+        for key, value in recorder.as_dict().items():
+            totals[key] = round(totals.get(key, 0) + value, 6)
 
     def get_results(self, max_results: Optional[int] = None, exclude: Optional[Set[str]] = None) -> Tuple[ResultSet, float, List]:
         """Get results so far, except for those whose ids are in `exclude`.
         Object should have been initialized with initialize() method but search does not have to be started yet
         with perform_search() method. Return a tuple of the result as
         a list of dictionaries and the percentage of search completion.
-        This method saves the object to update last accessed time."""
+        This method saves the object to update last accessed time and the
+        retrieval metrics."""
+        with recording() as recorder:
+            recorder.add('requests', 1)
+            all_matches, search_percentage, counts = \
+                self._collect_results(max_results, exclude)
+        self.add_metrics('retrieval', recorder)
+        self.last_accessed = timezone.now()
+        self.save()
+        all_matches = list(self.augment_with_variables(all_matches))
+        return (all_matches, search_percentage, counts)
+
+    def _collect_results(self, max_results: Optional[int],
+                         exclude: Optional[Set[str]]) \
+            -> Tuple[ResultSet, float, List]:
         completed_part = 0
         all_matches: List[Result] = []
         counts = []
@@ -335,9 +540,7 @@ class SearchQuery(models.Model):
             if exclude is not None:
                 matches = [m for m in matches if m.id not in exclude]
 
-            for filter_ in self.filters:
-                matches = filter_(matches)
-            all_matches.extend(matches)
+            all_matches.extend(self._filter(matches))
 
             if max_results is not None and len(all_matches) > max_results:
                 break
@@ -368,10 +571,6 @@ class SearchQuery(models.Model):
         # Check if too many results have been added
         if max_results is not None:
             all_matches = all_matches[0:max_results]
-
-        self.last_accessed = timezone.now()
-        self.save()
-        all_matches = list(self.augment_with_variables(all_matches))
         return (all_matches, search_percentage, counts)
 
     def perform_search(self) -> None:
@@ -390,6 +589,10 @@ class SearchQuery(models.Model):
         result_objs = list(result_objs_query)
         # append results that should be complete but can't be read
         result_objs += [r for r in self.results.filter(search_completed__isnull=False) if not r.check_results()]
+        # The other results are available in the cache
+        count_cache_requests(
+            True, max(0, self.results.count() - len(result_objs))
+        )
 
         # loop through the linked ComponentSearchResults.
         # for each component, we have to either run the query (perform_search)
@@ -402,7 +605,9 @@ class SearchQuery(models.Model):
                 # make sure the results are accessible, because reading the cache might fail
                 if result_obj.check_results():
                     # results are readable, skip the rest of the loop
+                    count_cache_requests(True)
                     continue
+            count_cache_requests(False)
             try:
                 result_obj.perform_search(self.id)
             except SearchError:
@@ -439,13 +644,93 @@ class SearchQuery(models.Model):
                 dbs = component.get_databases().keys()
                 for db in dbs:
                     xquery = generate_xquery_count(db, self.xpath)
-                    component_count += int(basex.perform_query(xquery))
+                    component_count += int(
+                        basex.perform_query(xquery, db, 'count')
+                    )
                 counts[component.slug] = component_count
         except (OSError, ValueError) as err:
             # Propagate errors because of bad XPath or BaseX problems
             raise SearchError(str(err))
         return counts
 
+    def _get_exact_count(self, component: Component) -> Optional[int]:
+        '''Return the number of results for a component if it is known
+        because an exhaustive search has already been completed, otherwise
+        None.'''
+        result = self.results.filter(
+            component=component, search_completed__isnull=False, errors=''
+        ).first()
+        if result is None:
+            return None
+        return result.number_of_results
+
+    def perform_sampled_count(self, rng=None) -> None:
+        '''Estimate the number of results in every component by counting
+        the results in a sample of its databases, drawn with a probability
+        proportional to their size. Estimates (including confidence
+        intervals) are saved in the estimates field as soon as a component
+        is done. Filters are not taken into account. Components for which
+        an exhaustive search has already been completed, or for which the
+        counts follow from the stored attribute counts, get their exact
+        count.'''
+        if self.sample_fraction is None:
+            raise SearchError('Query has no sample fraction')
+        confidence = settings.SAMPLE_CONFIDENCE_LEVEL
+        self.estimates = {'components': {}}
+        component_estimates = []
+        for component in self.components.all().order_by('slug'):
+            databases = component.get_databases()
+            exact_count = self._get_exact_count(component)
+            if exact_count is not None:
+                estimate = get_exact_estimate(exact_count)
+            else:
+                known_counts = get_known_counts(component, self.xpath)
+                if known_counts.keys() == databases.keys():
+                    # No need to sample
+                    drawn = list(databases)
+                else:
+                    drawn = choose_sample(databases, self.sample_fraction,
+                                          rng)
+                counts = {db: known_counts[db] for db in set(drawn)
+                          if db in known_counts}
+                try:
+                    for database in set(drawn) - counts.keys():
+                        xquery = generate_xquery_count(database, self.xpath)
+                        counts[database] = int(basex.perform_query(
+                            xquery, database, 'count'
+                        ))
+                except (OSError, ValueError) as err:
+                    logger.error('Could not count results in database for '
+                                 'sample of query %d: %s', self.pk, err)
+                    self.estimates['components'][component.slug] = {
+                        'error': str(err)
+                    }
+                    continue
+                estimate = estimate_count(databases, drawn, counts,
+                                          confidence)
+                estimate['sampled_databases'] = len(counts)
+            estimate['total_databases'] = len(databases)
+            component_estimates.append(estimate)
+            self.estimates['components'][component.slug] = estimate
+            self.save(update_fields=['estimates'])
+            self.refresh_from_db(fields=['cancelled'])
+            if self.cancelled:
+                return
+        self.estimates['total'] = combine_estimates(component_estimates,
+                                                    confidence)
+        self.save(update_fields=['estimates'])
+
+    def get_sampling_percentage(self) -> int:
+        '''Return the percentage of components for which the number of
+        results has been estimated.'''
+        if self.estimates is None:
+            return 0
+        if 'total' in self.estimates:
+            return 100
+        number_of_components = max(1, self.components.count())
+        return int(100 * len(self.estimates['components']) /
+                   number_of_components)
+
     def cancel_search(self) -> None:
         """Mark search as cancelled and save object"""
         self.cancelled = True
@@ -505,7 +790,8 @@ class SearchQuery(models.Model):
             return
             <match>{data($prevs)}||{data($nexts)}</match>
             '''
-            result = basex.perform_query(query)
+            result = basex.perform_query(query, match._match.database,
+                                         'context')
             prevs, nexts = result.split('||')
             prevs = prevs.replace('<match>', '')
             nexts = nexts.replace('</match>', '')
@@ -0,0 +1,108 @@
+"""Helpers for approximate searches that only count the results in a sample
+of the databases of each component and extrapolate from there."""
+
+import math
+import random
+from statistics import NormalDist
+from typing import Dict, List, Optional
+
+
+def get_number_of_draws(number_of_databases: int, fraction: float) -> int:
+    '''Return the number of databases to draw for a component consisting of
+    the given number of databases. At least two draws are needed to be able
+    to estimate the variance.'''
+    return max(2, math.ceil(fraction * number_of_databases))
+
+
+def choose_sample(databases: Dict[str, int], fraction: float,
+                  rng: Optional[random.Random] = None) -> List[str]:
+    '''Draw a sample (with replacement) of databases from a dictionary of
+    database names and sizes, with a probability proportional to their size.
+    If the number of draws is not smaller than the number of databases, all
+    databases are returned (once) so that the count will be exact.'''
+    if rng is None:
+        rng = random.Random()
+    draws = get_number_of_draws(len(databases), fraction)
+    if draws >= len(databases):
+        return list(databases)
+    names = list(databases)
+    # Databases of (almost) zero KiB should still have a chance to be drawn
+    weights = [max(1, databases[name]) for name in names]
+    return rng.choices(names, weights=weights, k=draws)
+
+
+def get_exact_estimate(count: int) -> dict:
+    '''Return an estimate in the format of estimate_count for a number of
+    results that is known exactly.'''
+    return {
+        'estimate': count,
+        'variance': 0.0,
+        'lower': count,
+        'upper': count,
+        'observed': count,
+        'exact': True,
+    }
+
+
+def estimate_count(databases: Dict[str, int], drawn: List[str],
+                   counts: Dict[str, int], confidence: float) -> dict:
+    '''Estimate the total number of results in a component using the
+    Hansen-Hurwitz estimator for sampling with a probability proportional
+    to size. `databases` contains the sizes of all databases of the component,
+    `drawn` the sample returned by choose_sample and `counts` the number of
+    results for every database in the sample. Return a dict containing the
+    estimate, the variance, the bounds of the confidence interval and the
+    number of results actually observed.'''
+    observed = sum(counts[database] for database in set(drawn))
+    if len(set(drawn)) == len(databases):
+        # Every database has been searched, so the count is exact
+        return get_exact_estimate(observed)
+    total_weight = sum(max(1, size) for size in databases.values())
+    scaled = [
+        counts[database] * total_weight / max(1, databases[database])
+        for database in drawn
+    ]
+    estimate = sum(scaled) / len(scaled)
+    variance = sum((x - estimate) ** 2 for x in scaled) / \
+        (len(scaled) * (len(scaled) - 1))
+    lower, upper = get_confidence_interval(estimate, variance, confidence)
+    return {
+        'estimate': round(estimate),
+        'variance': variance,
+        # The total can never be lower than what we have actually seen
+        'lower': max(observed, lower),
+        'upper': max(observed, upper),
+        'observed': observed,
+        'exact': False,
+    }
+
+
+def get_confidence_interval(estimate: float, variance: float,
+                            confidence: float):
+    '''Return the lower and upper bound of a normal approximation of the
+    confidence interval, rounded to whole numbers of results.'''
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    margin = z * math.sqrt(variance)
+    return max(0, math.floor(estimate - margin)), math.ceil(estimate + margin)
+
+
+def combine_estimates(estimates: List[dict], confidence: float) -> dict:
+    '''Combine the estimates of several components (strata) into an estimate
+    for all of them together. Because components are sampled independently,
+    both the estimates and the variances can be added up.'''
+    estimate = sum(e['estimate'] for e in estimates)
+    variance = sum(e['variance'] for e in estimates)
+    observed = sum(e['observed'] for e in estimates)
+    exact = all(e['exact'] for e in estimates)
+    if exact:
+        lower = upper = estimate
+    else:
+        lower, upper = get_confidence_interval(estimate, variance, confidence)
+    return {
+        'estimate': estimate,
+        'variance': variance,
+        'lower': max(observed, lower),
+        'upper': max(observed, upper),
+        'observed': observed,
+        'exact': exact,
+    }
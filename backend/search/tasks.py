@@ -1,8 +1,50 @@
+import time
+
 from celery import shared_task
+from django.conf import settings
+
+from services import metrics
 from .models import SearchQuery
+from . import warming
 
 
-@shared_task
-def run_search_query(query_id: int):
+@shared_task(bind=True)
+def run_search_query(self, query_id: int):
     query = SearchQuery.objects.get(id=query_id)
-    query.perform_search()
+    start = time.perf_counter()
+    with metrics.recording() as recorder:
+        # Set by the task_prerun handler in services.metrics
+        queue_wait = getattr(self.request, 'queue_wait', None)
+        if queue_wait is not None:
+            recorder.add('queue_wait_seconds', queue_wait)
+        try:
+            if query.sample_fraction is not None:
+                query.perform_sampled_count()
+                if not query.continue_search:
+                    return
+            query.perform_search()
+        finally:
+            recorder.add('task_seconds', time.perf_counter() - start)
+            query.add_metrics('search', recorder)
+            query.save(update_fields=['metrics'])
+
+
+@shared_task
+def warm_search_cache():
+    '''Send a low-priority task for every query that should be searched
+    to warm the search cache'''
+    deadline = time.time() + settings.CACHE_WARMING_DURATION * 60
+    for xpath, variables, component_id in warming.select_queries():
+        args = (xpath, variables, component_id, deadline)
+        try:
+            warm_search_result.apply_async(
+                args, priority=settings.CACHE_WARMING_PRIORITY)
+        except warm_search_result.OperationalError:
+            # No connection with message broker - run synchronously
+            warm_search_result.apply(args)
+
+
+@shared_task
+def warm_search_result(xpath: str, variables: list, component_id: int,
+                       deadline: float):
+    warming.warm_result(xpath, variables, component_id, deadline)
@@ -4,21 +4,37 @@ from django.core.management import call_command
 from django.utils import timezone
 
 import lxml.etree as etree
+import io
 import tempfile
 import pathlib
 import os
+import random
 import shutil
+import time
+from datetime import timedelta
+from unittest.mock import patch
 
-from treebanks.models import Treebank
+from treebanks.models import Treebank, Component, BaseXDB, AttributeCount
 from services.basex import basex
+from services.testing import FakeBaseXServer
 
 from .basex_search import (check_db_name, check_xpath, generate_xquery_search,
                            generate_xquery_count, parse_search_result,
                            generate_xquery_for_variables,
                            check_xquery_variable_name,
                            parse_metadata_count_result,
-                           generate_xquery_showtree)
-from .models import ComponentSearchResult, SearchQuery
+                           generate_xquery_showtree,
+                           generate_xquery_attribute_counts,
+                           parse_attribute_count)
+from benchmarks.synthetic import SyntheticTreebank
+from .models import (ComponentSearchResult, SearchQuery, SlowQuery,
+                     get_known_counts)
+from .tasks import run_search_query, warm_search_cache, warm_search_result
+from . import warming
+from mwe.models import CanonicalForm, XPathQuery
+from .sampling import choose_sample, estimate_count, combine_estimates
+from .xpath_analysis import (get_mandatory_attribute_values,
+                             get_attribute_conditions)
 
 test_treebank = None
 
@@ -87,7 +103,17 @@ class BaseXSearchTestCase(TestCase):
     def test_xquery_search_count(self):
         # Check if function runs without error
         generate_xquery_search(self.DB_NAME_CHECK, XPATH1)
-        generate_xquery_count(self.DB_NAME_CHECK, XPATH1)
+        # Descendant queries are applied to the whole database, so that
+        # BaseX can use its indexes
+        self.assertEqual(
+            generate_xquery_count(self.DB_NAME_CHECK, XPATH1),
+            'count(db:open("{}"){})'.format(self.DB_NAME_CHECK, XPATH1)
+        )
+        self.assertEqual(
+            generate_xquery_count(self.DB_NAME_CHECK, '/alpino_ds'),
+            'count(db:open("{}")/treebank/alpino_ds)'
+            .format(self.DB_NAME_CHECK)
+        )
         # Illegal arguments should raise error
         for func in (generate_xquery_search, generate_xquery_count):
             self.assertRaises(
@@ -132,6 +158,17 @@ class BaseXSearchTestCase(TestCase):
             self.DB_NAME_CHECK, self.SENT_ID_CHECK + '"'
         )
 
+    def test_attribute_counts(self):
+        generate_xquery_attribute_counts(self.DB_NAME_CHECK, ['lemma', 'pt'])
+        self.assertRaises(ValueError, generate_xquery_attribute_counts,
+                          self.DB_NAME_CHECK, ['lemma|@*'])
+        self.assertEqual(
+            parse_attribute_count(
+                '<count attribute="word" value="&quot;">12</count>'),
+            ('word', '"', 12)
+        )
+        self.assertRaises(ValueError, parse_attribute_count, '<count/>')
+
     def test_parse_search_result(self):
         input_str = '<match>id||sentence||ids||begins||' \
             'xml_sentences||meta||vars||db</match><match>id2||sentence2' \
@@ -187,7 +224,142 @@ class BaseXSearchTestCase(TestCase):
             parse_metadata_count_result('<something></something>')
 
 
+class SamplingTestCase(TestCase):
+    DATABASES = {'DB{}'.format(i): 100 * (i + 1) for i in range(20)}
+    COUNTS = {'DB{}'.format(i): 3 * (i + 1) for i in range(20)}
+
+    def test_choose_sample(self):
+        rng = random.Random(1)
+        drawn = choose_sample(self.DATABASES, 0.25, rng)
+        self.assertEqual(len(drawn), 5)
+        self.assertTrue(set(drawn) <= set(self.DATABASES))
+        # A large enough fraction means that all databases are searched
+        self.assertEqual(set(choose_sample(self.DATABASES, 1, rng)),
+                         set(self.DATABASES))
+        self.assertEqual(len(choose_sample({'DB0': 10}, 0.01, rng)), 1)
+
+    def test_estimate_count(self):
+        drawn = list(self.DATABASES)
+        estimate = estimate_count(self.DATABASES, drawn, self.COUNTS, 0.95)
+        self.assertTrue(estimate['exact'])
+        self.assertEqual(estimate['estimate'], sum(self.COUNTS.values()))
+        # Counts are proportional to size, so every sample gives the exact
+        # total and the confidence interval has a width of (almost) zero
+        drawn = ['DB3', 'DB7', 'DB3']
+        counts = {db: self.COUNTS[db] for db in drawn}
+        estimate = estimate_count(self.DATABASES, drawn, counts, 0.95)
+        self.assertFalse(estimate['exact'])
+        self.assertEqual(estimate['estimate'], sum(self.COUNTS.values()))
+        self.assertEqual(estimate['observed'], 12 + 24)
+        counts['DB7'] = 0
+        estimate = estimate_count(self.DATABASES, drawn, counts, 0.95)
+        self.assertLessEqual(estimate['lower'], estimate['estimate'])
+        self.assertGreater(estimate['upper'], estimate['estimate'])
+        self.assertGreaterEqual(estimate['lower'], estimate['observed'])
+
+    def test_combine_estimates(self):
+        first = estimate_count({'DB0': 1}, ['DB0'], {'DB0': 5}, 0.95)
+        drawn = ['DB1', 'DB2']
+        counts = {'DB1': 10, 'DB2': 0}
+        second = estimate_count(self.DATABASES, drawn, counts, 0.95)
+        total = combine_estimates([first, second], 0.95)
+        self.assertFalse(total['exact'])
+        self.assertEqual(total['estimate'],
+                         first['estimate'] + second['estimate'])
+        self.assertEqual(total['observed'], 15)
+        self.assertTrue(combine_estimates([first], 0.95)['exact'])
+
+
+class XPathAnalysisTestCase(TestCase):
+    def test_get_mandatory_attribute_values(self):
+        values = get_mandatory_attribute_values(XPATH1)
+        self.assertIn(('cat', 'smain'), values)
+        self.assertIn(('pt', 'vnw'), values)
+        self.assertEqual(len(values), 10)
+        self.assertEqual(
+            get_mandatory_attribute_values(
+                "//node[@lemma='a or b' and node[@rel=\"hd\"]]"),
+            {('lemma', 'a or b'), ('rel', 'hd')}
+        )
+        # Conditions that do not have to be satisfied by every match
+        for xpath in ('//node[@lemma="a" or @lemma="b"]',
+                      '//node[not(@lemma="a")]',
+                      '//node[@cat="np" and not(node[@rel="det"])]',
+                      '//node[(@lemma="a") = (@pt="n")]',
+                      '//node[@lemma="a"] | //node[@lemma="b"]',
+                      '//node[@cat="np"] union //node[@cat="pp"]',
+                      '//node[@cat="np"] intersect //node[@rel="su"]',
+                      '//node[@cat="np" and string-length('
+                      'node[@rel="det"]/@lemma) = 0]',
+                      '//node[@cat="np" and sum(node[@rel="det"]/@begin)'
+                      ' = 0]',
+                      '//node[@cat="np" and data(node[@rel="det"]) = ()]',
+                      '//node[@cat="np" and node[@rel="det"] = ()]',
+                      '//node[@cat="np"][1]',
+                      '//node[@cat="np"]/ancestor::node[@rel="su"]'):
+            self.assertEqual(get_mandatory_attribute_values(xpath), set())
+
+    def test_get_attribute_conditions(self):
+        self.assertEqual(get_attribute_conditions('//node[@lemma="lopen"]'),
+                         [('lemma', 'lopen')])
+        self.assertEqual(
+            get_attribute_conditions("//node[@cat='np' and @rel=\"su\"]"),
+            [('cat', 'np'), ('rel', 'su')]
+        )
+        for xpath in (XPATH1, '//node[@lemma="a" or @lemma="b"]',
+                      '//node[@lemma="lopen"]/node',
+                      '//node[@lemma="lopen" and node]'):
+            self.assertIsNone(get_attribute_conditions(xpath))
+
+
 class ComponentSearchResultTestCase(TestCase):
+    def test_databases_without_matches(self):
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        component = Component.objects.create(
+            slug='testcomp', title='Testcomp', treebank=treebank,
+            nr_sentences=0, nr_words=0)
+        for name, counted in (('TESTDB1', True), ('TESTDB2', True),
+                              ('TESTDB3', False)):
+            BaseXDB.objects.create(dbname=name, size=0, component=component,
+                                   has_attribute_counts=counted)
+        AttributeCount.objects.create(database_id='TESTDB1', attribute='pt',
+                                      value='vnw', count=2)
+        csr = ComponentSearchResult(xpath='//node[@pt="vnw"]',
+                                    component=component)
+        self.assertEqual(csr._get_databases_without_matches(), {'TESTDB2'})
+        csr.xpath = '//node[@pt="vnw" or @pt="n"]'
+        self.assertEqual(csr._get_databases_without_matches(), set())
+        # Counts of simple queries are known for databases with counts
+        self.assertEqual(get_known_counts(component, '//node[@pt="vnw"]'),
+                         {'TESTDB1': 2, 'TESTDB2': 0})
+        self.assertEqual(
+            get_known_counts(component, '//node[@pt="vnw" and @rel="su"]'),
+            {'TESTDB1': 0, 'TESTDB2': 0}
+        )
+        self.assertEqual(get_known_counts(component, XPATH1), {})
+
+    def test_invalidate(self):
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        components = [
+            Component.objects.create(slug=slug, title=slug,
+                                     treebank=treebank, nr_sentences=0,
+                                     nr_words=0)
+            for slug in ('comp1', 'comp2')
+        ]
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                self.settings(CACHING_DIR=pathlib.Path(cache_dir)):
+            for component in components:
+                ComponentSearchResult.objects.create(xpath='//node',
+                                                     component=component)
+            self.assertEqual(
+                ComponentSearchResult.invalidate(components[:1]), 1)
+            self.assertEqual(
+                list(ComponentSearchResult.objects.values_list(
+                    'component__slug', flat=True)),
+                ['comp2']
+            )
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
     def test_perform_search(self):
         if not basex.test_connection():
             return self.skipTest('requires running BaseX server')
@@ -211,6 +383,245 @@ class ComponentSearchResultTestCase(TestCase):
             csr.delete()  # Delete because CSR auto-saves
 
 
+class SearchMetricsTestCase(TestCase):
+    def test_search_metrics(self):
+        server = FakeBaseXServer()
+        server.start()
+        self.addCleanup(server.stop)
+        synthetic = SyntheticTreebank(components=1, files_per_component=1,
+                                      sentences_per_file=10)
+        server.add_database(
+            'METRICSDB', synthetic.generate_database(synthetic.filenames[0])
+        )
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        component = Component.objects.create(
+            slug='testcomp', title='Testcomp', treebank=treebank,
+            nr_sentences=10, nr_words=0)
+        BaseXDB.objects.create(dbname='METRICSDB', size=1,
+                               component=component)
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                self.settings(CACHING_DIR=pathlib.Path(cache_dir)), \
+                server.settings():
+            sq = SearchQuery.objects.create(xpath='//node[@cat="np"]')
+            sq.components.add(component)
+            sq.initialize()
+            run_search_query.apply((sq.pk,))
+            sq.refresh_from_db()
+            search = sq.metrics['search']
+            self.assertEqual(search['basex_search_queries'], 1)
+            self.assertEqual(search['cache_misses'], 1)
+            self.assertEqual(search['cache_hits'], 0)
+            self.assertGreater(search['search_results'], 0)
+            self.assertGreater(search['task_seconds'], 0)
+            # Searching again is answered from the cache
+            run_search_query.apply((sq.pk,))
+            sq.refresh_from_db()
+            self.assertEqual(sq.metrics['search']['cache_hits'], 1)
+            sq.add_filter(lambda matches: matches[:1])
+            results, _, _ = sq.get_results()
+            self.assertEqual(len(results), 1)
+            retrieval = SearchQuery.objects.get(pk=sq.pk).metrics['retrieval']
+            self.assertEqual(retrieval['requests'], 1)
+            self.assertGreater(retrieval['cache_read_seconds'], 0)
+            self.assertGreater(retrieval['cache_parse_seconds'], 0)
+            self.assertIn('filter_seconds', retrieval)
+
+
+class SlowQueryTestCase(TestCase):
+    def test_slow_query_log(self):
+        server = FakeBaseXServer()
+        server.start()
+        self.addCleanup(server.stop)
+        synthetic = SyntheticTreebank(sentences_per_file=10)
+        for name, filename in zip(['FASTDB', 'SLOWDB'], synthetic.filenames):
+            server.add_database(name,
+                                synthetic.generate_database(filename))
+        server.slow_down('SLOWDB', 0.2)
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        component = Component.objects.create(
+            slug='testcomp', title='Testcomp', treebank=treebank,
+            nr_sentences=20, nr_words=0)
+        for name in ('FASTDB', 'SLOWDB'):
+            BaseXDB.objects.create(dbname=name, size=1, component=component)
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                self.settings(CACHING_DIR=pathlib.Path(cache_dir),
+                              SLOW_QUERY_THRESHOLD=0.1), \
+                server.settings():
+            csr = ComponentSearchResult(xpath='//node[@cat="np"]',
+                                        component=component)
+            csr.perform_search()
+            slow_query = SlowQuery.objects.get()
+            self.assertEqual(slow_query.database, 'SLOWDB')
+            self.assertEqual(slow_query.query_type, 'search')
+            self.assertGreaterEqual(slow_query.duration, 0.2)
+            self.assertGreater(slow_query.number_of_results, 0)
+            self.assertIn('QueryPlan', slow_query.query_plan)
+
+            output = io.StringIO()
+            call_command('replay_slow_queries', repeat=2, stdout=output)
+            self.assertIn('1. search of //node[@cat="np"] in SLOWDB',
+                          output.getvalue())
+            self.assertIn('{} results'.format(slow_query.number_of_results),
+                          output.getvalue())
+            self.assertEqual(server.statistics['queries'], 5)
+
+        with self.settings(SLOW_QUERY_THRESHOLD=None):
+            self.assertIsNone(SlowQuery.record('//node', 'SLOWDB', 'count',
+                                               100, 0))
+
+
+class CacheWarmingTestCase(TestCase):
+    def test_warm_cache(self):
+        server = FakeBaseXServer()
+        server.start()
+        self.addCleanup(server.stop)
+        synthetic = SyntheticTreebank(components=1, files_per_component=1,
+                                      sentences_per_file=10)
+        server.add_database(
+            'WARMDB', synthetic.generate_database(synthetic.filenames[0])
+        )
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        component = Component.objects.create(
+            slug='testcomp', title='Testcomp', treebank=treebank,
+            nr_sentences=10, nr_words=0)
+        BaseXDB.objects.create(dbname='WARMDB', size=1, component=component)
+        form = CanonicalForm.objects.create(text='de dans ontspringen')
+        for xpath in ('//node[@cat="np"]', '//node[@cat="pp"]'):
+            XPathQuery.objects.create(canonical=form, xpath=xpath, rank=3,
+                                      description='Major lemma query')
+        # Search history: a popular query and an MWE query
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        for xpath in ('//node[@cat="smain"]', '//node[@cat="smain"]',
+                      '//node[@cat="np"]'):
+            sq = SearchQuery.objects.create(xpath=xpath,
+                                            last_accessed=an_hour_ago)
+            sq.components.add(component)
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                self.settings(CACHING_DIR=pathlib.Path(cache_dir),
+                              CACHE_WARMING_MAXIMUM_LOAD=None), \
+                server.settings():
+            with self.settings(CACHE_WARMING_QUERIES=1):
+                self.assertEqual(
+                    [xpath for xpath, _, _ in warming.select_queries()],
+                    ['//node[@cat="smain"]'])
+            # A low-priority task is sent for every query
+            with patch.object(warm_search_result, 'apply_async') as mocked:
+                warm_search_cache.apply()
+            self.assertEqual(
+                [call.args[0][0] for call in mocked.call_args_list],
+                ['//node[@cat="smain"]', '//node[@cat="np"]',
+                 '//node[@cat="pp"]'])
+            for call in mocked.call_args_list:
+                self.assertEqual(call.kwargs['priority'],
+                                 settings.CACHE_WARMING_PRIORITY)
+                warm_search_result.apply(call.args[0])
+            self.assertEqual(server.statistics['queries'], 3)
+            result = ComponentSearchResult.objects.get(
+                xpath='//node[@cat="np"]', component=component)
+            self.assertIsNotNone(result.search_completed)
+            self.assertGreater(result.number_of_results, 0)
+            # Cached queries are skipped
+            self.assertEqual(warming.select_queries(), [])
+            deadline = time.time() + 60
+            self.assertIsNone(warming.warm_result(
+                '//node[@cat="np"]', [], component.id, deadline))
+
+            ComponentSearchResult.empty_cache()
+            candidate = warming.select_queries()[0]
+            # Stop if time is up
+            self.assertIsNone(warming.warm_result(*candidate,
+                                                  time.time() - 1))
+            # Stop if the cache budget has been used
+            with self.settings(CACHE_WARMING_CACHE_FRACTION=0):
+                self.assertEqual(warming.select_queries(), [])
+                self.assertIsNone(warming.warm_result(*candidate, deadline))
+            # A query can only be claimed once
+            self.assertIsNotNone(warming.claim_result(*candidate))
+            self.assertIsNone(warming.claim_result(*candidate))
+            self.assertIsNone(warming.warm_result(*candidate, deadline))
+            # Stop if users are searching
+            sq.last_accessed = timezone.now()
+            sq.save()
+            self.assertEqual(warming.select_queries(), [])
+            self.assertIsNone(warming.warm_result(
+                '//node[@cat="pp"]', [], component.id, deadline))
+            self.assertEqual(server.statistics['queries'], 3)
+
+
+class TreeViewTestCase(TestCase):
+    def test_tree_view(self):
+        # Without database, the sentence has to be in the sentence index
+        response = self.client.post(
+            '/search/tree/',
+            {'sentence_id': 'unknown:1'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/search/tree/',
+            {'database': 'DB"', 'sentence_id': 'unknown:1'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        if not test_treebank:
+            return self.skipTest('requires an uploaded test treebank')
+        database = test_treebank.components.get(slug='troonrede19') \
+            .databases.first()
+        location = database.sentences.first()
+        response = self.client.post(
+            '/search/tree/',
+            {'sentence_id': location.sentence_id},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        tree = etree.fromstring(response.json()['tree'])
+        self.assertEqual(tree.get('id'), location.sentence_id)
+
+    def test_tree_cache(self):
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        component = Component.objects.create(
+            slug='testcomp', title='Testcomp', treebank=treebank,
+            nr_sentences=3, nr_words=0)
+        database = BaseXDB.objects.create(dbname='TREEDB', size=1,
+                                          component=component)
+        sentence_id = 'file.xml:1'
+        tree = '<alpino_ds id="{}"/>'.format(sentence_id)
+
+        def fetch_tree(database, sentence_id):
+            return tree if sentence_id == 'file.xml:1' else ''
+
+        def get_tree(sentence_id):
+            response = self.client.post(
+                '/search/tree/',
+                {'database': 'TREEDB', 'sentence_id': sentence_id},
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+            return response.json()['tree']
+
+        with patch('search.views._fetch_tree',
+                   side_effect=fetch_tree) as fetch:
+            self.assertEqual(get_tree(sentence_id), tree)
+            self.assertEqual(get_tree(sentence_id), tree)
+            self.assertEqual(fetch.call_count, 1)
+            # Not found trees are not cached
+            self.assertEqual(get_tree('unknown:1'), '')
+            get_tree('unknown:1')
+            self.assertEqual(fetch.call_count, 3)
+            # Importing the database again invalidates its trees
+            database.save()
+            self.assertEqual(get_tree(sentence_id), tree)
+            self.assertEqual(fetch.call_count, 4)
+
+        response = self.client.post(
+            '/search/tree/',
+            {'database': 'TREEDB', 'sentence_id': ['unknown:1']},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
 class SearchQueryTestCase(TestCase):
     def setUp(self):
         if not basex.test_connection():
@@ -313,6 +724,18 @@ class SearchQueryTestCase(TestCase):
         self.assertEqual(counts['troonrede19'], 4)
         self.assertEqual(counts['troonrede20'], 3)
 
+    def test_perform_sampled_count(self):
+        sq = SearchQuery(xpath=XPATH1, sample_fraction=1)
+        sq.save()
+        components = test_treebank.components.all()
+        sq.components.add(*components)
+        sq.perform_sampled_count()
+        # Components consist of two databases, so all are searched
+        self.assertTrue(sq.estimates['total']['exact'])
+        self.assertEqual(sq.estimates['total']['estimate'], 7)
+        self.assertEqual(
+            sq.estimates['components']['troonrede19']['estimate'], 4)
+        self.assertEqual(sq.get_sampling_percentage(), 100)
 
     def test_missing_cache(self):
         with self.settings(CACHING_DIR=test_cache_path):
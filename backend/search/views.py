@@ -1,5 +1,6 @@
-from collections import Counter
+from collections import Counter, OrderedDict
 from functools import partial
+from typing import Optional, Tuple, Union
 
 from rest_framework.response import Response
 from rest_framework.decorators import (
@@ -12,11 +13,12 @@ from rest_framework import status
 from django.conf import settings
 from django.db.utils import IntegrityError
 
-from treebanks.models import Component, BaseXDB, Treebank
+from treebanks.models import Component, BaseXDB, Treebank, SentenceLocation
+from treebanks.tasks import update_component_statistics
 from .models import SearchQuery
 from .basex_search import (
     generate_xquery_showtree, generate_xquery_metadata_count,
-    parse_metadata_count_result
+    parse_metadata_count_result, generate_xquery_showtree_at
 )
 from .tasks import run_search_query
 from .types import ResultSet
@@ -26,6 +28,7 @@ from sastadev.treebankfunctions import indextransform
 from mwe_query.canonicalform import expandfull
 
 import logging
+import threading
 
 log = logging.getLogger(__name__)
 
@@ -48,9 +51,9 @@ def _create_component_on_the_fly(component_slug: str, _treebank: str) -> None:
     dbname = component_slug[len('GRETEL-UPLOAD-'):]
     basex_db = BaseXDB(dbname)
     try:
+        # Only the size is determined now; counting sentences and words
+        # requires scanning the database and is done in the background
         basex_db.size = basex_db.get_db_size()
-        nr_sentences = basex_db.get_number_of_sentences()
-        nr_words = basex_db.get_number_of_words()
     except OSError:
         log.error('Tried to create component for BaseX database {} '
                   'for gretel-upload compatibility, but BaseX '
@@ -60,8 +63,7 @@ def _create_component_on_the_fly(component_slug: str, _treebank: str) -> None:
         return
     treebank, _ = Treebank.objects.get_or_create(slug=_treebank)
     component = Component(slug=component_slug, title=component_slug,
-                          nr_sentences=nr_sentences,
-                          nr_words=nr_words)
+                          nr_sentences=0, nr_words=0)
     component.treebank = treebank
     component.save()
     basex_db.component = component
@@ -78,6 +80,14 @@ def _create_component_on_the_fly(component_slug: str, _treebank: str) -> None:
         # Delete Component object so that the view will generate
         # an error.
         component.delete()
+        return
+    try:
+        update_component_statistics.delay(component.pk)
+    except update_component_statistics.OperationalError:
+        # No connection with message broker - run in a separate thread
+        # so that the search does not have to wait
+        threading.Thread(target=update_component_statistics.apply,
+                         args=((component.pk,),), daemon=True).start()
 
 
 def _get_or_create_components(component_slugs, treebank):
@@ -124,6 +134,37 @@ def filter_exclude(xpath: str, results: ResultSet) -> ResultSet:
             yield result
 
 
+def _get_sampling_options(data: dict) \
+        -> Union[Tuple[Optional[float], bool], Response]:
+    '''Return the sample fraction (None for an exhaustive search) and
+    whether the search should continue after sampling, or an error response
+    if the sample fraction is invalid'''
+    # Approximate search: only count results in a sample of the databases
+    sample_fraction = data.get('sample_fraction', None)
+    continue_search = data.get('continue_search', False)
+    if sample_fraction is not None:
+        try:
+            sample_fraction = float(sample_fraction)
+        except (TypeError, ValueError):
+            sample_fraction = 0.0
+        if not 0 < sample_fraction <= 1:
+            return Response(
+                {'error': 'sample_fraction should be a number between 0 '
+                          'and 1'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    return sample_fraction, continue_search
+
+
+def _add_sampling_results(response: dict, query: SearchQuery) -> None:
+    '''Add the estimates of a sampled search to the response'''
+    if query.sample_fraction is not None:
+        response['estimates'] = query.estimates
+        if not query.continue_search:
+            # Only the sample is searched, so report progress of sampling
+            response['search_percentage'] = query.get_sampling_percentage()
+
+
 @api_view(['POST'])
 @authentication_classes([BasicAuthentication])  # No CSRF verification for now
 @renderer_classes([JSONRenderer, BrowsableAPIRenderer])
@@ -144,11 +185,13 @@ def search_view(request):
     is_analysis = data.get('is_analysis', False)
     variables = data.get('variables', [])
     behaviour = data.get('behaviour', {})
+    sampling = _get_sampling_options(data)
+    if isinstance(sampling, Response):
+        return sampling
+    sample_fraction, continue_search = sampling
 
-    if is_analysis:
-        maximum_results = settings.MAXIMUM_RESULTS_ANALYSIS
-    else:
-        maximum_results = settings.MAXIMUM_RESULTS
+    maximum_results = settings.MAXIMUM_RESULTS_ANALYSIS if is_analysis \
+        else settings.MAXIMUM_RESULTS
 
     # The frontend might ask us to run the given query on the results of
     # another "superset" query instead of directly on BaseX.
@@ -184,7 +227,9 @@ def search_view(request):
                 {'error': 'Not all requested components could be found.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        query = SearchQuery(xpath=xpath, variables=variables)
+        query = SearchQuery(xpath=xpath, variables=variables,
+                            sample_fraction=sample_fraction,
+                            continue_search=continue_search)
         query.save()
         query.components.add(*component_objects)
         query.initialize()
@@ -233,7 +278,8 @@ def search_view(request):
         'results': results,
         'counts': counts,
     }
-    if percentage == 100:
+    _add_sampling_results(response, query)
+    if response['search_percentage'] == 100:
         response['errors'] = query.get_errors()
     if query.cancelled is True:
         response['cancelled'] = True
@@ -269,6 +315,62 @@ def cancel_query_view(request):
     query.cancel_search()
 
 
+# Recently shown trees by database, modification time of the database and
+# sentence ID
+_tree_cache: 'OrderedDict[tuple, str]' = OrderedDict()
+_tree_cache_lock = threading.Lock()
+
+
+def get_tree(database: str, sentence_id: str) -> str:
+    '''Get the XML of a sentence from BaseX, or an empty string if it cannot
+    be found. Trees of known databases are cached, because the same trees
+    are often shown repeatedly. The modification time of the database is
+    part of the cache key, so that trees of databases that are imported
+    again are not served from the cache. Raises ValueError if the arguments
+    are malformed and OSError in case of BaseX errors.'''
+    modified = BaseXDB.objects.filter(dbname=database) \
+        .values_list('modified', flat=True).first()
+    if modified is None:
+        return _fetch_tree(database, sentence_id)
+    key = (database, modified, sentence_id)
+    with _tree_cache_lock:
+        if key in _tree_cache:
+            _tree_cache.move_to_end(key)
+            return _tree_cache[key]
+    tree = _fetch_tree(database, sentence_id)
+    if tree:
+        # Sentences that are not found may be added later
+        with _tree_cache_lock:
+            _tree_cache[key] = tree
+            while len(_tree_cache) > settings.TREE_CACHE_SIZE:
+                _tree_cache.popitem(last=False)
+    return tree
+
+
+def _fetch_tree(database: str, sentence_id: str) -> str:
+    '''Get the XML of a sentence from BaseX. If the position of the sentence
+    is known from the sentence index, it is fetched directly, otherwise it
+    is searched for by its ID.'''
+    location = SentenceLocation.objects.filter(
+        database=database, sentence_id=sentence_id
+    ).first()
+    if location is not None:
+        xquery = generate_xquery_showtree_at(database, location.pre,
+                                             sentence_id)
+        try:
+            result = basex.perform_query(xquery, database, 'tree')
+        except OSError as err:
+            # The database may have been changed after building the index
+            log.warning('Could not get tree {} at stored position: {}'
+                        .format(sentence_id, err))
+        else:
+            if result:
+                return result
+    return basex.perform_query(
+        generate_xquery_showtree(database, sentence_id), database, 'tree'
+    )
+
+
 @api_view(['POST'])
 @authentication_classes([BasicAuthentication])  # No CSRF verification for now
 @renderer_classes([JSONRenderer, BrowsableAPIRenderer])
@@ -276,22 +378,38 @@ def cancel_query_view(request):
 def tree_view(request):
     data = request.data
     try:
-        database = data['database']
         sentence_id = data['sentence_id']
     except KeyError as err:
         return Response(
             {'error': '{} is missing'.format(err)},
             status=status.HTTP_400_BAD_REQUEST
         )
+    database = data.get('database')
+    if not isinstance(sentence_id, str) or \
+            not isinstance(database, (str, type(None))):
+        return Response(
+            {'error': 'sentence_id and database should be strings'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not database:
+        # Look up the database in the sentence index
+        databases = list(SentenceLocation.objects.filter(
+            sentence_id=sentence_id
+        ).values_list('database', flat=True)[:2])
+        if len(databases) != 1:
+            return Response(
+                {'error': 'database is missing and cannot be determined '
+                          'from the sentence ID'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        database = databases[0]
     try:
-        xquery = generate_xquery_showtree(database, sentence_id)
+        result = get_tree(database, sentence_id)
     except ValueError as err:
         return Response(
             {'error': str(err)},
             status=status.HTTP_400_BAD_REQUEST
         )
-    try:
-        result = basex.perform_query(xquery)
     except OSError as err:
         return Response(
             {'error': str(err)},
@@ -334,7 +452,8 @@ def metadata_count_view(request):
         for db in dbs:
             xquery = generate_xquery_metadata_count(db, xpath)
             try:
-                xml_count_for_db = basex.perform_query(xquery)
+                xml_count_for_db = basex.perform_query(xquery, db,
+                                                       'metadata_count')
             except OSError as err:
                 return Response(
                     {'error': 'BaseX search error'},
@@ -0,0 +1,175 @@
+'''Pre-warming of the search result cache. During off-peak hours the most
+popular queries of the last CACHE_WARMING_HISTORY_DAYS days and the
+superset queries of multi-word expressions are searched in advance, so
+that the first user asking for them does not have to wait for BaseX.
+Every query is searched by a separate low-priority task (see
+search.tasks), which does nothing when users are searching or the load of
+the server is high, when the cache has been filled up to its share of
+MAXIMUM_CACHE_SIZE or after CACHE_WARMING_DURATION minutes.'''
+
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from mwe.models import XPathQuery
+from .models import ComponentSearchResult, SearchQuery
+
+logger = logging.getLogger(__name__)
+
+# Queries of which the result was retrieved this number of seconds ago are
+# considered to be active
+ACTIVE_SECONDS = 60
+
+# XPath, variables and component ID
+Candidate = Tuple[str, list, int]
+
+
+def get_popular_queries() -> Iterator[Candidate]:
+    '''Yield the queries searched most often in the last
+    CACHE_WARMING_HISTORY_DAYS days, for every component'''
+    since = timezone.now() - \
+        timedelta(days=settings.CACHE_WARMING_HISTORY_DAYS)
+    popular = SearchQuery.objects.filter(last_accessed__gte=since) \
+        .exclude(components=None) \
+        .values('xpath', 'variables', 'components') \
+        .annotate(times=Count('id')).order_by('-times')
+    for query in popular.iterator():
+        yield query['xpath'], query['variables'], query['components']
+
+
+def get_mwe_queries() -> Iterator[Candidate]:
+    '''Yield the stored superset queries of multi-word expressions (which
+    are searched directly in BaseX) for the components on which these
+    queries have been searched before, most popular components first'''
+    superset = XPathQuery.objects.filter(rank=3)
+    components = SearchQuery.objects \
+        .filter(xpath__in=superset.values('xpath')) \
+        .exclude(components=None) \
+        .values('components').annotate(times=Count('id')) \
+        .order_by('-times').values_list('components', flat=True)
+    components = list(components)
+    if not components:
+        return
+    for xpath in superset.order_by('canonical__dcmid') \
+            .values_list('xpath', flat=True).iterator():
+        for component in components:
+            yield xpath, [], component
+
+
+def get_candidates() -> Iterator[Candidate]:
+    '''Yield the queries that should be in the cache, most important
+    first, without duplicates'''
+    seen = set()
+    for candidate in get_popular_queries():
+        key = (candidate[0], repr(candidate[1]), candidate[2])
+        if key not in seen:
+            seen.add(key)
+            yield candidate
+    for candidate in get_mwe_queries():
+        key = (candidate[0], repr(candidate[1]), candidate[2])
+        if key not in seen:
+            seen.add(key)
+            yield candidate
+
+
+def is_busy() -> bool:
+    '''Return True if users are searching or if the load of the server is
+    too high to warm the cache'''
+    since = timezone.now() - timedelta(seconds=ACTIVE_SECONDS)
+    active = SearchQuery.objects.filter(last_accessed__gte=since,
+                                        cancelled=False).count()
+    if active > settings.CACHE_WARMING_MAXIMUM_ACTIVE_SEARCHES:
+        return True
+    maximum_load = settings.CACHE_WARMING_MAXIMUM_LOAD
+    if maximum_load is not None and hasattr(os, 'getloadavg'):
+        return os.getloadavg()[0] / (os.cpu_count() or 1) > maximum_load
+    return False
+
+
+def get_cache_budget() -> int:
+    '''Return the number of bytes that can still be added to the cache by
+    warming'''
+    budget = settings.MAXIMUM_CACHE_SIZE * 1024 * 1024 * \
+        settings.CACHE_WARMING_CACHE_FRACTION
+    used = ComponentSearchResult.objects \
+        .aggregate(Sum('cache_size'))['cache_size__sum'] or 0
+    return int(budget - used)
+
+
+def is_cached(xpath: str, variables: list, component_id: int) -> bool:
+    '''Return True if a query has been searched or is being searched'''
+    return ComponentSearchResult.objects.filter(
+        xpath=xpath, component_id=component_id, variables=variables
+    ).filter(
+        Q(search_completed__isnull=False) | Q(completed_part__isnull=False)
+    ).exists()
+
+
+def select_queries() -> List[Candidate]:
+    '''Return at most CACHE_WARMING_QUERIES queries that are not cached
+    yet, or none if the server is busy or the cache is full'''
+    if is_busy():
+        logger.info('Not warming the search cache: server is busy')
+        return []
+    if get_cache_budget() <= 0:
+        logger.info('Not warming the search cache: cache is full')
+        return []
+    selected = []
+    for candidate in get_candidates():
+        if len(selected) >= settings.CACHE_WARMING_QUERIES:
+            break
+        if not is_cached(*candidate):
+            selected.append(candidate)
+    return selected
+
+
+def claim_result(xpath: str, variables: list,
+                 component_id: int) -> Optional[ComponentSearchResult]:
+    '''Return the component search result of a query, marked as being
+    searched, or None if it has already been searched or is being searched
+    (e.g. for a user). The row is locked while checking, so that concurrent
+    processes cannot both claim it.'''
+    with transaction.atomic():
+        result, _ = ComponentSearchResult.objects.select_for_update() \
+            .get_or_create(xpath=xpath, component_id=component_id,
+                           variables=variables)
+        if result.search_completed is not None or \
+                result.completed_part is not None:
+            return None
+        result.completed_part = 0
+        result.save(update_fields=['completed_part'])
+    return result
+
+
+def warm_result(xpath: str, variables: list, component_id: int,
+                deadline: float) -> Optional[ComponentSearchResult]:
+    '''Search a query that is not cached yet and return its component
+    search result. Nothing is searched if the deadline (a timestamp) has
+    passed, if the server is busy, if the cache budget has been used or if
+    the query has been searched in the meantime.'''
+    if time.time() > deadline:
+        logger.info('Skipped warming the search cache: time is up')
+        return None
+    if is_busy():
+        logger.info('Skipped warming the search cache: server is busy')
+        return None
+    if get_cache_budget() <= 0:
+        logger.info('Skipped warming the search cache: cache is full')
+        return None
+    result = claim_result(xpath, variables, component_id)
+    if result is None:
+        return None
+    try:
+        result.perform_search()
+    except Exception:
+        logger.exception('Could not warm search cache for %s', result)
+        return None
+    logger.info('Warmed search cache for %s', result)
+    return result
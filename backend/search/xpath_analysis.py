@@ -0,0 +1,74 @@
+"""Functions to statically analyse XPath queries, to find out beforehand
+which databases can be skipped or answered without searching BaseX."""
+
+import re
+from typing import List, Optional, Set, Tuple
+
+# An equality of an attribute to a string literal, e.g. @lemma="lopen".
+# Literals containing (escaped) quotation marks are not matched.
+ATTRIBUTE_EQUALITY = re.compile(
+    r'@([\w-]+)\s*=\s*(?:"([^"]*)"(?!")|\'([^\']*)\'(?!\'))'
+)
+# A query for nodes that only have conditions on attribute values,
+# e.g. //node[@lemma="lopen" and @pt="ww"]
+_CONDITION = r'@[\w-]+\s*=\s*(?:"[^"]*"|\'[^\']*\')'
+SIMPLE_NODE_QUERY = re.compile(
+    r'\s*//node\[\s*{0}(?:\s+and\s+{0})*\s*\]\s*'.format(_CONDITION)
+)
+STRING_LITERAL = re.compile(r'"[^"]*"|\'[^\']*\'')
+# The only tokens of queries that are analysed (after replacing string
+# literals by ""): node steps, predicates combined with "and", attributes
+# and equalities. Any other construct, such as a function call, another
+# operator or a set keyword like "union", might turn a condition around or
+# make it optional.
+SAFE_TOKEN = re.compile(r'\s*(?://?|\[|\]|=|""|and\b|node\b(?!\s*\()|@[\w-]+)')
+
+
+def _is_safe(xpath: str) -> bool:
+    '''Return True if the XPath (without string literals) only consists
+    of safe tokens'''
+    position = 0
+    while position < len(xpath):
+        match = SAFE_TOKEN.match(xpath, position)
+        if match is None or match.end() == position:
+            return xpath[position:].strip() == ''
+        position = match.end()
+    return True
+
+
+def get_mandatory_attribute_values(xpath: str) -> Set[Tuple[str, str]]:
+    '''Return a set of (attribute, value) tuples for all attributes that
+    must have the given value in some node of every sentence matching the
+    XPath. The analysis is conservative: if the XPath contains anything else
+    than node steps with predicates combining attribute conditions and
+    other node steps with "and", an empty set is returned.'''
+    if not _is_safe(STRING_LITERAL.sub('""', xpath)):
+        return set()
+    values = set()
+    for match in ATTRIBUTE_EQUALITY.finditer(xpath):
+        before = xpath[:match.start()].rstrip()
+        after = xpath[match.end():].lstrip()
+        # Only accept conditions that are a direct part of a conjunction
+        # inside a predicate, e.g. [@a="x" and @b="y"]
+        if not (before.endswith('[') or re.search(r'\band$', before)):
+            continue
+        if not (after.startswith(']') or re.match(r'and\b', after)):
+            continue
+        value = match.group(2) if match.group(2) is not None \
+            else match.group(3)
+        values.add((match.group(1), value))
+    return values
+
+
+def get_attribute_conditions(xpath: str) -> Optional[List[Tuple[str, str]]]:
+    '''If the XPath is a query for single nodes that only checks attribute
+    values (e.g. //node[@lemma="lopen"] or //node[@cat="np" and @rel="su"])
+    return a list of (attribute, value) tuples for these conditions.
+    Otherwise return None.'''
+    if not SIMPLE_NODE_QUERY.fullmatch(xpath):
+        return None
+    return [
+        (match.group(1),
+         match.group(2) if match.group(2) is not None else match.group(3))
+        for match in ATTRIBUTE_EQUALITY.finditer(xpath)
+    ]
@@ -0,0 +1,46 @@
+from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import ProfileReport
+
+
+@admin.register(ProfileReport)
+class ProfileReportAdmin(admin.ModelAdmin):
+    list_display = ['created', 'method', 'path', 'status_code', 'duration',
+                    'download']
+    list_filter = ['path', 'created']
+    ordering = ['-created']
+    readonly_fields = ['path', 'method', 'status_code', 'created',
+                       'duration', 'phases', 'summary', 'download']
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:report_id>/download/',
+                 self.admin_site.admin_view(self.download_view),
+                 name='services_profilereport_download'),
+        ] + super().get_urls()
+
+    @admin.display(description='Profile')
+    def download(self, obj):
+        url = reverse('admin:services_profilereport_download',
+                      args=[obj.id])
+        return format_html('<a href="{}">{}.prof</a>', url, obj.id)
+
+    def download_view(self, request, report_id):
+        '''Download the cProfile statistics of a report, which can be
+        inspected with e.g. python -m pstats'''
+        report = get_object_or_404(ProfileReport, id=report_id)
+        if not self.has_view_permission(request, report):
+            raise Http404
+        try:
+            profile = report.get_profile_path().open('rb')
+        except OSError:
+            raise Http404('Profile file is missing')
+        return FileResponse(profile, as_attachment=True,
+                            filename='{}.prof'.format(report.id))
@@ -1,15 +1,458 @@
+import itertools
+import logging
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from subprocess import Popen, PIPE
+from tempfile import TemporaryDirectory
+from typing import Callable, Hashable, List, Optional, Tuple, Union
+
 from django.conf import settings
 from lxml import etree
 
-from corpus2alpino.annotators.alpino import AlpinoAnnotator
+from corpus2alpino.abstracts import Annotator
+from corpus2alpino.annotators.alpino import ANNOTATION_KEY, timealign_symbol
+from corpus2alpino.annotators.alpino_client import (
+    AlpinoProcessClient, AlpinoServerClient, closing_punctuation,
+    sentence_id_matcher, sentence_tag_matcher)
+from corpus2alpino.models import Document, MetadataValue
+
+logger = logging.getLogger(__name__)
 
 
 class AlpinoError(RuntimeError):
     pass
 
 
+class AlpinoBusyError(AlpinoError):
+    '''Raised if a sentence cannot be parsed because all parsers are busy'''
+    pass
+
+
+def get_version_of_parse(parse: str) -> str:
+    '''Return the version attribute of the alpino_ds element of a parse'''
+    try:
+        # Encode to bytes because lxml.etree expects that
+        tree = etree.fromstring(parse.encode())
+        return tree.xpath('/alpino_ds/@version')[0]
+    except (etree.ParseError, IndexError) as e:
+        raise AlpinoError(str(e))
+
+
+class InterruptibleClient:
+    '''Mixin for the corpus2alpino clients that keeps track of the running
+    parses (Alpino processes or connections to the server), so that a parse
+    that takes too long can be stopped. Otherwise the thread waiting for it
+    and the process or connection would stay around until Alpino finishes.
+    A parse can be identified by passing an attempt (any hashable object)
+    to parse_line.'''
+    def __init__(self, *args):
+        self._stops = {}
+        self._stops_lock = threading.Lock()
+        super().__init__(*args)
+
+    @contextmanager
+    def _running(self, attempt: Optional[Hashable],
+                 stop: Callable[[], None]):
+        if attempt is None:
+            attempt = object()
+        with self._stops_lock:
+            self._stops[attempt] = stop
+        try:
+            yield
+        finally:
+            with self._stops_lock:
+                self._stops.pop(attempt, None)
+
+    def _stop(self, stop: Callable[[], None]):
+        try:
+            stop()
+        except OSError as e:
+            logger.warning('Could not stop Alpino parse: {}'.format(e))
+
+    def interrupt(self, attempt: Hashable):
+        '''Stop the parse of the given attempt if it is still running'''
+        with self._stops_lock:
+            stop = self._stops.pop(attempt, None)
+        if stop is not None:
+            self._stop(stop)
+
+    def close(self):
+        '''Stop all running parses'''
+        with self._stops_lock:
+            stops = list(self._stops.values())
+            self._stops.clear()
+        for stop in stops:
+            self._stop(stop)
+
+
+class ProcessClient(InterruptibleClient, AlpinoProcessClient):
+    '''Runs the Alpino executable for every sentence; interrupting a
+    parse kills the process group'''
+    def parse_line(self, line: str, sentence_id: str,
+                   attempt: Optional[Hashable] = None) -> str:
+        with TemporaryDirectory() as tmp:
+            process = Popen([self.path, '-notk', '-end_hook=xml', '-flag',
+                             'treebank', tmp, '-parse'] + self.arguments,
+                            stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                            encoding='utf8', start_new_session=True)
+            # Also kill the processes started by the Alpino script
+            with self._running(
+                    attempt, lambda: os.killpg(process.pid, signal.SIGKILL)):
+                stdout, stderr = process.communicate(
+                    '{}|{}\n'.format(sentence_id, line))
+            if process.returncode < 0:
+                raise AlpinoError('Alpino was stopped')
+            if stdout:
+                logger.warning(stdout)
+            if stderr:
+                logger.warning(stderr)
+            with open(os.path.join(tmp, '{}.xml'.format(sentence_id)),
+                      encoding='utf-8') as f:
+                return f.read()
+
+
+class ServerClient(InterruptibleClient, AlpinoServerClient):
+    '''Connects to an Alpino server for every sentence; interrupting a
+    parse closes the connection'''
+    def parse_line(self, line: str, sentence_id: str,
+                   attempt: Optional[Hashable] = None) -> str:
+        # Add a space before closing punctuation, like corpus2alpino
+        line = closing_punctuation.sub(
+            lambda m: m.group(1) + ' ' + m.group(2), line)
+        if self.prefix_id:
+            line = '{}|{}'.format(sentence_id, line)
+        received = []
+        with socket.create_connection((self.host, self.port)) as connection:
+            connection.settimeout(300)
+            with self._running(
+                    attempt, lambda: connection.shutdown(socket.SHUT_RDWR)):
+                connection.sendall((line + '\n\n').encode())
+                while True:
+                    buffer = connection.recv(8192)
+                    if not buffer:
+                        break
+                    received.append(buffer)
+        xml = b''.join(received).decode('utf8')
+        if '<alpino_ds' not in xml:
+            raise AlpinoError(xml or 'Alpino was stopped')
+        if not self.prefix_id:
+            xml = sentence_id_matcher.sub(sentence_id, xml)
+        if self.write_id:
+            xml = sentence_tag_matcher.sub(
+                ' sentid="{}"'.format(sentence_id), xml)
+        return xml
+
+
+def create_client(host_or_path: str,
+                  port_or_args: Union[int, List[str]]) -> InterruptibleClient:
+    '''Return a client for the Alpino executable at the given path (with
+    a list of arguments) or for the Alpino server at the given host and
+    port, like corpus2alpino does'''
+    if os.path.isfile(host_or_path) or os.path.isdir(host_or_path):
+        return ProcessClient(host_or_path, port_or_args)
+    return ServerClient(host_or_path, port_or_args)
+
+
+class AlpinoPool(Annotator):
+    '''Annotator for corpus2alpino that parses the utterances of a document
+    with several Alpino clients at the same time. Utterances are dispatched
+    to a pool of worker threads in batches and the parses are put back in
+    the original order. Parsing a sentence is retried (using the next
+    client) if it fails or does not finish within the timeout. A parse
+    that timed out is interrupted first (if the client supports it, see
+    InterruptibleClient), so that its worker and Alpino process become
+    available again.'''
+    def __init__(self, clients: list, workers: int, batch_size: int,
+                 timeout: float, retries: int):
+        if not clients:
+            raise AlpinoError('No Alpino clients given.')
+        self.clients = clients
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retries = retries
+        self._next_client = itertools.cycle(range(len(clients)))
+        self._executor = ThreadPoolExecutor(workers)
+        self.statistics = {
+            'sentences': 0,
+            'failed': 0,
+            'retries': 0,
+            'timeouts': 0,
+            'seconds': 0.0,
+        }
+
+    def close(self):
+        '''Stop the worker threads without waiting for parses that
+        timed out.'''
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_throughput(self) -> float:
+        '''Return the number of sentences parsed per second'''
+        if not self.statistics['seconds']:
+            return 0.0
+        return self.statistics['sentences'] / self.statistics['seconds']
+
+    def annotate(self, document: Document):
+        utterances = [utterance for utterance in document.utterances
+                      if ANNOTATION_KEY not in utterance.annotations]
+        parses = self.parse_lines([(utterance.text, utterance.id)
+                                   for utterance in utterances])
+        for utterance, (parse, client) in zip(utterances, parses):
+            if parse is None:
+                # The writer of corpus2alpino includes the sentence without
+                # a parse
+                continue
+            # Like AlpinoAnnotator, replace the symbol with a middot to
+            # prevent XML parsing errors
+            utterance.annotations[ANNOTATION_KEY] = \
+                timealign_symbol.sub('·', parse)
+            if client.version:
+                utterance.metadata['alpino_version'] = \
+                    MetadataValue(client.version)
+            if client.version_date:
+                utterance.metadata['alpino_version_date'] = MetadataValue(
+                    client.version_date.isoformat(), 'date')
+
+    def parse_lines(self, lines: List[Tuple[str, str]]) \
+            -> List[Tuple[Optional[str], object]]:
+        '''Parse a list of (sentence, sentence id) tuples and return a list
+        of (parse, client) tuples in the same order. The parse is None if
+        the sentence could not be parsed.'''
+        results = []
+        for start in range(0, len(lines), self.batch_size):
+            results.extend(
+                self._parse_batch(lines[start:start + self.batch_size])
+            )
+        return results
+
+    @staticmethod
+    def _parse_line(client, line: str, sentence_id: str, state: dict):
+        state['started'] = time.monotonic()
+        if hasattr(client, 'interrupt'):
+            return client.parse_line(line, sentence_id,
+                                     attempt=state['attempt'])
+        return client.parse_line(line, sentence_id)
+
+    def _parse_batch(self, lines: List[Tuple[str, str]]) \
+            -> List[Tuple[Optional[str], object]]:
+        batch_start = time.monotonic()
+        results = [(None, None)] * len(lines)
+        attempts = [0] * len(lines)
+        pending = {}
+
+        def submit(index):
+            client = self.clients[next(self._next_client)]
+            attempts[index] += 1
+            state = {'attempt': object()}
+            future = self._executor.submit(self._parse_line, client,
+                                           *lines[index], state)
+            pending[future] = (index, client, state)
+
+        def retry(index, reason):
+            if attempts[index] <= self.retries:
+                self.statistics['retries'] += 1
+                submit(index)
+            else:
+                self.statistics['failed'] += 1
+                logger.error('Could not parse sentence {}: {}'
+                             .format(lines[index][1], reason))
+
+        for index in range(len(lines)):
+            submit(index)
+        while pending:
+            done, _ = wait(pending, timeout=min(1, self.timeout),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                index, client, _ = pending.pop(future)
+                try:
+                    results[index] = (future.result(), client)
+                except Exception as e:
+                    retry(index, e)
+                else:
+                    self.statistics['sentences'] += 1
+            now = time.monotonic()
+            for future, (index, client, state) in list(pending.items()):
+                if future.done():
+                    # Finished after all; collected by the next wait()
+                    continue
+                if now - state.get('started', now) > self.timeout:
+                    # Stop this attempt; its result will be ignored
+                    del pending[future]
+                    interrupt = getattr(client, 'interrupt', None)
+                    if interrupt is not None:
+                        interrupt(state['attempt'])
+                    self.statistics['timeouts'] += 1
+                    retry(index, 'timeout after {} seconds'
+                          .format(self.timeout))
+        self.statistics['seconds'] += time.monotonic() - batch_start
+        return results
+
+
+class AlpinoClientPool:
+    '''Pool of Alpino clients for parsing single sentences of concurrent
+    requests. Every client (a connection to a server or a way to start the
+    executable) parses one sentence at a time; requests wait in a queue for
+    a free client. If too many requests are waiting, or waiting takes too
+    long, AlpinoBusyError is raised, so that requests are refused instead
+    of piling up.
+
+    A client that does not finish parsing within the timeout is considered
+    hung: it is closed (stopping its Alpino process or connection) and
+    replaced by a new client created with the same factory. The thread
+    waiting for the hung parse is abandoned; if maximum_abandoned of those
+    threads are still running, requests are refused with AlpinoBusyError
+    until they finish. Clients that have not been used for
+    health_check_interval seconds are checked by determining the Alpino
+    version before they are used again, and replaced if that fails.'''
+    def __init__(self, factories: List[Callable[[], object]],
+                 timeout: float, queue_size: int, queue_timeout: float,
+                 health_check_interval: float, maximum_abandoned: int = 10):
+        if not factories:
+            raise AlpinoError('No Alpino clients given.')
+        self.factories = factories
+        self.timeout = timeout
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.health_check_interval = health_check_interval
+        self.maximum_abandoned = maximum_abandoned
+        self.statistics = Counter()
+        self._waiting = 0
+        self._abandoned = []
+        self._lock = threading.Lock()
+        # Idle clients as (factory index, client, time of last use);
+        # the client is None if it has to be created (again)
+        self._idle = queue.Queue()
+        for index in range(len(factories)):
+            self._idle.put((index, None, None))
+
+    @property
+    def size(self) -> int:
+        '''Number of sentences that can be parsed at the same time'''
+        return len(self.factories)
+
+    def _create(self, index: int):
+        self.statistics['created'] += 1
+        try:
+            return self.factories[index]()
+        except Exception as e:
+            raise AlpinoError('Cannot start Alpino client: {}'.format(e))
+
+    def _close(self, index: int, client) -> None:
+        '''Stop the parses of a client that is replaced'''
+        close = getattr(client, 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception:
+            logger.exception('Could not close Alpino client {}'.format(index))
+
+    def _call(self, function: Callable, *args):
+        '''Call a function with a client in a separate thread and return
+        its result. Raises TimeoutError if it takes longer than the
+        timeout.'''
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = function(*args)
+            except Exception as e:
+                outcome['error'] = e
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(self.timeout)
+        if thread.is_alive():
+            with self._lock:
+                self._abandoned.append(thread)
+            raise TimeoutError
+        if 'error' in outcome:
+            raise AlpinoError(str(outcome['error']))
+        return outcome['result']
+
+    def _acquire(self) -> Tuple[int, object]:
+        with self._lock:
+            self._abandoned = [thread for thread in self._abandoned
+                               if thread.is_alive()]
+            if len(self._abandoned) >= self.maximum_abandoned:
+                self.statistics['refused'] += 1
+                raise AlpinoBusyError('Too many parses that took too long '
+                                      'are still running.')
+            if self._waiting >= self.queue_size + self._idle.qsize():
+                self.statistics['refused'] += 1
+                raise AlpinoBusyError('Too many sentences are waiting to be '
+                                      'parsed.')
+            self._waiting += 1
+        try:
+            index, client, last_used = \
+                self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            self.statistics['refused'] += 1
+            raise AlpinoBusyError('No Alpino parser became available within '
+                                  '{} seconds.'.format(self.queue_timeout))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        try:
+            if client is not None and \
+                    time.monotonic() - last_used > self.health_check_interval:
+                self.statistics['health_checks'] += 1
+                if not self.check_health(client):
+                    logger.warning('Alpino client {} is not healthy and will '
+                                   'be restarted'.format(index))
+                    self._close(index, client)
+                    client = None
+            if client is None:
+                client = self._create(index)
+        except Exception:
+            self._idle.put((index, None, None))
+            raise
+        return index, client
+
+    def check_health(self, client) -> bool:
+        '''Return True if the client can determine the Alpino version
+        within the timeout'''
+        try:
+            self._call(alpino.get_alpino_version, client)
+        except (AlpinoError, TimeoutError):
+            return False
+        return True
+
+    def parse_line(self, line: str, sentence_id: str) -> str:
+        '''Parse a sentence with the first available client. Raises
+        AlpinoBusyError if no client becomes available and AlpinoError if
+        parsing fails or takes too long.'''
+        index, client = self._acquire()
+        try:
+            parse = self._call(client.parse_line, line, sentence_id)
+        except TimeoutError:
+            self.statistics['timeouts'] += 1
+            logger.warning('Alpino client {} did not parse sentence {} '
+                           'within {} seconds and will be restarted'
+                           .format(index, sentence_id, self.timeout))
+            self._close(index, client)
+            # Restarted when it is needed again
+            self._idle.put((index, None, None))
+            raise AlpinoError('Parsing took longer than {} seconds.'
+                              .format(self.timeout))
+        except AlpinoError:
+            self.statistics['failed'] += 1
+            self._idle.put((index, client, time.monotonic()))
+            raise
+        self.statistics['sentences'] += 1
+        self._idle.put((index, client, time.monotonic()))
+        return parse
+
+
 class AlpinoService:
     client = None
+    version = None
+    client_pool = None
 
     def initialize(self):
         '''Connect to the Alpino server or the executable. The client
@@ -18,34 +461,86 @@ class AlpinoService:
         if self.client is None:
             try:
                 if settings.ALPINO_HOST and settings.ALPINO_PORT:
-                    annotator = AlpinoAnnotator(
+                    self.client = create_client(
                         settings.ALPINO_HOST, settings.ALPINO_PORT
                     )
                 elif settings.ALPINO_PATH:
-                    annotator = AlpinoAnnotator(
+                    self.client = create_client(
                         settings.ALPINO_PATH, []
                     )
                 else:
                     raise AlpinoError('Alpino has not been configured.')
-                self.client = annotator.client
-                self.annotator = annotator
+                self.version = None
+                self.client_pool = None
             except Exception as e:
                 raise AlpinoError(str(e))
 
-    def get_alpino_version(self):
+    def create_pool(self) -> AlpinoPool:
+        '''Return an AlpinoPool to parse many sentences in parallel, using
+        the client of this service and the servers in ALPINO_EXTRA_SERVERS.
+        The pool should be closed after use. initialize() should be called
+        first.'''
         if not self.client:
             raise AlpinoError('Alpino service not initialized')
+        clients = [self.client]
+        if settings.ALPINO_HOST and settings.ALPINO_PORT:
+            for host, port in settings.ALPINO_EXTRA_SERVERS:
+                try:
+                    clients.append(create_client(host, port))
+                except Exception as e:
+                    logger.warning('Cannot use Alpino server {}:{}: {}'
+                                   .format(host, port, e))
+        return AlpinoPool(clients, settings.ALPINO_PARSE_WORKERS,
+                          settings.ALPINO_PARSE_BATCH_SIZE,
+                          settings.ALPINO_PARSE_TIMEOUT,
+                          settings.ALPINO_PARSE_RETRIES)
+
+    def get_client_pool(self) -> AlpinoClientPool:
+        '''Return the AlpinoClientPool of this process, which is used to
+        parse single sentences. It has ALPINO_POOL_SIZE clients for the
+        server given by ALPINO_HOST and ALPINO_PORT and for each of
+        ALPINO_EXTRA_SERVERS, or ALPINO_POOL_SIZE clients running the
+        executable. initialize() should be called first.'''
+        if not self.client:
+            raise AlpinoError('Alpino service not initialized')
+        if self.client_pool is None:
+            if settings.ALPINO_HOST and settings.ALPINO_PORT:
+                servers = [(settings.ALPINO_HOST, settings.ALPINO_PORT)] + \
+                    list(settings.ALPINO_EXTRA_SERVERS)
+            else:
+                servers = [(settings.ALPINO_PATH, [])]
+            factories = [
+                lambda server=server: create_client(*server)
+                for server in servers
+                for _ in range(settings.ALPINO_POOL_SIZE)
+            ]
+            self.client_pool = AlpinoClientPool(
+                factories, settings.ALPINO_POOL_TIMEOUT,
+                settings.ALPINO_POOL_QUEUE_SIZE,
+                settings.ALPINO_POOL_QUEUE_TIMEOUT,
+                settings.ALPINO_HEALTH_CHECK_INTERVAL,
+                settings.ALPINO_POOL_MAXIMUM_ABANDONED
+            )
+        return self.client_pool
+
+    def get_alpino_version(self, client=None):
+        '''Return the Alpino version reported by the client of this service
+        or the given client'''
+        client = client or self.client
+        if not client:
+            raise AlpinoError('Alpino service not initialized')
         try:
-            parsed_sentence = self.client.parse_line('hoi', 'test_line') \
-                .encode()  # Encode to bytes because lxml.etree expects that
+            parsed_sentence = client.parse_line('hoi', 'test_line')
         except Exception as e:
             raise AlpinoError(str(e))
-        try:
-            tree = etree.fromstring(parsed_sentence)
-            version = tree.xpath('/alpino_ds/@version')[0]
-        except etree.ParseError as e:
-            raise AlpinoError(str(e))
-        return version
+        return get_version_of_parse(parsed_sentence)
+
+    def get_cached_version(self) -> str:
+        '''Return the Alpino version, which is only determined (using
+        get_alpino_version) the first time after initializing'''
+        if self.version is None:
+            self.version = self.get_alpino_version()
+        return self.version
 
 
 alpino = AlpinoService()
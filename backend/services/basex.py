@@ -1,21 +1,61 @@
 from BaseXClient import BaseXClient
+from lxml import etree
 
 from django.conf import settings
 
+from .metrics import BaseXQueryTimer
+
+# Database options that enable an index structure
+INDEX_OPTIONS = ('TEXTINDEX', 'ATTRINDEX', 'TOKENINDEX', 'FTINDEX')
+
+# Number of bytes sent at once when streaming input to BaseX
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class Session(BaseXClient.Session):
+    """BaseX client session that can also create databases from a binary
+    stream instead of a string, to avoid keeping large documents in
+    memory."""
+
+    def create_from_stream(self, name, stream):
+        """Create a new database from the UTF-8 encoded contents of a
+        binary file-like object, which is sent to BaseX in chunks"""
+        # The BaseXClient library only accepts strings, so we have to write
+        # to its (private) socket wrapper ourselves
+        swrapper = self._Session__swrapper
+        # Command 8 is CREATE, see https://docs.basex.org/wiki/Server_Protocol
+        swrapper.sendall(b'\x08' + name.encode() + b'\x00')
+        while True:
+            chunk = stream.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            # Bytes 0x00 and 0xFF have to be escaped (they do not occur in
+            # valid UTF-8 encoded XML anyway)
+            swrapper.sendall(chunk.replace(b'\xff', b'\xff\xff')
+                             .replace(b'\x00', b'\xff\x00'))
+        swrapper.sendall(b'\x00')
+        info = self.recv_c_str()
+        if not self.server_response_success():
+            raise IOError(info)
+
 
 class BaseXService:
-    def perform_query(self, query):
+    def perform_query(self, query, database='', query_type='other'):
         """Open a session, create a query, execute it, close the session
-        and result the result"""
-        session = self.get_session()
-        response = session.query(query).execute()
-        session.close()
+        and result the result. The database and the type of the query are
+        used to label the metrics of the query."""
+        with BaseXQueryTimer(database, query_type) as timer:
+            session = self.get_session()
+            response = session.query(query).execute()
+            session.close()
+            timer.count(response)
         return response
 
-    def perform_query_iter(self, query):
-        session = self.get_session()
-        yield from session.query(query).iter()
-        session.close()
+    def perform_query_iter(self, query, database='', query_type='other'):
+        with BaseXQueryTimer(database, query_type) as timer:
+            session = self.get_session()
+            yield from timer.iterate(session.query(query).iter())
+            session.close()
 
     def execute(self, command):
         """Open a session, execute a command, close the session
@@ -26,13 +66,63 @@ class BaseXService:
         return response
 
     def create(self, name, content):
-        """Open a session, create a database and close the session"""
+        """Open a session, create a database with the index options in
+        the BASEX_DATABASE_OPTIONS setting and close the session. The
+        indexes are built while creating the database, so it does not have
+        to be optimized. The content can be a string or a binary file-like
+        object containing UTF-8 encoded XML, which will be streamed to
+        BaseX."""
         session = self.get_session()
-        session.create(name, content)
+        for option, value in settings.BASEX_DATABASE_OPTIONS.items():
+            session.execute('SET {} {}'.format(option, str(value).lower()))
+        if isinstance(content, str):
+            session.create(name, content)
+        else:
+            session.create_from_stream(name, content)
         session.close()
 
+    def get_index_status(self, name) -> dict:
+        """Return a dictionary with the state of the index structures of
+        a database as reported by BaseX, e.g. {'uptodate': True,
+        'attrindex': True, ...}. Raises an OSError if the database does not
+        exist."""
+        result = self.perform_query('db:info("{}")/indexes'.format(name),
+                                    name, 'index_status')
+        try:
+            indexes = etree.fromstring(result)
+        except etree.XMLSyntaxError as err:
+            raise OSError('Cannot parse index information: {}'.format(err))
+        status = {}
+        for element in indexes:
+            if element.text in ('true', 'false'):
+                status[element.tag] = element.text == 'true'
+        return status
+
+    def needs_optimization(self, name) -> bool:
+        """Return True if the index structures of a database are outdated
+        or if indexes required by BASEX_DATABASE_OPTIONS are missing"""
+        status = self.get_index_status(name)
+        if not status.get('uptodate', False):
+            return True
+        for option, value in settings.BASEX_DATABASE_OPTIONS.items():
+            if option in INDEX_OPTIONS and value is True and \
+                    not status.get(option.lower(), False):
+                return True
+        return False
+
+    def optimize(self, name):
+        """Rebuild all index structures of a database, creating the indexes
+        required by BASEX_DATABASE_OPTIONS"""
+        options = ', '.join(
+            "'{}': {}()".format(option.lower(), str(value).lower())
+            for option, value in settings.BASEX_DATABASE_OPTIONS.items()
+            if option in INDEX_OPTIONS
+        )
+        self.perform_query('db:optimize("{}", true(), map {{ {} }})'
+                           .format(name, options), name, 'optimize')
+
     def get_session(self):
-        session = BaseXClient.Session(
+        session = Session(
                     settings.BASEX_HOST,
                     settings.BASEX_PORT,
                     settings.BASEX_USER,
@@ -0,0 +1,248 @@
+'''Metrics of the search pipeline. Every measurement is exported to
+Prometheus (see the metrics view) and can also be recorded for a single
+search query by measuring inside a recording() block, which is used to
+store the metrics of a query in SearchQuery.metrics.
+
+When running multiple worker processes (e.g. gunicorn and Celery), set the
+PROMETHEUS_MULTIPROC_DIR environment variable to a directory shared by all
+processes, so that the metrics view reports the metrics of all of them.
+
+BaseX metrics are not labelled by database, because sharding creates new
+database names with every (re)shard and every name would add series to
+Prometheus. The time spent per database is only recorded for single search
+queries.'''
+
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, Optional
+
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from prometheus_client import Counter, Histogram
+
+# Buckets for durations, from a millisecond to ten minutes
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                    5, 10, 30, 60, 120, 300, 600)
+
+BASEX_QUERY_SECONDS = Histogram(
+    'gretel_basex_query_seconds',
+    'Time spent waiting for results of BaseX queries',
+    ['query_type'], buckets=DURATION_BUCKETS
+)
+BASEX_QUERY_ERRORS = Counter(
+    'gretel_basex_query_errors', 'BaseX queries that failed',
+    ['query_type']
+)
+BASEX_STREAMED_BYTES = Counter(
+    'gretel_basex_streamed_bytes',
+    'Size of the items received from BaseX (UTF-8 encoded)',
+    ['query_type']
+)
+CACHE_READ_SECONDS = Histogram(
+    'gretel_cache_read_seconds',
+    'Time spent reading result cache files', buckets=DURATION_BUCKETS
+)
+CACHE_PARSE_SECONDS = Histogram(
+    'gretel_cache_parse_seconds',
+    'Time spent parsing the contents of result cache files',
+    buckets=DURATION_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    'gretel_cache_requests',
+    'Component searches that were answered from the result cache (hit) or '
+    'had to be searched in BaseX (miss)',
+    ['result']
+)
+FILTER_SECONDS = Histogram(
+    'gretel_filter_seconds',
+    'Time spent applying result filters of search queries',
+    buckets=DURATION_BUCKETS
+)
+SEARCH_RESULTS = Counter(
+    'gretel_search_results', 'Results found by component searches'
+)
+SEARCH_RESULTS_PER_SECOND = Histogram(
+    'gretel_search_results_per_second',
+    'Number of results found per second by component searches',
+    buckets=(1, 10, 100, 1000, 10000, 100000)
+)
+PARSE_CACHE_REQUESTS = Counter(
+    'gretel_parse_cache_requests',
+    'Sentences of which the parse was found in the parse cache (hit) or '
+    'had to be parsed by Alpino (miss)',
+    ['result']
+)
+ALPINO_PARSE_SECONDS = Histogram(
+    'gretel_alpino_parse_seconds',
+    'Time spent parsing single sentences with Alpino',
+    buckets=DURATION_BUCKETS
+)
+CELERY_QUEUE_WAIT_SECONDS = Histogram(
+    'gretel_celery_queue_wait_seconds',
+    'Time between publishing Celery tasks and their start',
+    ['task'], buckets=DURATION_BUCKETS
+)
+CELERY_TASK_SECONDS = Histogram(
+    'gretel_celery_task_seconds', 'Duration of Celery tasks',
+    ['task', 'state'], buckets=DURATION_BUCKETS
+)
+
+# Name of the Celery message header containing the time of publishing
+PUBLISHED_HEADER = 'gretel_published'
+
+
+class Recorder:
+    '''Totals of the measurements made while recording'''
+
+    def __init__(self):
+        self.values: Dict[str, float] = defaultdict(float)
+
+    def add(self, key: str, value: float) -> None:
+        self.values[key] += value
+
+    def as_dict(self) -> Dict[str, float]:
+        return {key: round(value, 6) for key, value
+                in sorted(self.values.items())}
+
+
+_recorder: ContextVar[Optional[Recorder]] = ContextVar('recorder',
+                                                       default=None)
+
+
+@contextmanager
+def recording() -> Iterator[Recorder]:
+    '''Record the measurements made in this block (in the current thread)
+    in the Recorder that is returned. Recordings can be nested; the
+    measurements are then also added to the enclosing recording.'''
+    recorder = Recorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+        outer = _recorder.get()
+        if outer is not None:
+            for key, value in recorder.values.items():
+                outer.add(key, value)
+
+
+def record(key: str, value: float) -> None:
+    '''Add a value to the active recording, if any'''
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.add(key, value)
+
+
+class BaseXQueryTimer:
+    '''Measure the time spent waiting for a BaseX query and the size of its
+    result. Use as context manager, and wrap the iterator of the results
+    with iterate() to measure streamed results only while waiting for them,
+    not while they are being processed.'''
+
+    def __init__(self, database: str, query_type: str):
+        self.database = database
+        self.query_type = query_type
+        self.seconds = 0.0
+        self.size = 0
+        self.streamed = False
+
+    def iterate(self, items: Iterable) -> Iterator:
+        self.streamed = True
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.seconds += time.perf_counter() - start
+            self.count(item[1])
+            yield item
+
+    def count(self, result: str) -> None:
+        self.size += len(result.encode('utf-8'))
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.streamed:
+            self.seconds = time.perf_counter() - self.start
+        if exc_type is not None and exc_type is not GeneratorExit:
+            BASEX_QUERY_ERRORS.labels(self.query_type).inc()
+        BASEX_QUERY_SECONDS.labels(self.query_type).observe(self.seconds)
+        BASEX_STREAMED_BYTES.labels(self.query_type).inc(self.size)
+        record('basex_{}_queries'.format(self.query_type), 1)
+        record('basex_{}_seconds'.format(self.query_type), self.seconds)
+        record('basex_{}_bytes'.format(self.query_type), self.size)
+        if self.database:
+            # Does not end with _seconds, so that it is not counted twice
+            # as a phase of profiled requests
+            record('database_seconds:{}'.format(self.database),
+                   self.seconds)
+
+
+@contextmanager
+def measure(histogram: Optional[Histogram], key: str) -> Iterator[None]:
+    '''Observe the duration of this block in a histogram without labels (if
+    given) and add it to the active recording with the given key'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if histogram is not None:
+            histogram.observe(duration)
+        record(key, duration)
+
+
+def count_cache_requests(hit: bool, number: int = 1) -> None:
+    CACHE_REQUESTS.labels('hit' if hit else 'miss').inc(number)
+    record('cache_hits' if hit else 'cache_misses', number)
+
+
+def count_parse_cache_request(hit: bool) -> None:
+    PARSE_CACHE_REQUESTS.labels('hit' if hit else 'miss').inc()
+    record('parse_cache_hits' if hit else 'parse_cache_misses', 1)
+
+
+def observe_search(results: int, seconds: float) -> None:
+    '''Register the number of results of a component search that took the
+    given number of seconds'''
+    SEARCH_RESULTS.inc(results)
+    if seconds > 0:
+        SEARCH_RESULTS_PER_SECOND.observe(results / seconds)
+    record('search_results', results)
+    record('search_seconds', seconds)
+
+
+# Celery tasks are measured using signals. The time of publishing is added
+# as message header, which can be read from the request of the task.
+_task_starts: Dict[str, float] = {}
+
+
+@before_task_publish.connect
+def _add_published_header(headers=None, **kwargs):
+    if headers is not None:
+        headers[PUBLISHED_HEADER] = time.time()
+
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    _task_starts[task_id] = time.perf_counter()
+    published = getattr(task.request, PUBLISHED_HEADER, None)
+    if published is not None:
+        wait = max(0.0, time.time() - published)
+        CELERY_QUEUE_WAIT_SECONDS.labels(task.name).observe(wait)
+        task.request.queue_wait = wait
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    start = _task_starts.pop(task_id, None)
+    if start is not None:
+        CELERY_TASK_SECONDS.labels(task.name, state or 'UNKNOWN') \
+            .observe(time.perf_counter() - start)
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1000)),
+                ('method', models.CharField(max_length=10)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('duration', models.FloatField(help_text='Wall time in seconds')),
+                ('phases', models.JSONField(default=dict, help_text='Wall time in seconds spent in the phases of handling the request')),
+                ('summary', models.TextField(blank=True, help_text='Functions with the highest cumulative time')),
+            ],
+        ),
+    ]
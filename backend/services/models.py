@@ -0,0 +1,58 @@
+from django.db import models
+from django.conf import settings
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+import logging
+import pathlib
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileReport(models.Model):
+    '''Profile of a request, made by services.profiling.ProfilingMiddleware.
+    The cProfile statistics are stored in a file in the PROFILING_DIR
+    directory, which can be downloaded from the admin and inspected with
+    e.g. pstats or snakeviz.'''
+    path = models.CharField(max_length=1000)
+    method = models.CharField(max_length=10)
+    status_code = models.PositiveSmallIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    duration = models.FloatField(help_text='Wall time in seconds')
+    phases = models.JSONField(
+        default=dict,
+        help_text='Wall time in seconds spent in the phases of handling the '
+                  'request'
+    )
+    summary = models.TextField(
+        blank=True, help_text='Functions with the highest cumulative time'
+    )
+
+    def __str__(self):
+        return '{} {} ({:.2f} s)'.format(self.method, self.path,
+                                         self.duration)
+
+    def get_profile_path(self) -> pathlib.Path:
+        settings.PROFILING_DIR.mkdir(exist_ok=True, parents=True)
+        return settings.PROFILING_DIR / '{}.prof'.format(self.id)
+
+    def delete_profile_file(self):
+        self.get_profile_path().unlink(missing_ok=True)
+
+    @classmethod
+    def purge(cls) -> int:
+        '''Delete the oldest reports if there are more than the
+        PROFILING_MAXIMUM_REPORTS setting. Return the number of deleted
+        reports.'''
+        obsolete = cls.objects.order_by('-created') \
+            .values_list('id', flat=True)[settings.PROFILING_MAXIMUM_REPORTS:]
+        count = 0
+        for report in cls.objects.filter(id__in=list(obsolete)):
+            report.delete()
+            count += 1
+        return count
+
+
+@receiver(pre_delete, sender=ProfileReport)
+def delete_profile_file_callback(sender, instance, using, **kwargs):
+    instance.delete_profile_file()
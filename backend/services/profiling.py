@@ -0,0 +1,129 @@
+'''Opt-in profiling of requests. A fraction PROFILING_SAMPLE_RATE of the
+requests to paths starting with one of PROFILING_PATHS is profiled, as well
+as requests having the X-Gretel-Profile header if PROFILING_ALLOW_HEADER is
+set. For every profiled request a ProfileReport is stored with the cProfile
+statistics and the wall time per phase; the ID of the report is returned in
+the X-Gretel-Profile response header.'''
+
+import cProfile
+import io
+import logging
+import pstats
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import measure, recording, record, Recorder
+from .models import ProfileReport
+
+logger = logging.getLogger(__name__)
+
+REQUEST_HEADER = 'HTTP_X_GRETEL_PROFILE'
+RESPONSE_HEADER = 'X-Gretel-Profile'
+
+# Phases and the keys of the measurements (see services.metrics) that they
+# consist of; keys ending with * are prefixes
+PHASES = {
+    'db': ['db_seconds'],
+    'basex': ['basex_*'],
+    'cache': ['cache_read_seconds'],
+    'parse': ['cache_parse_seconds', 'alpino_seconds'],
+    'filter': ['filter_seconds'],
+    'serialize': ['serialize_seconds'],
+}
+
+# Number of functions listed in the summary of a report
+SUMMARY_LENGTH = 40
+
+
+def get_phases(recorder: Recorder, duration: float) -> dict:
+    '''Return the seconds spent in every phase of a request that took the
+    given duration, including the time not spent in any of the phases'''
+    phases = dict.fromkeys(PHASES, 0.0)
+    for key, value in recorder.values.items():
+        if not key.endswith('_seconds'):
+            continue
+        for phase, patterns in PHASES.items():
+            if any(key == pattern or pattern.endswith('*') and
+                   key.startswith(pattern[:-1]) for pattern in patterns):
+                phases[phase] += value
+    phases['other'] = max(0.0, duration - sum(phases.values()))
+    return {phase: round(value, 6) for phase, value in phases.items()}
+
+
+def _time_database_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db_seconds', time.perf_counter() - start)
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request) -> bool:
+        if not request.path.startswith(tuple(settings.PROFILING_PATHS)):
+            return False
+        if settings.PROFILING_ALLOW_HEADER and REQUEST_HEADER in request.META:
+            return True
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        request.profiled = True
+        profiler = cProfile.Profile()
+        with recording() as recorder, \
+                connection.execute_wrapper(_time_database_query):
+            start = time.perf_counter()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another request is being profiled (only one profiler can
+                # be active at the same time since Python 3.12)
+                return self.get_response(request)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - start
+        try:
+            report = self.save_report(request, response, duration, recorder,
+                                      profiler)
+        except OSError as err:
+            logger.error('Cannot save profile of request: {}'.format(err))
+        else:
+            response[RESPONSE_HEADER] = str(report.id)
+        return response
+
+    def process_template_response(self, request, response):
+        '''Measure the rendering of responses (e.g. to JSON by Django REST
+        framework) of profiled requests'''
+        if getattr(request, 'profiled', False):
+            render = response.render
+
+            def measured_render():
+                with measure(None, 'serialize_seconds'):
+                    return render()
+            response.render = measured_render
+        return response
+
+    def save_report(self, request, response, duration: float,
+                    recorder: Recorder,
+                    profiler: cProfile.Profile) -> ProfileReport:
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative') \
+            .print_stats(SUMMARY_LENGTH)
+        report = ProfileReport.objects.create(
+            path=request.path[:1000], method=request.method,
+            status_code=response.status_code, duration=duration,
+            phases=get_phases(recorder, duration),
+            summary=summary.getvalue()
+        )
+        profiler.dump_stats(report.get_profile_path())
+        ProfileReport.purge()
+        return report
@@ -0,0 +1,535 @@
+'''Utilities shared by tests and benchmarks.
+
+FakeBaseXServer is an in-process stand-in for a BaseX server, so that tests
+and load benchmarks do not need a real BaseX server (and Java). It
+implements the client/server protocol used by BaseXClient.Session (see
+https://docs.basex.org/wiki/Server_Protocol): authentication, commands,
+queries (including iterating over results) and creating databases.
+
+Databases are kept in memory as lxml trees. The queries generated in
+search.basex_search are evaluated with lxml (variables of search queries
+are not supported); other queries and commands can be given scripted
+responses. Latency and failures can be injected to test behaviour under
+load, e.g. with slow databases.'''
+
+import hashlib
+import itertools
+import random
+import re
+import socketserver
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Union
+
+from django.test import override_settings
+from lxml import etree
+
+from benchmarks.synthetic import format_match, format_metadata_counts
+
+# Realm sent to clients when authenticating
+REALM = 'BaseX'
+# Type code of result items (xs:string); BaseXClient passes it on but it is
+# not used by GrETEL
+ITEM_TYPE = 82
+# Protocol codes of query and input requests; other requests are commands
+QUERY_CODES = {0, 2, 3, 4, 5, 6, 7, 14, 30, 31}
+INPUT_CODES = {8, 9, 12, 13}
+SPECIAL_BYTE = re.compile(b'[\x00\xff]')
+INDEXES = '<indexes><uptodate>true</uptodate><textindex>true</textindex>' \
+          '<attrindex>true</attrindex><tokenindex>true</tokenindex>' \
+          '<ftindex>true</ftindex></indexes>'
+DATABASE_NAME = re.compile(r'db:(?:open|open-pre|property|info)\("([^"]+)"')
+
+# A scripted response is a string, a list of result items, an exception
+# (which is returned as an error) or a function of the regular expression
+# match returning one of these
+Response = Union[str, List[str], Exception,
+                 Callable[['re.Match'], Union[str, List[str]]]]
+
+
+class QueryError(Exception):
+    '''Error that is returned to the client'''
+    pass
+
+
+class Database:
+    def __init__(self, content: bytes):
+        parser = etree.XMLParser(huge_tree=True)
+        self.tree = etree.ElementTree(etree.fromstring(content, parser))
+        self.size = len(content)
+        self._elements = None
+
+    @property
+    def elements(self) -> List[etree._Element]:
+        '''All elements in document order; the index of an element plus one
+        is used as its pre value'''
+        if self._elements is None:
+            self._elements = list(self.tree.getroot().iter())
+        return self._elements
+
+    def xpath(self, xpath: str) -> list:
+        try:
+            return self.tree.xpath(xpath)
+        except etree.XPathError as err:
+            raise QueryError('Cannot evaluate {}: {}'.format(xpath, err))
+
+
+class _Reader:
+    '''Buffered reading of 0-terminated strings from a socket'''
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def _fill(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise EOFError
+        self.buffer.extend(data)
+
+    def peek_byte(self) -> int:
+        if not self.buffer:
+            self._fill()
+        return self.buffer[0]
+
+    def read_byte(self) -> int:
+        byte = self.peek_byte()
+        del self.buffer[0]
+        return byte
+
+    def read_string(self) -> str:
+        while True:
+            position = self.buffer.find(b'\x00')
+            if position >= 0:
+                result = bytes(self.buffer[:position])
+                del self.buffer[:position + 1]
+                return result.decode()
+            self._fill()
+
+    def read_escaped(self) -> bytes:
+        '''Read input in which bytes 0x00 and 0xFF are escaped by 0xFF'''
+        result = bytearray()
+        while True:
+            match = SPECIAL_BYTE.search(self.buffer)
+            if match is None:
+                result.extend(self.buffer)
+                self.buffer.clear()
+                self._fill()
+                continue
+            position = match.start()
+            result.extend(self.buffer[:position])
+            if self.buffer[position] == 0:
+                del self.buffer[:position + 1]
+                return bytes(result)
+            if position + 1 == len(self.buffer):
+                del self.buffer[:position]
+                self._fill()
+                continue
+            result.append(self.buffer[position + 1])
+            del self.buffer[:position + 2]
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        fake = self.server.fake
+        fake._session_started()
+        try:
+            reader = _Reader(self.request)
+            if self.authenticate(reader, fake):
+                self.serve(reader, fake)
+        except (EOFError, OSError):
+            # Client disconnected, e.g. when a search was cancelled
+            pass
+        finally:
+            fake._session_ended()
+
+    def send(self, *parts: Union[bytes, str]):
+        self.request.sendall(b''.join(
+            part.encode() if isinstance(part, str) else part
+            for part in parts
+        ))
+
+    def authenticate(self, reader, fake) -> bool:
+        nonce = str(random.getrandbits(64))
+        self.send(REALM, ':', nonce, b'\x00')
+        user = reader.read_string()
+        received = reader.read_string()
+        code = '{}:{}:{}'.format(user, REALM, fake.password).encode()
+        expected = hashlib.md5(
+            hashlib.md5(code).hexdigest().encode() + nonce.encode()
+        ).hexdigest()
+        if user == fake.user and received == expected:
+            self.send(b'\x00')
+            return True
+        self.send(b'\x01')
+        return False
+
+    def serve(self, reader, fake):
+        queries = {}
+        query_ids = itertools.count()
+        while True:
+            code = reader.peek_byte()
+            if code in QUERY_CODES:
+                reader.read_byte()
+                self.handle_query(code, reader, fake, queries, query_ids)
+            elif code in INPUT_CODES:
+                reader.read_byte()
+                name = reader.read_string()
+                content = reader.read_escaped()
+                try:
+                    if code != 8:
+                        raise QueryError('Only CREATE is supported.')
+                    fake._delay(name)
+                    fake.create_database(name, content)
+                except QueryError as err:
+                    self.send(str(err), b'\x00\x01')
+                else:
+                    self.send("Database '{}' created.".format(name),
+                              b'\x00\x00')
+            else:
+                command = reader.read_string()
+                if command == 'exit':
+                    return
+                try:
+                    result = fake.execute(command)
+                except QueryError as err:
+                    self.send(b'\x00', str(err), b'\x00\x01')
+                else:
+                    self.send(result, b'\x00\x00\x00')
+
+    def handle_query(self, code, reader, fake, queries, query_ids):
+        if code == 0:
+            query_id = str(next(query_ids))
+            queries[query_id] = reader.read_string()
+            self.send(query_id, b'\x00\x00')
+            return
+        query_id = reader.read_string()
+        if code == 3:
+            # Binding: name, value and type follow
+            for _ in range(3):
+                reader.read_string()
+        elif code == 14:
+            # Context: value and type follow
+            for _ in range(2):
+                reader.read_string()
+        if code == 2:
+            queries.pop(query_id, None)
+        if code not in (4, 5):
+            self.send(b'\x00\x00')
+            return
+        try:
+            items = fake.query(queries[query_id])
+        except QueryError as err:
+            self.send(b'\x00\x01', str(err), b'\x00')
+            return
+        if code == 5:
+            self.send('\n'.join(items), b'\x00\x00')
+            return
+        for number, item in enumerate(items):
+            if number and fake.item_latency:
+                time.sleep(fake.item_latency)
+            self.send(bytes([ITEM_TYPE]), item, b'\x00')
+        self.send(b'\x00\x00')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeBaseXServer:
+    '''A BaseX server stand-in running in a thread of the current process.
+    Use it as a context manager and use settings() to let GrETEL connect to
+    it, e.g.
+
+        with FakeBaseXServer() as server, server.settings():
+            server.add_database('TEST', b'<treebank>...</treebank>')
+            basex.perform_query(...)
+
+    The given latency (in seconds) is added to every request, item_latency
+    between the items of results that are iterated over, and a fraction
+    failure_rate of requests fails at random.'''
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 user: str = 'admin', password: str = 'admin',
+                 latency: float = 0.0, item_latency: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.item_latency = item_latency
+        self.failure_rate = failure_rate
+        self.databases: Dict[str, Database] = {}
+        self.statistics = Counter()
+        self.active_sessions = 0
+        self._random = random.Random(seed)
+        self._database_latency: Dict[str, float] = {}
+        self._failing_databases: Dict[str, str] = {}
+        self._scripted = []
+        self._lock = threading.Lock()
+        self._server: Optional[_Server] = None
+        self._builtin = [
+            (re.compile(pattern, re.DOTALL), handler)
+            for pattern, handler in [
+                (r'^for \$node in db:open\("([^"]+)"\)(?:/treebank)?(.*?)'
+                 r' let \$tree := ', self._search),
+                (r'^count\(db:open\("([^"]+)"\)(?:/treebank)?(.*)\)$',
+                 self._count),
+                (r'^sum\(db:open\("([^"]+)"\)/treebank(.*)'
+                 r'/xs:integer\(@end\)\)$', self._sum_end),
+                (r'^db:property\("([^"]+)", "size"\)$', self._size),
+                (r'^let \$top := db:open\("([^"]+)"\)/treebank/alpino_ds'
+                 r'/node\[@cat="top"\] return concat\(', self._statistics),
+                (r'^<metadata>.*?in db:open\("([^"]+)"\)(.*?)\s*return'
+                 r' \$node/ancestor::alpino_ds/metadata/meta',
+                 self._metadata_count),
+                (r'^db:open\("([^"]+)"\)/treebank/alpino_ds'
+                 r'(?:\[@id="([^"]*)"\])?$', self._sentences),
+                (r'^db:open-pre\("([^"]+)", (\d+)\)\[self::alpino_ds\]'
+                 r'\[@id="([^"]*)"\]$', self._sentence_at),
+                (r'^for \$s in db:open\("([^"]+)"\)/treebank/alpino_ds'
+                 r' return concat\(db:node-pre\(\$s\)', self._positions),
+                (r'^for \$a in db:open\("([^"]+)"\)/treebank//node/'
+                 r'\(([^)]*)\) ', self._attribute_counts),
+                (r'^data\(db:open\("([^"]+)"\)/treebank/alpino_ds\[1\]'
+                 r'/@version\)$', self._version),
+                (r'^db:info\("([^"]+)"\)/indexes$',
+                 lambda match: [INDEXES]),
+                (r'^db:optimize\("([^"]+)"', lambda match: []),
+                (r'^xquery:parse\(',
+                 lambda match: ['<QueryPlan compiled="true"/>']),
+            ]
+        ]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def settings(self) -> override_settings:
+        '''Return settings that make GrETEL connect to this server'''
+        return override_settings(BASEX_HOST=self.host, BASEX_PORT=self.port,
+                                 BASEX_USER=self.user,
+                                 BASEX_PASSWORD=self.password)
+
+    def add_database(self, name: str, content: Union[str, bytes]):
+        if isinstance(content, str):
+            content = content.encode()
+        self.create_database(name, content)
+
+    def create_database(self, name: str, content: bytes):
+        try:
+            database = Database(content or b'<treebank/>')
+        except etree.XMLSyntaxError as err:
+            raise QueryError('Cannot parse input for {}: {}'
+                             .format(name, err))
+        with self._lock:
+            self.databases[name] = database
+
+    def script(self, pattern: str, response: Response):
+        '''Respond to queries and commands matching the regular expression
+        pattern with the given response, before all other responses'''
+        self._scripted.insert(0, (re.compile(pattern, re.DOTALL), response))
+
+    def slow_down(self, database: str, seconds: float):
+        '''Add latency to every request for the given database'''
+        self._database_latency[database] = seconds
+
+    def fail(self, database: str, message: str = 'Simulated failure.'):
+        '''Let every request for the given database fail'''
+        self._failing_databases[database] = message
+
+    def _session_started(self):
+        with self._lock:
+            self.statistics['sessions'] += 1
+            self.active_sessions += 1
+            self.statistics['max_active_sessions'] = max(
+                self.statistics['max_active_sessions'], self.active_sessions
+            )
+
+    def _record(self, key: str):
+        with self._lock:
+            self.statistics[key] += 1
+
+    def _session_ended(self):
+        with self._lock:
+            self.active_sessions -= 1
+
+    def _delay(self, text: str):
+        '''Wait and fail as configured for a request'''
+        names = DATABASE_NAME.findall(text) or [text]
+        delay = self.latency + sum(self._database_latency.get(name, 0)
+                                   for name in names)
+        if delay:
+            time.sleep(delay)
+        for name in names:
+            if name in self._failing_databases:
+                raise QueryError(self._failing_databases[name])
+        if self.failure_rate:
+            with self._lock:
+                failed = self._random.random() < self.failure_rate
+            if failed:
+                raise QueryError('Simulated random failure.')
+
+    def _respond(self, response: Response, match) -> List[str]:
+        if callable(response):
+            response = response(match)
+        if isinstance(response, Exception):
+            raise QueryError(str(response))
+        if isinstance(response, str):
+            return [response]
+        return list(response)
+
+    def _get_database(self, name: str) -> Database:
+        try:
+            return self.databases[name]
+        except KeyError:
+            raise QueryError("Database '{}' was not found.".format(name))
+
+    def query(self, text: str) -> List[str]:
+        '''Return the result items of a query'''
+        self._record('queries')
+        try:
+            self._delay(text)
+            for pattern, response in self._scripted:
+                match = pattern.search(text)
+                if match:
+                    return self._respond(response, match)
+            for pattern, handler in self._builtin:
+                match = pattern.search(text)
+                if match:
+                    return handler(match)
+            raise QueryError('Query not supported by fake BaseX server: {}'
+                             .format(text))
+        except QueryError:
+            self._record('errors')
+            raise
+
+    def execute(self, command: str) -> str:
+        '''Return the result of a command'''
+        self._record('commands')
+        try:
+            self._delay(command)
+            for pattern, response in self._scripted:
+                match = pattern.search(command)
+                if match:
+                    return '\n'.join(self._respond(response, match))
+            return self._execute(command)
+        except QueryError:
+            self._record('errors')
+            raise
+
+    def _execute(self, command: str) -> str:
+        name, _, argument = command.partition(' ')
+        name = name.upper()
+        if name == 'LIST':
+            with self._lock:
+                databases = sorted(self.databases.items())
+            lines = ['Name  Resources  Size  Input Path', '-' * 30]
+            lines.extend('{} 1 {} '.format(name, database.size)
+                         for name, database in databases)
+            lines.extend(['', '{} database(s).'.format(len(databases))])
+            return '\n'.join(lines)
+        if name == 'DROP' and argument.upper().startswith('DB '):
+            with self._lock:
+                self.databases.pop(argument[3:].strip(), None)
+            return ''
+        if name == 'CREATE' and argument.upper().startswith('DB '):
+            database, _, content = argument[3:].strip().partition(' ')
+            self.create_database(database, content.encode())
+            return ''
+        if name == 'XQUERY':
+            return '\n'.join(self.query(argument))
+        if name in ('SET', 'OPTIMIZE', 'OPEN', 'CLOSE'):
+            return ''
+        raise QueryError('Unknown command: {}'.format(command))
+
+    def _search(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        return [format_match(node.xpath('ancestor::alpino_ds')[0], node,
+                             match.group(1))
+                for node in database.xpath('/treebank' + match.group(2))]
+
+    def _count(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        return [str(len(database.xpath('/treebank' + match.group(2))))]
+
+    def _sum_end(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        return [str(sum(int(node.get('end')) for node in
+                        database.xpath('/treebank' + match.group(2))))]
+
+    def _size(self, match) -> List[str]:
+        return [str(self._get_database(match.group(1)).size)]
+
+    def _statistics(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        top = database.xpath('/treebank/alpino_ds/node[@cat="top"]')
+        return ['{} {} {}'.format(database.size, len(top),
+                                  sum(int(node.get('end')) for node in top))]
+
+    def _metadata_count(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        sentences = [node.xpath('ancestor::alpino_ds')[0]
+                     for node in database.xpath(match.group(2))]
+        return [format_metadata_counts(sentences)]
+
+    def _sentences(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        xpath = '/treebank/alpino_ds'
+        if match.group(2) is not None:
+            xpath += '[@id="{}"]'.format(match.group(2))
+        return [etree.tostring(sentence, encoding='unicode', with_tail=False)
+                for sentence in database.xpath(xpath)]
+
+    def _sentence_at(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        pre = int(match.group(2))
+        if not 0 < pre <= len(database.elements):
+            return []
+        element = database.elements[pre - 1]
+        if element.tag != 'alpino_ds' or element.get('id') != match.group(3):
+            return []
+        return [etree.tostring(element, encoding='unicode', with_tail=False)]
+
+    def _positions(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        return ['{} {}'.format(pre, element.get('id'))
+                for pre, element in enumerate(database.elements, 1)
+                if element.tag == 'alpino_ds']
+
+    def _attribute_counts(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        attributes = [x.lstrip('@') for x in match.group(2).split('|')]
+        counts = Counter(
+            (attribute, node.get(attribute))
+            for node in database.xpath('/treebank//node')
+            for attribute in attributes if node.get(attribute) is not None
+        )
+        items = []
+        for (attribute, value), count in counts.items():
+            element = etree.Element('count', attribute=attribute, value=value)
+            element.text = str(count)
+            items.append(etree.tostring(element, encoding='unicode'))
+        return items
+
+    def _version(self, match) -> List[str]:
+        database = self._get_database(match.group(1))
+        return [str(x) for x in
+                database.xpath('/treebank/alpino_ds[1]/@version')]
@@ -1,7 +1,23 @@
 from django.test import TestCase
 from django.conf import settings
+from django.contrib.auth.models import User
 
-from .alpino import alpino, AlpinoError
+import io
+import pathlib
+import pstats
+import tempfile
+import threading
+import time
+
+from benchmarks.synthetic import SyntheticTreebank
+from search.basex_search import (generate_xquery_search,
+                                 generate_xquery_count, parse_search_result)
+from .alpino import (alpino, AlpinoError, AlpinoBusyError, AlpinoPool,
+                     AlpinoClientPool)
+from .basex import basex
+from .metrics import recording, BASEX_QUERY_SECONDS
+from .models import ProfileReport
+from .testing import FakeBaseXServer
 
 
 class AlpinoServiceTestCase(TestCase):
@@ -26,3 +42,345 @@ class AlpinoServiceTestCase(TestCase):
             except AlpinoError:
                 self.skipTest('cannot use Alpino executable')
             alpino.client.parse_line('Werkt Alpino?', 'testzin')
+
+
+class FakeAlpinoClient:
+    '''Stands in for a corpus2alpino client: fails and sleeps for the
+    sentences given, the first time they are parsed. Sleeping stops when
+    the attempt is interrupted or the client is closed.'''
+    version = None
+    version_date = None
+
+    def __init__(self, fail=(), slow=()):
+        self.fail = set(fail)
+        self.slow = set(slow)
+        self.stopped = threading.Event()
+        self.slow_attempts = []
+        self.interrupted = []
+
+    def parse_line(self, line, sentence_id, attempt=None):
+        if sentence_id in self.fail:
+            self.fail.remove(sentence_id)
+            raise Exception('Cannot parse')
+        if sentence_id in self.slow:
+            self.slow.remove(sentence_id)
+            self.slow_attempts.append(attempt)
+            if self.stopped.wait(1):
+                raise Exception('Stopped')
+        return '<alpino_ds id="{}">{}</alpino_ds>'.format(sentence_id, line)
+
+    def interrupt(self, attempt):
+        self.interrupted.append(attempt)
+        if attempt in self.slow_attempts:
+            self.stopped.set()
+
+    def close(self):
+        self.stopped.set()
+
+
+class HungAlpinoClient(FakeAlpinoClient):
+    '''Fake client that keeps sleeping when it is closed'''
+    def close(self):
+        pass
+
+
+class AlpinoPoolTestCase(TestCase):
+    def test_parse_lines(self):
+        client = FakeAlpinoClient(fail=['3'], slow=['5'])
+        pool = AlpinoPool([client], workers=3, batch_size=4, timeout=0.2,
+                          retries=1)
+        lines = [('zin {}'.format(i), str(i)) for i in range(10)]
+        try:
+            results = pool.parse_lines(lines)
+        finally:
+            pool.close()
+        self.assertEqual(
+            [parse for parse, _ in results],
+            ['<alpino_ds id="{}">zin {}</alpino_ds>'.format(i, i)
+             for i in range(10)]
+        )
+        self.assertEqual(pool.statistics['sentences'], 10)
+        self.assertEqual(pool.statistics['retries'], 2)
+        self.assertEqual(pool.statistics['timeouts'], 1)
+        self.assertEqual(pool.statistics['failed'], 0)
+        # Only the parse that timed out has been interrupted
+        self.assertTrue(client.stopped.is_set())
+        self.assertEqual(client.interrupted, client.slow_attempts)
+
+    def test_failing_sentence(self):
+        client = FakeAlpinoClient(fail=['1'])
+        pool = AlpinoPool([client], workers=2, batch_size=10, timeout=10,
+                          retries=0)
+        try:
+            results = pool.parse_lines([('a', '0'), ('b', '1')])
+        finally:
+            pool.close()
+        self.assertIsNone(results[1][0])
+        self.assertEqual(pool.statistics['failed'], 1)
+
+
+class AlpinoClientPoolTestCase(TestCase):
+    def setUp(self):
+        self.clients = []
+
+    def create_client(self, **kwargs):
+        client = FakeAlpinoClient(**kwargs)
+        self.clients.append(client)
+        return client
+
+    def test_timeout_and_restart(self):
+        pool = AlpinoClientPool(
+            [lambda: self.create_client(slow=['1'])], timeout=0.2,
+            queue_size=1, queue_timeout=1, health_check_interval=300
+        )
+        self.assertEqual(pool.parse_line('zin', '0'),
+                         '<alpino_ds id="0">zin</alpino_ds>')
+        with self.assertRaisesRegex(AlpinoError, 'longer than'):
+            pool.parse_line('zin', '1')
+        # The hung client has been closed and replaced
+        self.assertTrue(self.clients[0].stopped.is_set())
+        pool.parse_line('zin', '2')
+        self.assertEqual(len(self.clients), 2)
+        self.assertEqual(pool.statistics['timeouts'], 1)
+        self.assertEqual(pool.statistics['sentences'], 2)
+
+    def test_maximum_abandoned(self):
+        pool = AlpinoClientPool(
+            [lambda: HungAlpinoClient(slow=['1'])], timeout=0.1,
+            queue_size=1, queue_timeout=1, health_check_interval=300,
+            maximum_abandoned=1
+        )
+        with self.assertRaisesRegex(AlpinoError, 'longer than'):
+            pool.parse_line('zin', '1')
+        # The thread of the hung client is still running
+        with self.assertRaisesRegex(AlpinoBusyError, 'still running'):
+            pool.parse_line('zin', '2')
+        time.sleep(1)
+        pool.parse_line('zin', '2')
+        self.assertEqual(pool.statistics['refused'], 1)
+
+    def test_back_pressure(self):
+        pool = AlpinoClientPool(
+            [lambda: self.create_client(slow=['slow'])], timeout=2,
+            queue_size=0, queue_timeout=0.1, health_check_interval=300
+        )
+        thread = threading.Thread(target=pool.parse_line,
+                                  args=('zin', 'slow'))
+        thread.start()
+        time.sleep(0.1)
+        with self.assertRaisesRegex(AlpinoBusyError, 'waiting'):
+            pool.parse_line('zin', '1')
+        pool.queue_size = 1
+        with self.assertRaisesRegex(AlpinoBusyError, 'within'):
+            pool.parse_line('zin', '1')
+        thread.join()
+        pool.parse_line('zin', '1')
+        self.assertEqual(pool.statistics['refused'], 2)
+
+    def test_health_check(self):
+        pool = AlpinoClientPool([self.create_client], timeout=1,
+                                queue_size=1, queue_timeout=1,
+                                health_check_interval=0)
+        pool.parse_line('zin', '0')
+        # The fake client does not report a version, so it is restarted
+        pool.parse_line('zin', '1')
+        self.assertEqual(pool.statistics['health_checks'], 1)
+        self.assertEqual(len(self.clients), 2)
+
+
+class BaseXServiceTestCase(TestCase):
+    DB_NAME = 'GRETEL5_TEST_INDEXES'
+
+    def setUp(self):
+        if not basex.test_connection():
+            self.skipTest('requires running BaseX server')
+
+    def test_index_status(self):
+        basex.create(self.DB_NAME, '<treebank><alpino_ds id="1"/></treebank>')
+        try:
+            status = basex.get_index_status(self.DB_NAME)
+            self.assertTrue(status['uptodate'])
+            self.assertTrue(status['attrindex'])
+            self.assertFalse(basex.needs_optimization(self.DB_NAME))
+            basex.optimize(self.DB_NAME)
+            self.assertFalse(basex.needs_optimization(self.DB_NAME))
+        finally:
+            basex.execute('DROP DB {}'.format(self.DB_NAME))
+        with self.assertRaises(OSError):
+            basex.get_index_status(self.DB_NAME)
+
+
+class FakeBaseXServerTestCase(TestCase):
+    XPATH = '//node[@cat="np"]'
+
+    def setUp(self):
+        self.server = FakeBaseXServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        overridden = self.server.settings()
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        synthetic = SyntheticTreebank(sentences_per_file=10)
+        self.content = synthetic.generate_database(synthetic.filenames[0])
+        # Search results as BaseX would return them
+        self.expected = sum(
+            len(sentence.xpath(self.XPATH)) for sentence in
+            synthetic.generate_file(synthetic.filenames[0])
+        )
+
+    def test_search(self):
+        self.assertTrue(basex.test_connection())
+        basex.create('TESTDB', io.BytesIO(self.content))
+        self.assertEqual(
+            int(basex.perform_query(generate_xquery_count('TESTDB',
+                                                          self.XPATH))),
+            self.expected
+        )
+        query = generate_xquery_search('TESTDB', self.XPATH)
+        results = parse_search_result(
+            ''.join(item for _, item in basex.perform_query_iter(query)),
+            'comp'
+        )
+        self.assertEqual(len(results), self.expected)
+        self.assertIn('TESTDB ', basex.execute('LIST'))
+        basex.execute('DROP DB TESTDB')
+        with self.assertRaises(OSError):
+            basex.perform_query(generate_xquery_count('TESTDB', self.XPATH))
+
+    def test_scripted_responses_and_failures(self):
+        self.server.script(r'^scripted', ['a', 'b'])
+        self.assertEqual(list(basex.perform_query_iter('scripted query')),
+                         [(82, 'a'), (82, 'b')])
+        self.server.add_database('TESTDB', self.content)
+        self.server.fail('TESTDB', 'Database is broken.')
+        with self.assertRaisesRegex(OSError, 'Database is broken'):
+            basex.perform_query(generate_xquery_count('TESTDB', self.XPATH))
+        self.assertEqual(self.server.statistics['errors'], 1)
+
+    def test_latency(self):
+        self.server.add_database('TESTDB', self.content)
+        self.server.slow_down('TESTDB', 0.2)
+        start = time.monotonic()
+        basex.perform_query(generate_xquery_count('TESTDB', self.XPATH))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_authentication(self):
+        with self.settings(BASEX_PASSWORD='wrong'):
+            with self.assertRaises(OSError):
+                basex.get_session()
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.server = FakeBaseXServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        overridden = self.server.settings()
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.server.add_database('METRICSDB', '<treebank/>')
+
+    def get_number_of_queries(self):
+        return sum(sample.value
+                   for metric in BASEX_QUERY_SECONDS.collect()
+                   for sample in metric.samples
+                   if sample.name.endswith('_count'))
+
+    def test_basex_metrics(self):
+        before = self.get_number_of_queries()
+        self.server.script(r'^scripted', ['één', 'twee'])
+        with recording() as recorder:
+            basex.perform_query(generate_xquery_count('METRICSDB', '//node'),
+                                'METRICSDB', 'count')
+            items = list(basex.perform_query_iter('scripted', 'METRICSDB',
+                                                  'search'))
+        self.assertEqual(len(items), 2)
+        self.assertEqual(self.get_number_of_queries(), before + 2)
+        values = recorder.as_dict()
+        self.assertEqual(values['basex_count_queries'], 1)
+        self.assertEqual(values['basex_search_queries'], 1)
+        self.assertEqual(values['basex_search_bytes'], 9)
+        self.assertGreater(values['basex_count_seconds'], 0)
+        self.assertAlmostEqual(values['database_seconds:METRICSDB'],
+                               values['basex_count_seconds'] +
+                               values['basex_search_seconds'], places=5)
+        # Measurements outside a recording are not recorded
+        basex.perform_query(generate_xquery_count('METRICSDB', '//node'))
+        self.assertEqual(recorder.as_dict(), values)
+
+    def test_metrics_view(self):
+        basex.perform_query(generate_xquery_count('METRICSDB', '//node'),
+                            'METRICSDB', 'count')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'gretel_basex_query_seconds_bucket{'
+                      b'le="0.001",query_type="count"}', response.content)
+        self.assertNotIn(b'METRICSDB', response.content)
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        self.server = FakeBaseXServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        synthetic = SyntheticTreebank(sentences_per_file=10)
+        self.server.add_database(
+            'PROFILEDB', synthetic.generate_database(synthetic.filenames[0])
+        )
+        # Trees are cached, so every request asks for another sentence
+        self.sentence_ids = ['{}:{}'.format(synthetic.filenames[0], number)
+                             for number in range(3)]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overridden = self.settings(
+            PROFILING_DIR=pathlib.Path(directory.name),
+            PROFILING_ALLOW_HEADER=True, PROFILING_MAXIMUM_REPORTS=1,
+            BASEX_HOST=self.server.host, BASEX_PORT=self.server.port
+        )
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def get_tree(self, sentence_id, **headers):
+        return self.client.post(
+            '/search/tree/',
+            {'database': 'PROFILEDB', 'sentence_id': sentence_id},
+            content_type='application/json', **headers
+        )
+
+    def test_profiling(self):
+        response = self.get_tree(self.sentence_ids[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Gretel-Profile', response)
+        self.assertEqual(ProfileReport.objects.count(), 0)
+
+        response = self.get_tree(self.sentence_ids[1],
+                                 HTTP_X_GRETEL_PROFILE='1')
+        report = ProfileReport.objects.get(
+            id=int(response['X-Gretel-Profile'])
+        )
+        self.assertEqual(report.path, '/search/tree/')
+        self.assertEqual(report.status_code, 200)
+        self.assertIn(self.sentence_ids[1], response.json()['tree'])
+        self.assertGreater(report.phases['basex'], 0)
+        self.assertGreater(report.phases['serialize'], 0)
+        self.assertAlmostEqual(sum(report.phases.values()), report.duration,
+                               places=4)
+        self.assertIn('tree_view', report.summary)
+        stats = pstats.Stats(str(report.get_profile_path()))
+        self.assertGreater(stats.total_calls, 0)
+
+        # Only the most recent report is kept
+        response = self.get_tree(self.sentence_ids[2],
+                                 HTTP_X_GRETEL_PROFILE='1')
+        self.assertFalse(ProfileReport.objects.filter(id=report.id).exists())
+        self.assertFalse(report.get_profile_path().exists())
+        report = ProfileReport.objects.get()
+
+        User.objects.create_superuser('admin', password='admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.get(
+            '/admin/services/profilereport/{}/download/'.format(report.id)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content),
+                         report.get_profile_path().read_bytes())
@@ -0,0 +1,23 @@
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+import os
+
+from prometheus_client import (
+    CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+    multiprocess
+)
+
+
+@require_GET
+def metrics_view(request):
+    '''Expose the metrics in services.metrics in the Prometheus text
+    format. If PROMETHEUS_MULTIPROC_DIR is set, the metrics of all
+    processes are combined.'''
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from treebanks.models import Treebank, BaseXDB
+from services.basex import basex
+
+
+class Command(BaseCommand):
+    help = 'Show the state of the index structures of the BaseX databases ' \
+           'of treebanks and optionally rebuild outdated or missing indexes'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            'treebanks', nargs='*',
+            help='The slugs of the treebanks to check (default: all '
+                 'treebanks)'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='optimize all databases of which the indexes are outdated '
+                 'or incomplete'
+        )
+
+    def handle(self, *args, **options):
+        if not basex.test_connection():
+            raise CommandError('Cannot connect to BaseX. '
+                               'This command needs BaseX to run.')
+        databases = BaseXDB.objects.all().order_by('dbname')
+        if options['treebanks']:
+            for slug in options['treebanks']:
+                if not Treebank.objects.filter(slug=slug).exists():
+                    raise CommandError('Treebank {} does not exist.'
+                                       .format(slug))
+            databases = databases.filter(
+                component__treebank__slug__in=options['treebanks']
+            )
+        stale = []
+        errors = 0
+        for database in databases:
+            try:
+                status = basex.get_index_status(database.dbname)
+                needs_optimization = basex.needs_optimization(database.dbname)
+            except OSError as err:
+                errors += 1
+                self.stdout.write(self.style.ERROR(
+                    '{}: cannot get index information: {}'
+                    .format(database, err)
+                ))
+                continue
+            description = ', '.join(
+                '{}={}'.format(name, 'yes' if value else 'no')
+                for name, value in status.items()
+            )
+            if needs_optimization:
+                stale.append(database)
+                self.stdout.write(self.style.WARNING(
+                    '{}: {} (needs optimization)'.format(database, description)
+                ))
+            else:
+                self.stdout.write('{}: {}'.format(database, description))
+
+        if not options['rebuild']:
+            self.stdout.write('{} of {} databases need optimization.'
+                              .format(len(stale), databases.count()))
+        else:
+            for number, database in enumerate(stale, start=1):
+                try:
+                    basex.optimize(database.dbname)
+                except OSError as err:
+                    errors += 1
+                    self.stdout.write(self.style.ERROR(
+                        'Could not optimize {}: {}'.format(database, err)
+                    ))
+                else:
+                    self.stdout.write('Optimized {} ({} of {}).'
+                                      .format(database, number, len(stale)))
+        if errors:
+            raise CommandError('Errors occurred for {} databases.'
+                               .format(errors))
+        self.stdout.write(self.style.SUCCESS('Done.'))
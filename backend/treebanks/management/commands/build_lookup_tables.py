@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from treebanks.models import Treebank, BaseXDB
+from services.basex import basex
+
+
+class Command(BaseCommand):
+    help = 'Build the lookup tables (attribute counts and sentence index) ' \
+           'of the BaseX databases of treebanks, which are used to skip ' \
+           'databases while searching and to quickly show trees'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            'treebanks', nargs='*',
+            help='The slugs of the treebanks to build lookup tables for '
+                 '(default: all treebanks)'
+        )
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='only build lookup tables for databases that do not have '
+                 'all of them yet'
+        )
+
+    def handle(self, *args, **options):
+        if not basex.test_connection():
+            raise CommandError('Cannot connect to BaseX. '
+                               'This command needs BaseX to run.')
+        databases = BaseXDB.objects.all().order_by('dbname')
+        if options['treebanks']:
+            for slug in options['treebanks']:
+                if not Treebank.objects.filter(slug=slug).exists():
+                    raise CommandError('Treebank {} does not exist.'
+                                       .format(slug))
+            databases = databases.filter(
+                component__treebank__slug__in=options['treebanks']
+            )
+        if options['missing']:
+            databases = databases.filter(
+                Q(has_attribute_counts=False) | Q(has_sentence_index=False)
+            )
+        databases = list(databases)
+        errors = 0
+        for database in databases:
+            try:
+                database.build_lookup_tables()
+            except (OSError, ValueError) as err:
+                errors += 1
+                self.stdout.write(self.style.ERROR(
+                    'Could not build lookup tables for {}: {}.'
+                    .format(database, err)
+                ))
+            else:
+                self.stdout.write('Built lookup tables for {}.'
+                                  .format(database))
+        if errors:
+            raise CommandError('{} databases could not be processed.'
+                               .format(errors))
+        self.stdout.write(self.style.SUCCESS(
+            'Lookup tables built for {} databases.'
+            .format(len(databases) - errors)
+        ))
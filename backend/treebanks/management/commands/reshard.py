@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from treebanks.models import Treebank
+from treebanks.sharding import ShardingPolicy, reshard
+from search.models import ComponentSearchResult
+from services.basex import basex
+
+
+class Command(BaseCommand):
+    help = 'Divide the sentences of the components of a treebank over new ' \
+           'BaseX databases according to the sharding policy ' \
+           '(DATABASE_SHARD_SIZE and DATABASE_SHARD_SENTENCES settings)'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('treebank', help='slug of the treebank')
+        parser.add_argument(
+            'components', nargs='*',
+            help='slugs of the components to reshard (default: all '
+                 'components)'
+        )
+        parser.add_argument(
+            '--shard-size', type=int, default=None,
+            help='target size of a database in bytes of XML (overrides '
+                 'DATABASE_SHARD_SIZE)'
+        )
+        parser.add_argument(
+            '--shard-sentences', type=int, default=None,
+            help='maximum number of sentences of a database (overrides '
+                 'DATABASE_SHARD_SENTENCES)'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='also reshard components that already have the number of '
+                 'databases that the policy would create'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='only show which components would be resharded'
+        )
+
+    def get_policy(self, options) -> ShardingPolicy:
+        default = ShardingPolicy.from_settings()
+        try:
+            return ShardingPolicy(
+                options['shard_size'] or default.max_bytes,
+                options['shard_sentences'] or default.max_sentences
+            )
+        except ValueError as err:
+            raise CommandError(str(err))
+
+    def get_components(self, options):
+        try:
+            treebank = Treebank.objects.get(slug=options['treebank'])
+        except Treebank.DoesNotExist:
+            raise CommandError('Treebank {} does not exist.'
+                               .format(options['treebank']))
+        components = treebank.components.order_by('slug')
+        if options['components']:
+            components = components.filter(slug__in=options['components'])
+            if components.count() != len(set(options['components'])):
+                raise CommandError('Not all components exist.')
+        return components
+
+    def handle(self, *args, **options):
+        policy = self.get_policy(options)
+        components = self.get_components(options)
+        if not options['dry_run'] and not basex.test_connection():
+            raise CommandError('Cannot connect to BaseX. '
+                               'This command needs BaseX to run.')
+
+        errors = 0
+        for component in components:
+            number_of_databases = component.databases.count()
+            if number_of_databases == 0:
+                continue
+            planned = policy.get_number_of_shards(
+                (component.total_database_size or 0) * 1024,
+                component.nr_sentences
+            )
+            if policy.is_balanced(component) and not options['force']:
+                self.stdout.write('{}: {} databases, balanced.'
+                                  .format(component.slug,
+                                          number_of_databases))
+                continue
+            if options['dry_run']:
+                self.stdout.write(
+                    '{}: {} databases, about {} after resharding.'
+                    .format(component.slug, number_of_databases, planned)
+                )
+                continue
+            try:
+                new_databases = reshard(component, policy)
+            except OSError as err:
+                errors += 1
+                self.stdout.write(self.style.ERROR(
+                    'Could not reshard {}: {}'.format(component.slug, err)
+                ))
+                continue
+            # Results may refer to the old databases
+            ComponentSearchResult.invalidate([component])
+            self.stdout.write(
+                '{}: {} databases replaced by {}.'
+                .format(component.slug, number_of_databases,
+                        len(new_databases))
+            )
+        if errors:
+            raise CommandError('Errors occurred for {} components.'
+                               .format(errors))
+        self.stdout.write(self.style.SUCCESS('Done.'))
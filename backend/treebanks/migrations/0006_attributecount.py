@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treebanks', '0005_remove_component_contains_metadata_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basexdb',
+            name='has_attribute_counts',
+            field=models.BooleanField(default=False, editable=False, help_text='True if the attribute counts of this database have been stored'),
+        ),
+        migrations.CreateModel(
+            name='AttributeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attribute', models.CharField(max_length=50)),
+                ('value', models.CharField(max_length=200)),
+                ('count', models.PositiveBigIntegerField()),
+                ('database', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attribute_counts', to='treebanks.basexdb')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['attribute', 'value', 'database'], name='attributecount_lookup')],
+            },
+        ),
+    ]
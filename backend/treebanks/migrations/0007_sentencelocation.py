@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treebanks', '0006_attributecount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basexdb',
+            name='has_sentence_index',
+            field=models.BooleanField(default=False, editable=False, help_text='True if the positions of the sentences in this database have been stored'),
+        ),
+        migrations.CreateModel(
+            name='SentenceLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sentence_id', models.CharField(db_index=True, max_length=500)),
+                ('pre', models.PositiveBigIntegerField()),
+                ('database', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sentences', to='treebanks.basexdb')),
+            ],
+        ),
+    ]
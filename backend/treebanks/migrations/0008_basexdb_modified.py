@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treebanks', '0007_sentencelocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basexdb',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, help_text='Last time the database was created or replaced'),
+        ),
+    ]
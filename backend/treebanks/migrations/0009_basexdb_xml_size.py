@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treebanks', '0008_basexdb_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basexdb',
+            name='xml_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, help_text='Size in bytes of the XML the database was created from, if known', null=True),
+        ),
+    ]
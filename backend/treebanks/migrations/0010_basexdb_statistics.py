@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treebanks', '0009_basexdb_xml_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basexdb',
+            name='nr_sentences',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of sentences, if known', null=True),
+        ),
+        migrations.AddField(
+            model_name='basexdb',
+            name='nr_words',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Number of words, if known', null=True),
+        ),
+    ]
@@ -1,19 +1,27 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.conf import settings
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Tuple, Union
 
 from services.basex import basex
 from search.basex_search import (
     generate_xquery_count_words, generate_xquery_count_sentences,
-    generate_xquery_get_version
+    generate_xquery_get_version, generate_xquery_attribute_counts,
+    parse_attribute_count, generate_xquery_sentence_positions,
+    generate_xquery_database_statistics
 )
 
 logger = logging.getLogger(__name__)
 
+# Node attributes for which the number of occurrences of every value is
+# stored for each database (see AttributeCount)
+COUNTED_ATTRIBUTES = ['lemma', 'word', 'pos', 'pt', 'rel', 'cat']
+
 
 class Treebank(models.Model):
     slug = models.SlugField(max_length=200, primary_key=True)
@@ -95,6 +103,50 @@ class Component(models.Model):
         # BaseX databases.
         return configuration
 
+    def get_attribute_counts(self, attribute: str,
+                             value: str) -> Dict[str, int]:
+        '''Return a dictionary of all BaseX databases of this component for
+        which attribute counts are available (keys) and the number of nodes
+        in them having the given value for the given attribute (values).
+        Databases without attribute counts are not included.'''
+        if attribute not in COUNTED_ATTRIBUTES or \
+                len(value) > AttributeCount.MAXIMUM_VALUE_LENGTH:
+            return {}
+        counts = dict.fromkeys(
+            self.databases.filter(has_attribute_counts=True)
+            .values_list('dbname', flat=True), 0
+        )
+        counts.update(
+            AttributeCount.objects.filter(
+                database__in=counts.keys(), attribute=attribute, value=value
+            ).values_list('database', 'count')
+        )
+        return counts
+
+    def update_statistics(self):
+        '''Determine the numbers of sentences and words of the databases of
+        this component for which these are not known yet and update the
+        totals of the component.'''
+        databases = list(self.databases.all())
+        unknown = [database for database in databases
+                   if database.nr_sentences is None or
+                   database.nr_words is None]
+        statistics = get_database_statistics(
+            [database.dbname for database in unknown]
+        )
+        for database in unknown:
+            result = statistics[database.dbname]
+            if isinstance(result, Exception):
+                logger.error('Cannot get statistics of database {}: {}'
+                             .format(database, result))
+                continue
+            database.size, database.nr_sentences, database.nr_words = result
+            database.save(update_fields=['size', 'nr_sentences', 'nr_words'])
+        self.nr_sentences = sum(database.nr_sentences or 0
+                                for database in databases)
+        self.nr_words = sum(database.nr_words or 0 for database in databases)
+        self.save(update_fields=['nr_sentences', 'nr_words'])
+
     @property
     def total_database_size(self):
         if self.databases.all().count() == 0:
@@ -106,8 +158,35 @@ class BaseXDB(models.Model):
     dbname = models.CharField(max_length=200, primary_key=True,
                               verbose_name='Database name')
     size = models.IntegerField(help_text='Size of BaseX database in KiB')
+    nr_sentences = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text='Number of sentences, if known'
+    )
+    nr_words = models.PositiveBigIntegerField(
+        null=True, blank=True,
+        help_text='Number of words, if known'
+    )
+    xml_size = models.PositiveBigIntegerField(
+        null=True, blank=True, editable=False,
+        help_text='Size in bytes of the XML the database was created from, '
+                  'if known'
+    )
     component = models.ForeignKey(Component, on_delete=models.CASCADE,
                                   related_name='databases')
+    has_attribute_counts = models.BooleanField(
+        default=False, editable=False,
+        help_text='True if the attribute counts of this database have been '
+                  'stored'
+    )
+    has_sentence_index = models.BooleanField(
+        default=False, editable=False,
+        help_text='True if the positions of the sentences in this database '
+                  'have been stored'
+    )
+    modified = models.DateTimeField(
+        auto_now=True,
+        help_text='Last time the database was created or replaced'
+    )
 
     class Meta:
         verbose_name = 'BaseX database'
@@ -119,20 +198,88 @@ class BaseXDB(models.Model):
         """Get database size in KiB. An OSError will be raised if
         the database does not exist."""
         dbsize = int(basex.perform_query(
-                        'db:property("{}", "size")'.format(self.dbname)
+                        'db:property("{}", "size")'.format(self.dbname),
+                        self.dbname, 'size'
                     ))
         return int(dbsize / 1024)
 
     def get_number_of_words(self):
         return int(basex.perform_query(
-            generate_xquery_count_words(self.dbname)
+            generate_xquery_count_words(self.dbname), self.dbname, 'words'
         ))
 
     def get_number_of_sentences(self):
         return int(basex.perform_query(
-            generate_xquery_count_sentences(self.dbname)
+            generate_xquery_count_sentences(self.dbname), self.dbname,
+            'sentences'
         ))
 
+    def get_statistics(self) -> Tuple[int, int, int]:
+        '''Return a tuple of the size in KiB, the number of sentences and the
+        number of words of this database, using a single query. An OSError
+        will be raised if the database does not exist.'''
+        result = basex.perform_query(
+            generate_xquery_database_statistics(self.dbname), self.dbname,
+            'statistics'
+        )
+        try:
+            size, nr_sentences, nr_words = (int(x) for x in result.split())
+        except ValueError:
+            raise ValueError('Unexpected statistics for database {}: {}'
+                             .format(self.dbname, result))
+        return int(size / 1024), nr_sentences, nr_words
+
+    def build_attribute_counts(self):
+        '''Count the occurrences of every value of the attributes in
+        COUNTED_ATTRIBUTES and store them as AttributeCount objects,
+        replacing any existing counts. An OSError will be raised if the
+        database cannot be queried.'''
+        xquery = generate_xquery_attribute_counts(self.dbname,
+                                                  COUNTED_ATTRIBUTES)
+        counts = []
+        for _, item in basex.perform_query_iter(xquery, self.dbname,
+                                                'attribute_counts'):
+            attribute, value, count = parse_attribute_count(item)
+            if len(value) > AttributeCount.MAXIMUM_VALUE_LENGTH:
+                # Not stored, lookups for such values will not be answered
+                continue
+            counts.append(AttributeCount(database=self, attribute=attribute,
+                                         value=value, count=count))
+        with transaction.atomic():
+            self.attribute_counts.all().delete()
+            AttributeCount.objects.bulk_create(counts, batch_size=1000)
+            self.has_attribute_counts = True
+            self.save(update_fields=['has_attribute_counts'])
+
+    def build_sentence_index(self):
+        '''Store the position (pre value) of every sentence in the database
+        as SentenceLocation objects, replacing any existing ones, so that
+        sentences can be fetched without searching for their ID. An OSError
+        will be raised if the database cannot be queried.'''
+        xquery = generate_xquery_sentence_positions(self.dbname)
+        locations = []
+        for _, item in basex.perform_query_iter(xquery, self.dbname,
+                                                'sentence_index'):
+            pre, sentence_id = item.split(' ', 1)
+            if len(sentence_id) > SentenceLocation.MAXIMUM_ID_LENGTH:
+                # Not stored, this sentence will be searched for instead
+                continue
+            locations.append(SentenceLocation(database=self,
+                                              sentence_id=sentence_id,
+                                              pre=int(pre)))
+        with transaction.atomic():
+            self.sentences.all().delete()
+            SentenceLocation.objects.bulk_create(locations, batch_size=5000)
+            self.has_sentence_index = True
+            self.save(update_fields=['has_sentence_index'])
+
+    def build_lookup_tables(self):
+        '''Build both the attribute counts and the sentence index of this
+        database. Should be called after creating the database in BaseX
+        and saving this object.'''
+        self.build_attribute_counts()
+        self.build_sentence_index()
+
     def delete_basex_db(self):
         """Delete this database from BaseX (called when BaseXDB objects
         are deleted)"""
@@ -147,7 +294,64 @@ class BaseXDB(models.Model):
 
     def get_alpino_version(self):
         xquery = generate_xquery_get_version(self.dbname)
-        return basex.perform_query(xquery)
+        return basex.perform_query(xquery, self.dbname, 'version')
+
+
+class AttributeCount(models.Model):
+    '''The number of nodes in a BaseX database having a certain value for
+    a certain attribute. Values that do not occur in a database for which
+    the counts have been built have a count of zero.'''
+    MAXIMUM_VALUE_LENGTH = 200
+
+    database = models.ForeignKey(BaseXDB, on_delete=models.CASCADE,
+                                 related_name='attribute_counts')
+    attribute = models.CharField(max_length=50)
+    value = models.CharField(max_length=MAXIMUM_VALUE_LENGTH)
+    count = models.PositiveBigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['attribute', 'value', 'database'],
+                         name='attributecount_lookup')
+        ]
+
+    def __str__(self):
+        return '{}: @{}="{}"'.format(self.database, self.attribute,
+                                     self.value)
+
+
+class SentenceLocation(models.Model):
+    '''The position of a sentence in a BaseX database, i.e. the pre value of
+    its alpino_ds element, which allows fetching it in constant time.'''
+    MAXIMUM_ID_LENGTH = 500
+
+    sentence_id = models.CharField(max_length=MAXIMUM_ID_LENGTH,
+                                   db_index=True)
+    database = models.ForeignKey(BaseXDB, on_delete=models.CASCADE,
+                                 related_name='sentences')
+    pre = models.PositiveBigIntegerField()
+
+    def __str__(self):
+        return '{} in {}'.format(self.sentence_id, self.database)
+
+
+def get_database_statistics(dbnames: Iterable[str]) \
+        -> Dict[str, Union[Tuple[int, int, int], Exception]]:
+    '''Return a dictionary with the result of BaseXDB.get_statistics
+    for all given database names, or the exception it raised. The
+    databases are queried concurrently, using the number of sessions given
+    by the DATABASE_STATISTICS_WORKERS setting.'''
+    def get_statistics(dbname):
+        try:
+            return BaseXDB(dbname=dbname).get_statistics()
+        except (OSError, ValueError) as err:
+            return err
+
+    dbnames = list(dbnames)
+    if not dbnames:
+        return {}
+    with ThreadPoolExecutor(settings.DATABASE_STATISTICS_WORKERS) as pool:
+        return dict(zip(dbnames, pool.map(get_statistics, dbnames)))
 
 
 @receiver(pre_delete, sender=BaseXDB)
@@ -0,0 +1,178 @@
+"""Policy deciding how the sentences of a component are divided over BaseX
+databases (shards), and rebalancing of existing components according to it.
+A few huge databases are slow to search, while searching many tiny
+databases is dominated by the overhead of every query."""
+
+import logging
+import math
+import tempfile
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from services.basex import basex
+from search.basex_search import generate_xquery_sentences
+from .models import Component, BaseXDB
+
+logger = logging.getLogger(__name__)
+
+
+class ShardingPolicy:
+    def __init__(self, max_bytes: int, max_sentences: Optional[int] = None):
+        if max_bytes < 1 or (max_sentences is not None and max_sentences < 1):
+            raise ValueError('Shard size should be positive')
+        self.max_bytes = max_bytes
+        self.max_sentences = max_sentences
+
+    @classmethod
+    def from_settings(cls) -> 'ShardingPolicy':
+        return cls(settings.DATABASE_SHARD_SIZE,
+                   settings.DATABASE_SHARD_SENTENCES)
+
+    def is_full(self, nr_bytes: int, nr_sentences: int) -> bool:
+        '''Return True if a shard with the given size in bytes of XML and
+        number of sentences is complete'''
+        if nr_bytes >= self.max_bytes:
+            return True
+        return self.max_sentences is not None and \
+            nr_sentences >= self.max_sentences
+
+    def get_number_of_shards(self, nr_bytes: int, nr_sentences: int) -> int:
+        '''Return the number of shards needed for the given amount of data'''
+        number = math.ceil(nr_bytes / self.max_bytes)
+        if self.max_sentences is not None:
+            number = max(number,
+                         math.ceil(nr_sentences / self.max_sentences))
+        return max(1, number)
+
+    def is_balanced(self, component: Component) -> bool:
+        '''Return True if a component consists of about the number of
+        databases this policy would create for it. One database more or
+        less is accepted, because the exact number depends on where the
+        sentences cross the limits. The size of the XML the databases were
+        created from is used; if it is unknown, the size of the database in
+        BaseX (which includes the indexes) is used as an estimate.'''
+        nr_bytes = 0
+        databases = list(component.databases.only('size', 'xml_size'))
+        for database in databases:
+            if database.xml_size is not None:
+                nr_bytes += database.xml_size
+            else:
+                nr_bytes += database.size * 1024
+        expected = self.get_number_of_shards(nr_bytes,
+                                             component.nr_sentences or 0)
+        return abs(len(databases) - expected) <= 1
+
+
+def get_shard_name(component: Component, generation: str, number: int) -> str:
+    return 'GRETEL5_{}_{}_S{}_{}'.format(component.treebank.slug,
+                                         component.slug, generation,
+                                         number).upper()
+
+
+class ShardWriter:
+    '''Writes sentences to new BaseX databases for a component, completing
+    a database whenever it is full according to the policy'''
+    def __init__(self, component: Component, policy: ShardingPolicy):
+        self.component = component
+        self.policy = policy
+        self.generation = timezone.now().strftime('%Y%m%d%H%M%S')
+        # Unsaved BaseXDB objects of the databases created so far
+        self.databases: List[BaseXDB] = []
+        self._shard = None
+        self._nr_bytes = self._nr_sentences = 0
+
+    def _start_shard(self):
+        self._shard = tempfile.TemporaryFile()
+        self._shard.write(b'<treebank>')
+        self._nr_bytes = self._nr_sentences = 0
+
+    def _complete_shard(self):
+        shard, self._shard = self._shard, None
+        shard.write(b'</treebank>')
+        xml_size = shard.tell()
+        shard.seek(0)
+        name = get_shard_name(self.component, self.generation,
+                              len(self.databases))
+        with shard:
+            basex.create(name, shard)
+        self.databases.append(BaseXDB(dbname=name, component=self.component,
+                                      xml_size=xml_size))
+
+    def add(self, sentence: str) -> None:
+        if self._shard is None:
+            self._start_shard()
+        data = sentence.encode()
+        self._shard.write(data)
+        self._nr_bytes += len(data)
+        self._nr_sentences += 1
+        if self.policy.is_full(self._nr_bytes, self._nr_sentences):
+            self._complete_shard()
+
+    def finish(self) -> List[BaseXDB]:
+        '''Complete the last database and return the BaseXDB objects of
+        all new databases'''
+        if self._shard is None and not self.databases:
+            # Keep an (empty) database for an empty component
+            self._start_shard()
+        if self._shard is not None:
+            self._complete_shard()
+        return self.databases
+
+    def discard(self) -> None:
+        '''Delete the databases created so far'''
+        if self._shard is not None:
+            self._shard.close()
+            self._shard = None
+        for database in self.databases:
+            try:
+                basex.execute('DROP DB {}'.format(database.dbname))
+            except OSError as err:
+                logger.error('Cannot delete database {} from BaseX: {}'
+                             .format(database.dbname, err))
+
+
+def reshard(component: Component, policy: ShardingPolicy) -> List[BaseXDB]:
+    '''Copy all sentences of a component, in order, to new BaseX databases
+    divided according to the policy and replace the old databases with
+    them. Return the new BaseXDB objects. An OSError will be raised if
+    something goes wrong in BaseX; in that case the component is left
+    unchanged.'''
+    old_databases = list(component.databases.order_by('dbname'))
+    writer = ShardWriter(component, policy)
+    try:
+        for database in old_databases:
+            xquery = generate_xquery_sentences(database.dbname)
+            for _, sentence in basex.perform_query_iter(
+                    xquery, database.dbname, 'sentences'):
+                writer.add(sentence)
+        new_databases = writer.finish()
+        for database in new_databases:
+            database.size, database.nr_sentences, database.nr_words = \
+                database.get_statistics()
+    except BaseException:
+        writer.discard()
+        raise
+
+    with transaction.atomic():
+        # Also deletes the records of imported files of the old databases
+        for database in old_databases:
+            # Deletes the BaseX database if DELETE_COMPONENTS_FROM_BASEX
+            database.delete()
+        BaseXDB.objects.bulk_create(new_databases)
+    if not settings.DELETE_COMPONENTS_FROM_BASEX:
+        # The contents have been copied, so the old databases are no
+        # longer needed
+        for database in old_databases:
+            database.delete_basex_db()
+    for database in new_databases:
+        try:
+            database.build_lookup_tables()
+        except (OSError, ValueError) as err:
+            logger.warning('Could not build lookup tables for {}: {}'
+                           .format(database, err))
+    logger.info('Resharded component {}: {} databases replaced by {}.'
+                .format(component, len(old_databases), len(new_databases)))
+    return new_databases
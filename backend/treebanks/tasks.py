@@ -0,0 +1,8 @@
+from celery import shared_task
+from .models import Component
+
+
+@shared_task
+def update_component_statistics(component_id: int):
+    component = Component.objects.get(id=component_id)
+    component.update_statistics()
@@ -1,6 +1,9 @@
+from unittest.mock import patch
+
 from django.test import TestCase
 
-from .models import Treebank, Component, BaseXDB
+from .models import Treebank, Component, BaseXDB, AttributeCount
+from .sharding import ShardingPolicy
 
 
 class TreebankTestCase(TestCase):
@@ -22,3 +25,84 @@ class TreebankTestCase(TestCase):
         self.assertEqual(ser['components'][0]['slug'], 'testcomp1')
         self.assertEqual(len(ser['components'][0]['databases']), 1)
         self.assertEqual(ser['components'][0]['databases'][0], 'TESTDB')
+
+    def test_get_attribute_counts(self):
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        comp = Component.objects.create(slug='testcomp1', title='Testcomp1',
+                                        treebank=treebank, nr_sentences=0,
+                                        nr_words=0)
+        db1 = BaseXDB.objects.create(dbname='TESTDB1', size=0, component=comp,
+                                     has_attribute_counts=True)
+        BaseXDB.objects.create(dbname='TESTDB2', size=0, component=comp,
+                               has_attribute_counts=True)
+        BaseXDB.objects.create(dbname='TESTDB3', size=0, component=comp)
+        AttributeCount.objects.create(database=db1, attribute='lemma',
+                                      value='lopen', count=3)
+        self.assertEqual(comp.get_attribute_counts('lemma', 'lopen'),
+                         {'TESTDB1': 3, 'TESTDB2': 0})
+        # Attributes that are not counted and values that are too long
+        # to be stored are unknown for all databases
+        self.assertEqual(comp.get_attribute_counts('sense', 'lopen'), {})
+        self.assertEqual(comp.get_attribute_counts('lemma', 'x' * 1000), {})
+
+    def test_update_statistics(self):
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        comp = Component.objects.create(slug='testcomp1', title='Testcomp1',
+                                        treebank=treebank, nr_sentences=0,
+                                        nr_words=0)
+        BaseXDB.objects.create(dbname='TESTDB1', size=1, component=comp,
+                               nr_sentences=10, nr_words=100)
+        BaseXDB.objects.create(dbname='TESTDB2', size=1, component=comp)
+        BaseXDB.objects.create(dbname='TESTDB3', size=1, component=comp)
+
+        def get_statistics(database):
+            if database.dbname == 'TESTDB3':
+                raise OSError('Database not found')
+            return 2, 5, 40
+
+        # Only databases of which the counts are unknown are queried, and
+        # a failing database does not prevent updating the others
+        with patch.object(BaseXDB, 'get_statistics', autospec=True,
+                          side_effect=get_statistics) as mocked:
+            comp.update_statistics()
+        self.assertEqual(mocked.call_count, 2)
+        comp.refresh_from_db()
+        self.assertEqual(comp.nr_sentences, 15)
+        self.assertEqual(comp.nr_words, 140)
+        database = BaseXDB.objects.get(dbname='TESTDB2')
+        self.assertEqual((database.size, database.nr_sentences,
+                          database.nr_words), (2, 5, 40))
+        self.assertIsNone(BaseXDB.objects.get(dbname='TESTDB3').nr_sentences)
+
+
+class ShardingPolicyTestCase(TestCase):
+    def test_policy(self):
+        policy = ShardingPolicy(1000)
+        self.assertFalse(policy.is_full(999, 1000))
+        self.assertTrue(policy.is_full(1000, 1))
+        self.assertEqual(policy.get_number_of_shards(0, 0), 1)
+        self.assertEqual(policy.get_number_of_shards(2500, 10), 3)
+        policy = ShardingPolicy(1000, 10)
+        self.assertTrue(policy.is_full(10, 10))
+        self.assertEqual(policy.get_number_of_shards(2500, 45), 5)
+        with self.assertRaises(ValueError):
+            ShardingPolicy(0)
+
+    def test_is_balanced(self):
+        treebank = Treebank.objects.create(slug='test', title='Test')
+        comp = Component.objects.create(slug='testcomp1', title='Testcomp1',
+                                        treebank=treebank, nr_sentences=100,
+                                        nr_words=1000)
+        for i in range(3):
+            BaseXDB.objects.create(dbname='TESTDB{}'.format(i), size=400,
+                                   component=comp)
+        # 1200 KiB in three databases
+        self.assertTrue(ShardingPolicy(500 * 1024).is_balanced(comp))
+        self.assertFalse(ShardingPolicy(2000 * 1024).is_balanced(comp))
+        self.assertFalse(ShardingPolicy(2000 * 1024, 10).is_balanced(comp))
+        # One database more or less is accepted
+        self.assertTrue(ShardingPolicy(350 * 1024).is_balanced(comp))
+        # The size of the XML is used if it is known: 300 KiB
+        comp.databases.update(xml_size=100 * 1024)
+        self.assertTrue(ShardingPolicy(100 * 1024).is_balanced(comp))
+        self.assertFalse(ShardingPolicy(1000 * 1024).is_balanced(comp))
@@ -0,0 +1,95 @@
+"""Conversion of compressed LASSY files (.data.dz) to XML documents that are
+ready to be added to BaseX."""
+
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import zlib
+from typing import BinaryIO, Optional, Tuple
+
+# Number of bytes read at once when calculating a hash
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Number of words in a sentence, taken from the top node like gretel-upload
+END_ATTRIBUTE = re.compile(rb'end="(.+?)"')
+
+
+class InputError(RuntimeError):
+    pass
+
+
+def convert_data_dz(input_filename: str, output: BinaryIO) -> Tuple[int, int]:
+    '''Convert a .data.dz file to a single XML document with a <treebank>
+    root element and write it (UTF-8 encoded) to output. The file is read
+    and written in a single streaming pass, so memory usage does not depend
+    on the size of the file. Sentences get an ID consisting of the filename
+    and a sequence number. Return a tuple of the number of sentences and the
+    number of words. Raises InputError if the file cannot be read; in that
+    case output may contain incomplete data.'''
+    current_id = 0
+    number_of_sentences = 0
+    number_of_words = 0
+    try:
+        f = gzip.open(input_filename, 'rb')
+    except OSError as err:
+        raise InputError('Cannot open {}: {}.'.format(input_filename, err))
+    output.write(b'<treebank>\n')
+    try:
+        with f:
+            for line in f:
+                try:
+                    line.decode()
+                except UnicodeDecodeError:
+                    raise InputError('Error in unicode decoding in file {}.'
+                                     .format(input_filename))
+                if line.startswith(b'<?xml'):
+                    number_of_sentences += 1
+                    continue  # Do not include <?xml line in output file
+                if b'cat="top"' in line:
+                    number_of_words += int(END_ATTRIBUTE.search(line).group(1))
+                if b'<alpino_ds' in line:
+                    # Add id to the end of the tag for identification in GrETEL
+                    tagend_pos = line.find(b'>')
+                    id_attr = ' id="{}:{}"'.format(input_filename, current_id)
+                    line = line[:tagend_pos] + id_attr.encode() + \
+                        line[tagend_pos:]
+                    current_id += 1
+                output.write(line)
+    except (gzip.BadGzipFile, zlib.error, EOFError):
+        raise InputError('Cannot open {}: bad gzip file.'
+                         .format(input_filename))
+    output.write(b'</treebank>')
+    return number_of_sentences, number_of_words
+
+
+def convert_data_dz_to_file(input_filename: str,
+                            directory: Optional[str] = None) \
+        -> Tuple[str, int, int]:
+    '''Convert a .data.dz file like convert_data_dz, writing the result to
+    a new temporary file in the given directory (or the default directory
+    for temporary files). Return a tuple of the path of that file, the number
+    of sentences and the number of words. The caller is responsible for
+    removing the file; it is removed here if an InputError is raised. This
+    function is defined at module level so that it can be run in a process
+    pool.'''
+    fd, path = tempfile.mkstemp(suffix='.xml', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            number_of_sentences, number_of_words = \
+                convert_data_dz(input_filename, output)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, number_of_sentences, number_of_words
+
+
+def get_file_hash(filename: str) -> str:
+    '''Return the SHA-256 hash of the contents of a file as a hexadecimal
+    string.'''
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
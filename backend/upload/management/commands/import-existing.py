@@ -1,8 +1,10 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.db import transaction
 
 import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 from treebanks.models import Treebank, Component, BaseXDB
 from services.basex import basex
@@ -42,20 +44,46 @@ class Command(BaseCommand):
     class ArgumentError(RuntimeError):
         pass
 
-    def create_database(self, dbname: str):
-        # Get database size (and check if it exists)
+    def probe_database(self, dbname: str):
+        '''Optimize the indexes of a database if needed and return its
+        BaseXDB object with size and counts filled in, or the exception
+        raised if the database cannot be accessed. Runs in a thread pool.'''
         basex_db = BaseXDB(dbname)
         try:
-            basex_db.size = basex_db.get_db_size()
-            words = basex_db.get_number_of_words()
-            sentences = basex_db.get_number_of_sentences()
-        except OSError as err:
+            if basex.needs_optimization(dbname):
+                self.stdout.write('Optimizing indexes of {}...'
+                                  .format(dbname))
+                basex.optimize(dbname)
+            basex_db.size, basex_db.nr_sentences, basex_db.nr_words = \
+                basex_db.get_statistics()
+        except (OSError, ValueError) as err:
+            return err
+        return basex_db
+
+    def probe_databases(self):
+        '''Probe all databases in the configuration concurrently and store
+        the results in self.databases'''
+        dbnames = []
+        for comp in self.config_components:
+            for dbname in comp.get('databases', []):
+                if dbname not in dbnames:
+                    dbnames.append(dbname)
+        self.stdout.write('Inspecting {} BaseX databases...'
+                          .format(len(dbnames)))
+        with ThreadPoolExecutor(settings.DATABASE_STATISTICS_WORKERS) as pool:
+            self.databases = dict(
+                zip(dbnames, pool.map(self.probe_database, dbnames))
+            )
+
+    def create_database(self, dbname: str):
+        basex_db = self.databases[dbname]
+        if isinstance(basex_db, Exception):
             raise CommandError(
                 'Error accessing BaseX database {}: {}'
                 ' - probably this database does not exist.'
-                .format(dbname, str(err))
+                .format(dbname, str(basex_db))
             )
-        return basex_db, words, sentences
+        return basex_db, basex_db.nr_words, basex_db.nr_sentences
 
     def create_component(self, comp: dict):
         try:
@@ -117,6 +145,7 @@ class Command(BaseCommand):
         self.treebank.metadata = self.configuration.get('metadata', '{}')
 
         # Get all Component and BaseXDB objects
+        self.probe_databases()
         component_objs = []
         all_db_objs = []  # A flat list of all BaseXDB objects
         for component_config in self.config_components:
@@ -125,11 +154,21 @@ class Command(BaseCommand):
             all_db_objs.extend(db_objs)
 
         # If all objects have been created successfully, save them
-        self.treebank.save()
-        for component_obj in component_objs:
-            component_obj.save()
+        with transaction.atomic():
+            self.treebank.save()
+            for component_obj in component_objs:
+                component_obj.save()
+            BaseXDB.objects.bulk_create(all_db_objs, batch_size=1000)
+
+        # Store attribute counts and sentence positions to speed up searching
         for db_obj in all_db_objs:
-            db_obj.save()
+            try:
+                db_obj.build_lookup_tables()
+            except (OSError, ValueError) as err:
+                self.stdout.write(self.style.WARNING(
+                    'Could not build lookup tables for {}: {}.'
+                    .format(db_obj.dbname, err)
+                ))
 
         self.stdout.write(self.style.SUCCESS(
             'Successfully imported treebank {} with existing BaseX databases'
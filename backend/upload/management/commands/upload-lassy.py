@@ -1,17 +1,24 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.utils.text import slugify
 from django.utils import timezone
+from django.db import transaction
 
 import os
 import sys
 import glob
-import gzip
-import zlib
 import re
 import csv
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 
-from treebanks.models import Treebank, Component, BaseXDB
+from treebanks.models import (Treebank, Component, BaseXDB, AttributeCount,
+                              SentenceLocation)
 from services.basex import basex
+from upload.lassy import convert_data_dz_to_file, get_file_hash, InputError
+from upload.models import ImportedFile
+from search.models import ComponentSearchResult
+from treebanks.sharding import ShardingPolicy, reshard
 
 
 def userinputyesno(prompt, default=False):
@@ -58,72 +65,163 @@ class Command(BaseCommand):
             help='answer the defaults to any interactive questions',
             action='store_true'
         )
+        parser.add_argument(
+            '--jobs', '-j',
+            help='number of processes used to decompress and convert files '
+                 'in parallel (default: 1)',
+            type=int,
+            default=1
+        )
+        parser.add_argument(
+            '--writers',
+            help='number of simultaneous BaseX sessions used to create '
+                 'databases if --jobs is given (default: the number of jobs, '
+                 'with a maximum of 4)',
+            type=int,
+            default=None
+        )
+        parser.add_argument(
+            '--resume',
+            help='resume an interrupted import of the same treebank: files '
+                 'that have been imported completely and have not changed '
+                 'since are skipped',
+            action='store_true'
+        )
+        parser.add_argument(
+            '--update',
+            help='update an existing treebank: files that are new are added '
+                 'and files that have changed are imported again, while '
+                 'other databases of the treebank are left untouched',
+            action='store_true'
+        )
+        parser.add_argument(
+            '--reshard',
+            help='afterwards, divide the sentences of components over new '
+                 'databases according to the sharding policy instead of '
+                 'keeping one database per file (a resharded treebank '
+                 'cannot be resumed or updated)',
+            action='store_true'
+        )
 
-    class InputError(RuntimeError):
-        pass
+        parser.add_argument(
+            '--checkpoint',
+            help='number of imported files of which the records are written '
+                 'to the database at once (default: 500); after an '
+                 'interruption, at most this many files are imported again',
+            type=int,
+            default=500
+        )
 
     class ArgumentError(RuntimeError):
         pass
 
-    def process_file(self, input_filename):
+    def add_to_basex(self, basex_db, converted):
+        """
+        Create a BaseX database from a file converted by
+        convert_data_dz_to_file and remove the converted file afterwards
+
+        :param basex_db: Name of the BaseX database
+        :param converted: Tuple of the path of the converted file, the number
+        of sentences and the number of words
+        :return: a tuple of the number of sentences, number of words, the
+        size of the database in KiB and the size of the XML in bytes
+        """
+        path, number_of_sentences, number_of_words = converted
+        try:
+            xml_size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                basex.create(basex_db, f)
+            # Get database size in KiB
+            dbsize = int(basex.perform_query(
+                'db:property("{}", "size")'.format(basex_db),
+                basex_db, 'size'
+            ))
+        finally:
+            os.remove(path)
+        return (number_of_sentences, number_of_words, int(dbsize / 1024),
+                xml_size)
+
+    def import_file(self, input_filename, basex_db):
         """
         Process a .data.dz file by extracting it, counting number of sentences
-        and words and outputting to an XML file that is ready for BaseX
+        and words and adding it to BaseX. Raises InputError if the file
+        cannot be read and OSError if adding it to BaseX fails.
 
         :param input_filename: Path to input file
-        :return: a tuple of the output, the number of sentences and number of
-        words
+        :param basex_db: Name of the BaseX database
+        :return: a tuple of the number of sentences, number of words, the
+        size of the database in KiB and the size of the XML in bytes
         """
-        current_id = 0
-        number_of_sentences = 0
-        number_of_words = 0
-        try:
-            f = gzip.open(input_filename, 'r')
-        except gzip.BadGzipFile:
-            self.stdout.write(self.style.ERROR(
-                'Cannot open {}: bad gzip file.'.format(input_filename)
-            ))
-            raise self.InputError
-        # Read whole file to make sure it is not corrupted
-        lines = []
-        try:
-            for line in f:
-                try:
-                    lines.append(line.decode())
-                except UnicodeDecodeError:
-                    self.stdout.write(self.style.ERROR(
-                        'Error in unicode decoding in file {}.'
-                        .format(input_filename)
-                    ))
-                    raise self.InputError
-        except (gzip.BadGzipFile, zlib.error, EOFError):
-            self.stdout.write(self.style.ERROR(
-                'Cannot open {}: bad gzip file.'.format(input_filename)
-            ))
-            raise self.InputError
-
-        output = '<treebank>\n'
-
-        for line in lines:
-            if line.startswith('<?xml'):
-                number_of_sentences += 1
-                continue  # Do not include <?xml line in output file
-            if 'cat="top"' in line:
-                # Like gretel-upload, determine number of words using the
-                # 'end' attribute in the top-level node
-                number_of_words += int(
-                    re.search('end=\"(.+?)\"', line).group(1)
-                )
-            if '<alpino_ds' in line:
-                # Add id to the end of the tag for identification in GrETEL
-                tagend_pos = line.find('>')
-                id_attr = ' id="{}:{}"'.format(input_filename, current_id)
-                line = line[:tagend_pos] + id_attr + line[tagend_pos:]
-                current_id += 1
-            output += line
+        return self.add_to_basex(basex_db,
+                                 convert_data_dz_to_file(input_filename))
 
-        output += '</treebank>'
-        return (output, number_of_sentences, number_of_words)
+    def import_files(self, inputfiles, treebank_db, jobs, writers):
+        """
+        Import all input files, yielding a tuple of the input file, the name
+        of its BaseX database and a function that returns the result of
+        import_file (or raises its exceptions) for every file, in the order
+        of the input files. If jobs is larger than 1, files are converted in
+        a pool of processes and the results are added to BaseX by a pool of
+        writer threads. The number of files that are converted in advance is
+        limited, so that not too many converted files are waiting on disk.
+        """
+        databases = [self.get_database_name(treebank_db, dzfile)
+                     for dzfile in inputfiles]
+        if jobs == 1:
+            for dzfile, basex_db in zip(inputfiles, databases):
+                yield dzfile, basex_db, partial(self.import_file, dzfile,
+                                                basex_db)
+            return
+
+        def convert_and_add(conversion, basex_db):
+            return self.add_to_basex(basex_db, conversion.result())
+
+        window = 2 * jobs + writers
+        with ProcessPoolExecutor(jobs) as converters, \
+                ThreadPoolExecutor(writers) as writer_pool:
+            pending = deque()
+            to_submit = iter(zip(inputfiles, databases))
+            while True:
+                for dzfile, basex_db in to_submit:
+                    conversion = converters.submit(convert_data_dz_to_file,
+                                                   dzfile)
+                    # Writers take files in input order
+                    result = writer_pool.submit(convert_and_add, conversion,
+                                                basex_db)
+                    pending.append((dzfile, basex_db, conversion, result))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                dzfile, basex_db, conversion, result = pending.popleft()
+                try:
+                    yield dzfile, basex_db, result.result
+                except GeneratorExit:
+                    # Do not start any more work when the import is
+                    # interrupted; running conversions will still finish and
+                    # are removed in the writer threads.
+                    for _, _, conversion, result in pending:
+                        if result.cancel() and not conversion.cancel():
+                            conversion.add_done_callback(
+                                self.remove_converted_file)
+                    raise
+
+    @staticmethod
+    def remove_converted_file(conversion):
+        if conversion.exception() is None:
+            os.remove(conversion.result()[0])
+
+    def get_database_name(self, treebank_db: str, dzfile: str) -> str:
+        return treebank_db + '_' + self.get_file_title(dzfile).upper()
+
+    def get_relative_path(self, dzfile: str) -> str:
+        return os.path.relpath(dzfile, self.input_dir)
+
+    def get_file_title(self, dzfile: str) -> str:
+        dzfile_name = os.path.basename(dzfile)
+        if dzfile.endswith('.data.dz'):
+            return dzfile_name[:-len('.data.dz')]
+        return dzfile_name
 
     def determine_component_id(self, filename: str):
         """
@@ -226,6 +324,249 @@ class Command(BaseCommand):
                     'Deleted existing BaseX databases.'
                 ))
 
+    def get_unrecorded_databases(self, treebank_db):
+        """
+        Return the databases of the current treebank that do not have an
+        ImportedFile record. Raise a CommandError if any of these databases
+        does not belong to an input file (e.g. because the treebank has
+        been resharded), because such a treebank cannot be resumed or
+        updated file by file.
+        """
+        names = {self.get_database_name(treebank_db, dzfile)
+                 for dzfile in self.inputfiles}
+        unrecorded = list(BaseXDB.objects.filter(
+            component__treebank=self.treebank, imported_file__isnull=True
+        ))
+        others = [database.dbname for database in unrecorded
+                  if database.dbname not in names]
+        if others:
+            raise CommandError(
+                'Treebank {} contains databases that do not belong to an '
+                'input file, e.g. because it has been resharded ({}). Import '
+                'it again without --resume or --update instead.'
+                .format(self.treebank.slug, ', '.join(others[:3]))
+            )
+        return unrecorded
+
+    def resume_import(self, treebank_db) -> set:
+        """
+        Check the files recorded as imported in a previous run of this
+        command for the current treebank and return a set of the relative
+        paths of the files that do not have to be imported again. The
+        databases of files that have changed, that have been removed or of
+        which the BaseX database is incomplete are deleted, as well as
+        databases that have not been recorded at all.
+        """
+        unrecorded = self.get_unrecorded_databases(treebank_db)
+        current_files = {self.get_relative_path(dzfile): dzfile
+                         for dzfile in self.inputfiles}
+        completed = set()
+        for record in self.treebank.imported_files \
+                .select_related('database'):
+            dzfile = current_files.get(record.path)
+            if dzfile is not None and \
+                    get_file_hash(dzfile) == record.sha256 and \
+                    record.verify():
+                completed.add(record.path)
+                database = record.database
+                if not (database.has_attribute_counts and
+                        database.has_sentence_index):
+                    try:
+                        database.build_lookup_tables()
+                    except (OSError, ValueError) as err:
+                        self.stdout.write(self.style.WARNING(
+                            'Could not build lookup tables for {}: {}.'
+                            .format(database, err)
+                        ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    'File {} has changed or its database is incomplete; '
+                    'it will be imported again.'.format(record.path)
+                ))
+                # Also deletes the record
+                record.database.delete()
+        # Databases without a record were added by an interrupted run
+        # before their file was completely imported
+        for database in unrecorded:
+            database.delete()
+        # Count only what is left
+        components = list(self.treebank.components.all())
+        for component in components:
+            records = ImportedFile.objects.filter(
+                database__component=component
+            )
+            component.nr_sentences = sum(x.nr_sentences for x in records)
+            component.nr_words = sum(x.nr_words for x in records)
+        Component.objects.bulk_update(components,
+                                      ['nr_sentences', 'nr_words'])
+        self.stdout.write(self.style.SUCCESS(
+            'Resuming import: {} files have already been imported.'
+            .format(len(completed))
+        ))
+        return completed
+
+    def record_existing_databases(self, treebank_db):
+        """
+        Create ImportedFile records for databases of the current treebank
+        that belong to an input file but were imported before imports were
+        recorded. The input files of these databases are assumed not to have
+        changed since; the numbers of sentences and words are counted in
+        BaseX if they are not known yet.
+        """
+        databases = {
+            database.dbname: database
+            for database in BaseXDB.objects.filter(
+                component__treebank=self.treebank,
+                imported_file__isnull=True
+            )
+        }
+        records = []
+        for dzfile in self.inputfiles:
+            database = databases.get(self.get_database_name(treebank_db,
+                                                            dzfile))
+            if database is None:
+                continue
+            if database.nr_sentences is None or database.nr_words is None:
+                try:
+                    _, database.nr_sentences, database.nr_words = \
+                        database.get_statistics()
+                except (OSError, ValueError) as err:
+                    raise CommandError(
+                        'Cannot count sentences and words of database {}: {}'
+                        .format(database, err)
+                    )
+            records.append(ImportedFile(
+                treebank=self.treebank,
+                path=self.get_relative_path(dzfile),
+                sha256=get_file_hash(dzfile),
+                database=database,
+                nr_sentences=database.nr_sentences,
+                nr_words=database.nr_words
+            ))
+            self.stdout.write(self.style.WARNING(
+                'Database {} was not recorded; assuming that {} has not '
+                'changed since it was imported.'
+                .format(database, os.path.basename(dzfile))
+            ))
+        ImportedFile.objects.bulk_create(records, batch_size=1000)
+
+    def prepare_update(self, treebank_db) -> set:
+        """
+        Compare the input files with the files recorded as imported for the
+        current treebank and return a set of the relative paths of the files
+        that have not changed and do not have to be imported again.
+        """
+        self.get_unrecorded_databases(treebank_db)
+        self.record_existing_databases(treebank_db)
+        current_files = {self.get_relative_path(dzfile): dzfile
+                         for dzfile in self.inputfiles}
+        unchanged = set()
+        changed = 0
+        for record in self.treebank.imported_files.all():
+            dzfile = current_files.get(record.path)
+            if dzfile is None:
+                # Not part of this update
+                continue
+            if get_file_hash(dzfile) == record.sha256:
+                unchanged.add(record.path)
+            else:
+                changed += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Updating treebank: {} files have not changed, {} files have '
+            'changed and {} files are new.'.format(
+                len(unchanged), changed,
+                len(self.inputfiles) - len(unchanged) - changed
+            )
+        ))
+        return unchanged
+
+    def save_checkpoint(self):
+        """
+        Write the databases and records of the files imported since the
+        previous checkpoint and the updated totals of their components to
+        the database in a single transaction, then invalidate cached search
+        results of these components and build the lookup tables of the new
+        databases. Until then, the databases of these files are unrecorded
+        and will be imported again if the import is interrupted.
+        """
+        databases, self.pending_databases = self.pending_databases, []
+        records, self.pending_records = self.pending_records, []
+        components, self.changed_components = self.changed_components, {}
+        if not records:
+            return
+        with transaction.atomic():
+            # Databases of files that are imported again are replaced
+            BaseXDB.objects.bulk_create(
+                databases, batch_size=1000, update_conflicts=True,
+                unique_fields=['dbname'],
+                update_fields=['size', 'xml_size', 'nr_sentences', 'nr_words',
+                               'component', 'has_attribute_counts',
+                               'has_sentence_index', 'modified']
+            )
+            ImportedFile.objects.bulk_create(
+                records, batch_size=1000, update_conflicts=True,
+                unique_fields=['treebank', 'path'],
+                update_fields=['sha256', 'database', 'nr_sentences',
+                               'nr_words', 'imported']
+            )
+            Component.objects.bulk_update(components.values(),
+                                          ['nr_sentences', 'nr_words'])
+        # Cached results of these components are no longer complete
+        ComponentSearchResult.invalidate(components.values())
+        for database in databases:
+            try:
+                database.build_lookup_tables()
+            except (OSError, ValueError) as err:
+                self.stdout.write(self.style.WARNING(
+                    'Could not build lookup tables for {}: {}.'
+                    .format(database, err)
+                ))
+
+    def clear_lookup_tables(self, database):
+        """
+        Clear the lookup tables of a database that is replaced in BaseX and
+        invalidate cached search results of its component right away, so
+        that searches do not use stale counts or sentence positions until
+        the database is recorded again at the next checkpoint.
+
+        :param database: BaseXDB object of the replaced database
+        """
+        with transaction.atomic():
+            AttributeCount.objects.filter(database=database).delete()
+            SentenceLocation.objects.filter(database=database).delete()
+            # Updating modified also invalidates cached trees
+            BaseXDB.objects.filter(pk=database.pk).update(
+                has_attribute_counts=False, has_sentence_index=False,
+                modified=timezone.now()
+            )
+        ComponentSearchResult.invalidate([database.component])
+
+    def reshard_components(self):
+        """
+        Reshard the components of the current treebank that do not consist
+        of the number of databases the sharding policy would create.
+        """
+        policy = ShardingPolicy.from_settings()
+        for component in self.treebank.components.all():
+            if not component.databases.exists() or \
+                    policy.is_balanced(component):
+                continue
+            number_of_databases = component.databases.count()
+            try:
+                new_databases = reshard(component, policy)
+            except OSError as err:
+                self.stdout.write(self.style.WARNING(
+                    'Could not reshard component {}: {}.'
+                    .format(component.slug, err)
+                ))
+                continue
+            ComponentSearchResult.invalidate([component])
+            self.stdout.write(
+                'Resharded component {}: {} databases replaced by {}.'
+                .format(component.slug, number_of_databases,
+                        len(new_databases))
+            )
+
     def wrap_up(self, incomplete=False):
         """
         Give summary to user and set as complete in database.
@@ -244,6 +585,11 @@ class Command(BaseCommand):
                 'Skipped {} files.'
                 .format(self.skipped_files)
             ))
+        if self.resumed_files:
+            self.stdout.write(self.style.SUCCESS(
+                'Skipped {} files that had already been imported.'
+                .format(self.resumed_files)
+            ))
         self.treebank.processed = timezone.now()
         self.treebank.save()
 
@@ -251,6 +597,18 @@ class Command(BaseCommand):
         self.group_by = options['group_by']
         self.input_dir = options['input_dir']
         self.use_defaults = options['defaults']
+        resume = options['resume']
+        update = options['update']
+        if resume and update:
+            raise CommandError('Options --resume and --update cannot be '
+                               'combined.')
+        jobs = options['jobs']
+        writers = options['writers'] or min(jobs, 4)
+        if jobs < 1 or writers < 1:
+            raise CommandError('Number of jobs and writers must be positive.')
+        self.checkpoint = options['checkpoint']
+        if self.checkpoint < 1:
+            raise CommandError('Checkpoint size must be positive.')
 
         # Load list of user-friendly components names, if given
         if options['components_names']:
@@ -288,15 +646,24 @@ class Command(BaseCommand):
 
         # Create treebank in database
         treebank_slug = slugify(treebank_title)
-        self.check_existing_treebank(treebank_slug)
-        self.treebank = Treebank()
-        self.treebank.title = treebank_title
-        self.treebank.slug = treebank_slug
-        self.treebank.save()
+        completed = set()
+        if (resume or update) and \
+                Treebank.objects.filter(slug=treebank_slug).exists():
+            self.treebank = Treebank.objects.get(slug=treebank_slug)
+            if resume:
+                completed = self.resume_import(treebank_db)
+            else:
+                completed = self.prepare_update(treebank_db)
+        else:
+            self.check_existing_treebank(treebank_slug)
+            self.treebank = Treebank()
+            self.treebank.title = treebank_title
+            self.treebank.slug = treebank_slug
+            self.treebank.save()
 
-        # Check if BaseX databases with the same prefix already exist to
-        # prevent them from being overwritten.
-        self.check_existing_databases(treebank_db)
+            # Check if BaseX databases with the same prefix already exist to
+            # prevent them from being overwritten.
+            self.check_existing_databases(treebank_db)
 
         # Start the processing
         self.total_number_of_files = 0
@@ -304,79 +671,134 @@ class Command(BaseCommand):
         self.total_number_of_words = 0
         self.number_of_components = 0
         self.skipped_files = 0
-
-        current_comp_id = None
+        self.resumed_files = len(completed)
+
+        # Components and records are kept in memory and written to the
+        # database at checkpoints
+        components = {component.slug: component
+                      for component in self.treebank.components.all()}
+        recorded = {record.path: record for record in
+                    self.treebank.imported_files.select_related(
+                        'database__component')}
+        self.pending_databases = []
+        self.pending_records = []
+        self.changed_components = {}
 
         # Extract all dz files in separate xml files; make a BaseX database
         # for every file and put them in components according to the user's
         # preferences
-        for dzfile in self.inputfiles:
+        inputfiles = [dzfile for dzfile in self.inputfiles
+                      if self.get_relative_path(dzfile) not in completed]
+        imported = self.import_files(inputfiles, treebank_db, jobs, writers)
+        try:
+            self.import_loop(imported, components, recorded)
+        finally:
+            # Record what has been imported, also when interrupted
+            self.save_checkpoint()
+
+        if options['reshard']:
+            self.reshard_components()
+        self.wrap_up()
+
+    def import_loop(self, imported, components: dict, recorded: dict):
+        """
+        Add the results of import_files to the components of the current
+        treebank, saving a checkpoint every time the given number of files
+        has been imported.
+
+        :param imported: Generator returned by import_files
+        :param components: Dictionary of existing components by slug
+        :param recorded: Dictionary of existing ImportedFile records by path
+        """
+        current_comp_id = None
+        for dzfile, basex_db, get_result in imported:
             success = False
             dzfile_name = os.path.basename(dzfile)
-            if dzfile.endswith('.data.dz'):
-                file_title = dzfile_name[:-len('.data.dz')]
-            else:
-                file_title = dzfile_name
+            file_title = self.get_file_title(dzfile)
             # Start new component if a new component id is detected
             comp_id = self.determine_component_id(file_title)
             if current_comp_id != comp_id:
-                component = Component(nr_sentences=0, nr_words=0,
-                                      treebank=self.treebank)
-                component.slug = slugify(comp_id)
-                component.title = self.components_names.get(comp_id, comp_id)
-                component.save()
-                self.stdout.write(
-                    'Starting new component {}.'.format(comp_id)
-                )
-                self.number_of_components += 1
+                component = components.get(slugify(comp_id))
+                if component is None:
+                    component = Component.objects.create(
+                        treebank=self.treebank, slug=slugify(comp_id),
+                        title=self.components_names.get(comp_id, comp_id),
+                        nr_sentences=0, nr_words=0
+                    )
+                    components[component.slug] = component
+                    self.stdout.write(
+                        'Starting new component {}.'.format(comp_id)
+                    )
+                    self.number_of_components += 1
+                else:
+                    self.stdout.write(
+                        'Continuing component {}.'.format(comp_id)
+                    )
                 current_comp_id = comp_id
+            path = self.get_relative_path(dzfile)
+            if path in recorded:
+                # The database of this file is (or, with more than one job,
+                # may already have been) replaced in BaseX
+                self.clear_lookup_tables(recorded[path].database)
             try:
-                output, number_of_sentences, number_of_words = \
-                    self.process_file(dzfile)
-            except self.InputError:
+                number_of_sentences, number_of_words, dbsize_kib, xml_size = \
+                    get_result()
+            except InputError as err:
+                self.stdout.write(self.style.ERROR(str(err)))
                 self.stdout.write(self.style.ERROR(
                     'Cannot read file {}.'.format(dzfile_name)
                 ))
+            except OSError as err:
+                self.stdout.write(self.style.ERROR(
+                    'Adding file {} to BaseX failed: {}.'
+                    .format(dzfile_name, err)
+                ))
             else:
-                # Determine BaseX database name
-                basex_db = treebank_db + '_' + file_title.upper()
-                # Add to BaseX and wrap up if this succeeds
-                try:
-                    basex.create(basex_db, output)
-                    # Get database size in KiB
-                    dbsize = int(basex.perform_query(
-                        'db:property("{}", "size")'.format(basex_db)
-                    ))
-                    dbsize_kib = int(dbsize / 1024)
-                except OSError as err:
-                    self.stdout.write(self.style.ERROR(
-                        'Adding file {} to BaseX failed: {}.'
-                        .format(dzfile_name, err)
-                    ))
-                else:
-                    # Adding to BaseX succeeded; save to database
-                    component.nr_sentences += number_of_sentences
-                    component.nr_words += number_of_words
-                    component.save()
-                    basexdb_obj = BaseXDB(dbname=basex_db, size=dbsize_kib)
-                    basexdb_obj.component = component
-                    basexdb_obj.save()
-                    self.total_number_of_files += 1
-                    self.total_number_of_sentences += number_of_sentences
-                    self.total_number_of_words += number_of_words
-                    success = True
-                    progress = int((self.total_number_of_files +
-                                    self.skipped_files) / len(self.inputfiles)
-                                   * 100)
-                    self.stdout.write(
-                        'Successfully added contents of {} to BaseX. '
-                        'Progress: {}%'.format(dzfile_name, progress)
-                    )
+                # Adding to BaseX succeeded; record that this file is
+                # complete at the next checkpoint
+                replaced = recorded.pop(path, None)
+                if replaced is not None:
+                    # The database has been replaced in BaseX, so subtract
+                    # what it contained before
+                    old_component = components[
+                        replaced.database.component.slug
+                    ]
+                    old_component.nr_sentences -= replaced.nr_sentences
+                    old_component.nr_words -= replaced.nr_words
+                    self.changed_components[old_component.pk] = old_component
+                component.nr_sentences += number_of_sentences
+                component.nr_words += number_of_words
+                self.changed_components[component.pk] = component
+                basexdb_obj = BaseXDB(dbname=basex_db, size=dbsize_kib,
+                                      xml_size=xml_size,
+                                      nr_sentences=number_of_sentences,
+                                      nr_words=number_of_words,
+                                      component=component)
+                self.pending_databases.append(basexdb_obj)
+                self.pending_records.append(ImportedFile(
+                    treebank=self.treebank,
+                    path=path,
+                    sha256=get_file_hash(dzfile),
+                    database=basexdb_obj,
+                    nr_sentences=number_of_sentences,
+                    nr_words=number_of_words
+                ))
+                if len(self.pending_records) >= self.checkpoint:
+                    self.save_checkpoint()
+                self.total_number_of_files += 1
+                self.total_number_of_sentences += number_of_sentences
+                self.total_number_of_words += number_of_words
+                success = True
+                progress = int((self.total_number_of_files +
+                                self.skipped_files + self.resumed_files) /
+                               len(self.inputfiles) * 100)
+                self.stdout.write(
+                    'Successfully added contents of {} to BaseX. '
+                    'Progress: {}%'.format(dzfile_name, progress)
+                )
             if not success:
                 self.stdout.write(self.style.WARNING(
                     'Could not add {} to BaseX because of errors - skipped.'
                     .format(dzfile_name)
                 ))
                 self.skipped_files += 1
-
-        self.wrap_up()
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 23:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treebanks', '0007_sentencelocation'),
+        ('upload', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(help_text='Path of the input file, relative to the input directory', max_length=1000)),
+                ('sha256', models.CharField(max_length=64)),
+                ('nr_sentences', models.PositiveIntegerField()),
+                ('nr_words', models.PositiveBigIntegerField()),
+                ('imported', models.DateTimeField(auto_now_add=True)),
+                ('database', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='imported_file', to='treebanks.basexdb')),
+                ('treebank', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='imported_files', to='treebanks.treebank')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='importedfile',
+            constraint=models.UniqueConstraint(fields=('treebank', 'path'), name='unique_path_in_treebank'),
+        ),
+    ]
@@ -1,9 +1,9 @@
 from pathlib import Path
-import re
+from typing import Tuple
 from lxml import etree
 import logging
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 
@@ -13,13 +13,12 @@ from corpus2alpino.targets.memory import MemoryTarget
 from corpus2alpino.writers.lassy import LassyWriter
 
 from treebanks.models import Treebank, Component, BaseXDB
+from treebanks.sharding import ShardingPolicy
 from services.alpino import alpino, AlpinoError
 from services.basex import basex
 
 logger = logging.getLogger(__name__)
 
-MAXIMUM_DATABASE_SIZE = 1024 * 1024 * 10  # 10 MiB
-
 
 class UploadError(RuntimeError):
     pass
@@ -90,39 +89,53 @@ class TreebankUpload(models.Model):
             datas.append(data)
         return datas
 
-    def _discover_metadata(self, xml: str):
-        '''Helper method to discover the metadata for a number of sentences
-        (to be passed in xml as the argument to this method). This method
-        updates the private _metadata class attribute.'''
-        root = etree.fromstring(xml)
-        for sentence in root.findall('alpino_ds'):
-            metadata = sentence.find('metadata')
-            for meta in metadata.findall('meta'):
-                name = meta.get('name')
-                type_ = meta.get('type')
-                value = meta.get('value')
-                m = self._metadata.get(name, None)
-                if m:
-                    if len(m['values']) <= (self.MAX_METADATA_OPTIONS + 1):
-                        # Only add to values set if not too large -
-                        # we only use this to test if a filter should be
-                        # created
-                        m['values'].add(value)
-                    if m.get('allnumeric', None):
-                        if value.isnumeric():
-                            m['min_value'] = min(m['min_value'], int(value))
-                            m['max_value'] = max(m['max_value'], int(value))
-                        else:
-                            m['allnumeric'] = False
-                else:
-                    m = {}
-                    m['type'] = type_
-                    m['values'] = {value}
+    def _discover_metadata(self, sentence: etree._Element):
+        '''Helper method to discover the metadata of a sentence (an
+        alpino_ds element). This method updates the private _metadata
+        class attribute.'''
+        for meta in sentence.iterfind('metadata/meta'):
+            name = meta.get('name')
+            type_ = meta.get('type')
+            value = meta.get('value')
+            m = self._metadata.get(name, None)
+            if m:
+                if len(m['values']) <= (self.MAX_METADATA_OPTIONS + 1):
+                    # Only add to values set if not too large -
+                    # we only use this to test if a filter should be
+                    # created
+                    m['values'].add(value)
+                if m.get('allnumeric', None):
                     if value.isnumeric():
-                        m['allnumeric'] = True
-                        m['min_value'] = int(value)
-                        m['max_value'] = int(value)
-                    self._metadata[name] = m
+                        m['min_value'] = min(m['min_value'], int(value))
+                        m['max_value'] = max(m['max_value'], int(value))
+                    else:
+                        m['allnumeric'] = False
+            else:
+                m = {}
+                m['type'] = type_
+                m['values'] = {value}
+                if value.isnumeric():
+                    m['allnumeric'] = True
+                    m['min_value'] = int(value)
+                    m['max_value'] = int(value)
+                self._metadata[name] = m
+
+    def _process_sentence(self, sentence: etree._Element,
+                          sentence_id: str) -> Tuple[str, int]:
+        '''Give a sentence (an alpino_ds element) an ID for identification
+        in GrETEL and discover its metadata. Return a tuple of the sentence
+        as a string and its number of words.'''
+        sentence.set('id', sentence_id)
+        self._discover_metadata(sentence)
+        # Like gretel-upload, determine number of words using the
+        # 'end' attribute in the top-level node
+        top = sentence.find('node[@cat="top"]')
+        try:
+            nr_words = int(top.get('end'))
+        except (AttributeError, TypeError, ValueError):
+            nr_words = 0
+        return (etree.tostring(sentence, encoding='unicode', with_tail=False),
+                nr_words)
 
     def _probe_file(self, path):
         '''Probe file format to allow autodiscovery'''
@@ -191,70 +204,66 @@ class TreebankUpload(models.Model):
     def _generate_blocks(self, filenames, componentslug):
         '''A generator function converting all files in filenames to
         Alpino, yielding multiple strings ready to be added to BaseX,
-        respecting MAXIMUM_DATABASE_SIZE.'''
-        # This method directly manipulates the XML using regular expressions,
-        # but it may be a good idea to use lxml for this because of
-        # possible changes in what Alpino returns.
+        divided according to the sharding policy. The output of
+        corpus2alpino is parsed incrementally and every sentence is removed
+        from the tree as soon as it has been processed. The sentences of a
+        file are only added to the output when the whole file could be
+        read, so that no sentences of a file that is skipped end up in
+        BaseX; memory usage is bounded by the database size plus the size
+        of a single file.'''
         current_output = []
         current_length = 0
         current_id = 0
         current_file = 0
         nr_words = 0
         nr_sentences = 0
+        yielded = False
+        policy = ShardingPolicy.from_settings()
         for filename in filenames:
             converter = Converter(FilesystemCollector([filename]),
-                                  annotators=[alpino.annotator],
+                                  annotators=[self._parser],
                                   target=MemoryTarget(),
                                   writer=LassyWriter(True))
-            parses = converter.convert()
+            parser = etree.XMLPullParser(events=('end',), tag='alpino_ds')
+            # Sentences of this file as (XML, number of words) tuples
+            file_output = []
             try:
-                results = list(parses)
+                for output in converter.convert():
+                    parser.feed(output.encode())
+                    for _, sentence in parser.read_events():
+                        file_output.append(self._process_sentence(
+                            sentence, '{}:{}'.format(componentslug, current_id)
+                        ))
+                        current_id += 1
+                        # Discard the sentence and everything before it
+                        sentence.clear()
+                        while sentence.getprevious() is not None:
+                            del sentence.getparent()[0]
+                parser.close()
             except Exception as e:
                 logger.error('Could not process file {} - skipping: {}'
                              .format(filename, str(e)))
-                current_file += 1
-                continue
-            assert len(results) == 1
-            parse = results[0]
+                file_output = []
+            for xml, words in file_output:
+                current_output.append(xml)
+                current_length += len(xml)
+                nr_words += words
+                nr_sentences += 1
+                if policy.is_full(current_length, nr_sentences):
+                    # Yield as soon as the shard is complete
+                    yield ('<treebank>' + ''.join(current_output) +
+                           '</treebank>', nr_words, nr_sentences,
+                           current_file)
+                    yielded = True
+                    current_length = 0
+                    nr_words = 0
+                    nr_sentences = 0
+                    current_output.clear()
             current_file += 1
-            current_length += len(parse)
-            stripped = parse.strip()
-            stripped = re.sub(
-                '^' + re.escape(
-                    '<?xml version="1.0" encoding="UTF-8"?>\n<treebank>'
-                ), '', stripped
-            )  # Alternative for str.removeprefix()
-            stripped = re.sub(
-                re.escape('</treebank>') + '$', '', stripped
-            )
-            lines = stripped.split('\n')
-            for line in lines:
-                if 'cat="top"' in line:
-                    # Like gretel-upload, determine number of words using the
-                    # 'end' attribute in the top-level node
-                    nr_words += int(
-                        re.search('end=\"(.+?)\"', line).group(1)
-                    )
-                if '<alpino_ds' in line:
-                    # Each <alpino_ds> tag contains one sentence
-                    nr_sentences += 1
-                    # Add id to the end of the tag for identification in GrETEL
-                    tagend_pos = line.find('">') + 1
-                    id_attr = ' id="{}:{}"'.format(componentslug, current_id)
-                    line = line[:tagend_pos] + id_attr + line[tagend_pos:]
-                    current_id += 1
-                current_output.append(line)
-            if current_length > MAXIMUM_DATABASE_SIZE:
-                # Yield as soon as the maximum length is reached
-                yield ('<treebank>' + ''.join(current_output) + '</treebank>',
-                       nr_words, nr_sentences, current_file)
-                current_length = 0
-                nr_words = 0
-                nr_sentences = 0
-                current_output.clear()
         # Yield once more as soon as all files have been read
-        yield ('<treebank>' + ''.join(current_output) + '</treebank>',
-               nr_words, nr_sentences, current_file)
+        if current_output or not yielded:
+            yield ('<treebank>' + ''.join(current_output) + '</treebank>',
+                   nr_words, nr_sentences, current_file)
 
     def process(self):
         '''Process prepared treebank upload. This method converts the
@@ -263,8 +272,24 @@ class TreebankUpload(models.Model):
         instances.'''
         try:
             alpino.initialize()
+            self._parser = alpino.create_pool()
         except AlpinoError as e:
             raise UploadError('Alpino not available: {}'.format(str(e)))
+        try:
+            self._process()
+        finally:
+            self._parser.close()
+            logger.info(
+                'Parsed {} sentences ({:.1f} per second); {} retries, {} '
+                'timeouts and {} sentences that could not be parsed.'
+                .format(self._parser.statistics['sentences'],
+                        self._parser.get_throughput(),
+                        self._parser.statistics['retries'],
+                        self._parser.statistics['timeouts'],
+                        self._parser.statistics['failed'])
+            )
+
+    def _process(self):
         if not basex.test_connection():
             raise UploadError('BaseX not available')
 
@@ -302,20 +327,28 @@ class TreebankUpload(models.Model):
             db_sequence = 0
             for result in self._generate_blocks(filenames, componentslug):
                 doc, words, sentences, files_processed = result
-                self._discover_metadata(doc)
                 nr_words += words
                 nr_sentences += sentences
                 comp_obj.nr_sentences = nr_sentences
                 comp_obj.nr_words = nr_words
-                comp_obj.save()
+                if comp_obj.pk is None:
+                    # Totals are saved when all components are complete
+                    comp_obj.save()
                 dbname = ('GRETEL5_' + treebankslug + '_' + componentslug +
                           '_' + str(db_sequence)).upper()
-                basexdb_obj = BaseXDB(dbname)
+                basexdb_obj = BaseXDB(dbname, nr_sentences=sentences,
+                                      nr_words=words,
+                                      xml_size=len(doc.encode()))
                 basexdb_objs.append(basexdb_obj)
                 basexdb_obj.component = comp_obj
                 basex.create(dbname, doc)
                 basexdb_obj.size = basexdb_obj.get_db_size()
                 basexdb_obj.save()
+                try:
+                    basexdb_obj.build_lookup_tables()
+                except (OSError, ValueError) as err:
+                    logger.warning('Could not build lookup tables for {}: {}'
+                                   .format(dbname, err))
                 db_sequence += 1
                 percentage_component = int(files_processed
                                            / len(filenames) * 100)
@@ -325,5 +358,49 @@ class TreebankUpload(models.Model):
                             .format(files_processed, len(filenames),
                                     percentage_component, percentage))
             total_processed_files += files_processed
-        treebank.metadata = self.get_metadata()
-        treebank.save()
+        with transaction.atomic():
+            Component.objects.bulk_update(
+                [comp_obj for comp_obj in component_objs
+                 if comp_obj.pk is not None],
+                ['nr_sentences', 'nr_words']
+            )
+            treebank.metadata = self.get_metadata()
+            treebank.save()
+
+
+class ImportedFile(models.Model):
+    '''Record of an input file that has been completely imported into a
+    BaseX database. These records make up the manifest of an import that
+    is used to resume interrupted imports: files of which the content has
+    not changed since they were recorded do not have to be imported again.'''
+    treebank = models.ForeignKey(Treebank, on_delete=models.CASCADE,
+                                 related_name='imported_files')
+    path = models.CharField(
+        max_length=1000,
+        help_text='Path of the input file, relative to the input directory'
+    )
+    sha256 = models.CharField(max_length=64)
+    database = models.OneToOneField(BaseXDB, on_delete=models.CASCADE,
+                                    related_name='imported_file')
+    nr_sentences = models.PositiveIntegerField()
+    nr_words = models.PositiveBigIntegerField()
+    imported = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['treebank', 'path'],
+                                    name='unique_path_in_treebank')
+        ]
+
+    def __str__(self):
+        return '{} in {}'.format(self.path, self.treebank)
+
+    def verify(self) -> bool:
+        '''Check if the BaseX database of this file still exists and has
+        the size and number of sentences that were recorded.'''
+        try:
+            return (self.database.get_db_size() == self.database.size and
+                    self.database.get_number_of_sentences() ==
+                    self.nr_sentences)
+        except (OSError, ValueError):
+            return False
@@ -1,3 +1,235 @@
-# from django.test import TestCase
+from django.test import TestCase
+from django.conf import settings
+from django.core.management import call_command
 
-# Create your tests here.
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+from lxml import etree
+
+from services.basex import basex
+from search.models import ComponentSearchResult
+from treebanks.models import (Treebank, BaseXDB, AttributeCount,
+                              SentenceLocation)
+from .lassy import (convert_data_dz, convert_data_dz_to_file, get_file_hash,
+                    InputError)
+from .models import TreebankUpload, ImportedFile
+
+TEST_FILE = str(settings.BASE_DIR / 'testdata' / 'TEST_TROONREDE' /
+                'COMPACT' / 'troonrede1990.data.dz')
+
+
+class ConvertDataDzTestCase(TestCase):
+    def test_convert(self):
+        output = io.BytesIO()
+        sentences, words = convert_data_dz(TEST_FILE, output)
+        treebank = etree.fromstring(output.getvalue())
+        self.assertEqual(treebank.tag, 'treebank')
+        self.assertEqual(len(treebank), sentences)
+        self.assertGreater(sentences, 0)
+        self.assertEqual(
+            words,
+            sum(int(x) for x in treebank.xpath('alpino_ds/node/@end'))
+        )
+        self.assertEqual(treebank[63].get('id'), TEST_FILE + ':63')
+
+    def test_bad_file(self):
+        with self.assertRaises(InputError):
+            convert_data_dz(str(settings.BASE_DIR / 'manage.py'),
+                            io.BytesIO())
+        with self.assertRaises(InputError):
+            convert_data_dz('nonexisting.data.dz', io.BytesIO())
+
+    def test_convert_to_file(self):
+        path, sentences, words = convert_data_dz_to_file(TEST_FILE)
+        try:
+            treebank = etree.parse(path).getroot()
+            self.assertEqual(len(treebank), sentences)
+        finally:
+            os.remove(path)
+        directory = str(settings.BASE_DIR / 'testdata')
+        before = os.listdir(directory)
+        with self.assertRaises(InputError):
+            convert_data_dz_to_file('nonexisting.data.dz', directory)
+        self.assertEqual(os.listdir(directory), before)
+
+    def test_file_hash(self):
+        with open(TEST_FILE, 'rb') as f:
+            expected = hashlib.sha256(f.read()).hexdigest()
+        self.assertEqual(get_file_hash(TEST_FILE), expected)
+
+
+class NoAnnotator:
+    '''Annotator for input that has been parsed already'''
+    def annotate(self, document):
+        pass
+
+
+class TreebankUploadTestCase(TestCase):
+    def setUp(self):
+        self.input_dir = tempfile.TemporaryDirectory()
+        component_dir = Path(self.input_dir.name) / 'comp'
+        component_dir.mkdir()
+        # Split a LASSY file into files containing one parsed sentence
+        with gzip.open(TEST_FILE, 'rt') as f:
+            sentences = f.read().split(
+                '<?xml version="1.0" encoding="UTF-8"?>\n')[1:6]
+        self.sentences = []
+        for i, sentence in enumerate(sentences):
+            sentence = sentence.replace(
+                '<sentence',
+                '<metadata><meta type="int" name="year" value="{}"/>'
+                '</metadata><sentence'.format(1990 + i % 2), 1
+            )
+            self.sentences.append(sentence)
+            (component_dir / '{}.xml'.format(i)).write_text(
+                '<?xml version="1.0" encoding="UTF-8"?>\n' + sentence
+            )
+        (component_dir / '9.xml').write_text(
+            '<?xml version="1.0" encoding="UTF-8"?>\n<alpino_ds><broken'
+        )
+
+    def tearDown(self):
+        self.input_dir.cleanup()
+
+    def test_generate_blocks(self):
+        upload = TreebankUpload(input_dir=self.input_dir.name)
+        upload.prepare()
+        self.assertEqual(upload.input_format,
+                         TreebankUpload.InputFormat.ALPINO)
+        upload._parser = NoAnnotator()
+        upload._metadata = {}
+        filenames = sorted(str(x) for x in upload.components['comp'])
+        with self.settings(DATABASE_SHARD_SIZE=20000):
+            blocks = list(upload._generate_blocks(filenames, 'comp'))
+        # Blocks are split in between sentences and the broken file is
+        # skipped
+        self.assertEqual([x[2] for x in blocks], [4, 1])
+        self.assertEqual([x[3] for x in blocks], [3, 6])
+        ids = []
+        words = 0
+        for doc, _, _, _ in blocks:
+            treebank = etree.fromstring(doc)
+            ids.extend(treebank.xpath('alpino_ds/@id'))
+            words += sum(int(x) for x in
+                         treebank.xpath('alpino_ds/node[@cat="top"]/@end'))
+        self.assertEqual(ids, ['comp:{}'.format(i) for i in range(5)])
+        self.assertEqual(sum(x[1] for x in blocks), words)
+        self.assertEqual(upload.get_metadata(), [{
+            'field': 'year', 'type': 'int', 'min_value': 1990,
+            'max_value': 1991, 'facet': 'slider'
+        }])
+
+    def test_file_failing_after_shard(self):
+        upload = TreebankUpload(input_dir=self.input_dir.name)
+        upload._parser = NoAnnotator()
+        upload._metadata = {}
+
+        def convert(sentences, error=None):
+            yield '<treebank>'
+            yield from sentences
+            if error:
+                raise error
+            yield '</treebank>'
+        converters = [
+            # The shard is full after every sentence, but the first file
+            # fails after two of them
+            convert(self.sentences[:2], OSError('Cannot read file')),
+            convert(self.sentences[2:3])
+        ]
+        with patch('upload.models.Converter') as mocked, \
+                self.settings(DATABASE_SHARD_SIZE=1):
+            mocked.return_value.convert.side_effect = converters
+            blocks = list(upload._generate_blocks(['a', 'b'], 'comp'))
+        # None of the sentences of the failing file have been yielded
+        self.assertEqual([x[2] for x in blocks], [1])
+        self.assertEqual(etree.fromstring(blocks[0][0])
+                         .xpath('alpino_ds/@id'), ['comp:2'])
+
+
+class UploadLassyTestCase(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_dir = Path(self.temp_dir.name) / 'test'
+        (self.input_dir / 'COMPACT').mkdir(parents=True)
+        for name in ['a1', 'a2', 'b1']:
+            shutil.copy(TEST_FILE, self.input_dir / 'COMPACT' /
+                        '{}.data.dz'.format(name))
+        self.sentences, self.words = convert_data_dz(TEST_FILE, io.BytesIO())
+        # BaseX is not needed because databases are only created and their
+        # size is asked for
+        patches = [
+            patch.object(basex, 'test_connection', return_value=True),
+            patch.object(basex, 'execute', return_value=''),
+            patch.object(basex, 'create'),
+            patch.object(basex, 'perform_query', return_value='4096'),
+            patch.object(BaseXDB, 'build_lookup_tables'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def import_lassy(self, *args):
+        call_command('upload-lassy', str(self.input_dir), '--group-by', '1',
+                     '--checkpoint', '2', *args, stdout=io.StringIO())
+
+    def get_totals(self):
+        treebank = Treebank.objects.get(slug='test')
+        return {component.slug: (component.nr_sentences, component.nr_words)
+                for component in treebank.components.all()}
+
+    def test_import_and_update(self):
+        self.import_lassy('--defaults')
+        self.assertEqual(self.get_totals(), {
+            'a': (2 * self.sentences, 2 * self.words),
+            'b': (self.sentences, self.words),
+        })
+        self.assertEqual(ImportedFile.objects.count(), 3)
+        self.assertEqual(
+            BaseXDB.objects.get(dbname='GRETEL5_TEST_ID_A2').nr_sentences,
+            self.sentences
+        )
+
+        # Lookup tables and cached results of b1
+        database = BaseXDB.objects.get(dbname='GRETEL5_TEST_ID_B1')
+        database.has_attribute_counts = database.has_sentence_index = True
+        database.save()
+        AttributeCount.objects.create(database=database, attribute='pt',
+                                      value='n', count=1)
+        SentenceLocation.objects.create(database=database,
+                                        sentence_id='b1:1', pre=1)
+        ComponentSearchResult.objects.create(xpath='//node',
+                                             component=database.component)
+
+        # Replace b1 by a file containing only the first sentence and add
+        # a new file
+        with gzip.open(TEST_FILE, 'rb') as f:
+            first_sentence = f.read().split(b'<?xml', 2)[1]
+        with gzip.open(self.input_dir / 'COMPACT' / 'b1.data.dz', 'wb') as f:
+            f.write(b'<?xml' + first_sentence)
+        shutil.copy(TEST_FILE, self.input_dir / 'COMPACT' / 'b2.data.dz')
+        self.import_lassy('--update')
+        words = convert_data_dz(
+            str(self.input_dir / 'COMPACT' / 'b1.data.dz'), io.BytesIO()
+        )[1]
+        self.assertEqual(self.get_totals(), {
+            'a': (2 * self.sentences, 2 * self.words),
+            'b': (self.sentences + 1, self.words + words),
+        })
+        record = ImportedFile.objects.get(path='COMPACT/b1.data.dz')
+        self.assertEqual(record.nr_sentences, 1)
+        self.assertEqual(record.database.nr_sentences, 1)
+        self.assertEqual(ImportedFile.objects.count(), 4)
+        # The lookup tables of the replaced database have been cleared
+        self.assertFalse(record.database.has_attribute_counts)
+        self.assertFalse(record.database.attribute_counts.exists())
+        self.assertFalse(record.database.sentences.exists())
+        self.assertFalse(ComponentSearchResult.objects.exists())
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
+import json
 import os
 import sys
 import logging
@@ -12,6 +14,22 @@ import csv
 from BaseXClient import BaseXClient
 
 
+# Options for the BaseX databases that are created. GrETEL searches
+# heavily depend on the attribute index; the databases are not updated
+# afterwards, so indexes do not have to be updated incrementally.
+DATABASE_OPTIONS = {
+    'ATTRINDEX': 'true',
+    'TEXTINDEX': 'true',
+    'TOKENINDEX': 'true',
+    'UPDINDEX': 'false',
+    'AUTOOPTIMIZE': 'false',
+}
+
+
+# Number of bytes read at once when calculating the hash of an input file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
 class InputError(Exception):
     pass
 
@@ -110,6 +128,60 @@ def process_file(input_filename):
     return (output, number_of_sentences, number_of_words)
 
 
+def get_file_hash(filename):
+    """
+    Return the SHA-256 hash of the contents of a file as a hexadecimal string
+    """
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def read_manifest(filename: str) -> dict:
+    """
+    Read the manifest of a previous import, which contains the hash,
+    database name and number of sentences and words of every completely
+    imported file, by path of the file
+    """
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logging.warning('Manifest {} not found.'.format(filename))
+    except ValueError:
+        logging.error('Manifest {} cannot be read; ignoring.'.format(filename))
+    return {}
+
+
+def write_manifest(filename: str):
+    """
+    Write the manifest of the current import. The file is replaced at once,
+    so that an interrupted write does not leave an incomplete manifest.
+    """
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+
+def check_imported_file(fileobj, entry) -> bool:
+    """
+    Check if a file that has been recorded in the manifest has not changed
+    since and if its BaseX database still contains all sentences
+    """
+    if get_file_hash(fileobj.path) != entry['sha256']:
+        return False
+    try:
+        number_of_sentences = int(session.query(
+            'count(db:open("{}")/treebank/alpino_ds)'
+            .format(entry['database'])
+        ).execute())
+    except (OSError, ValueError):
+        return False
+    return number_of_sentences == entry['sentences']
+
+
 def get_prefix_candidate(filename):
     """
     Discover the prefix of a given filename based on the --group-by argument
@@ -297,6 +369,12 @@ def get_commandline_arguments():
              'GrETEL according to a CSV file',
         default=None
     )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='resume an interrupted import: files that are listed in the '
+             'manifest of the previous run and have not changed are skipped'
+    )
     return parser.parse_args()
 
 
@@ -397,6 +475,10 @@ except ConnectionRefusedError:
     logging.error('BaseX connection refused - is it running?')
     break_script()
 
+# Create databases with explicit index options (see DATABASE_OPTIONS)
+for option, value in DATABASE_OPTIONS.items():
+    session.execute('SET {} {}'.format(option, value))
+
 # Remove trailing slash because os.path.basename would return empty string
 input_dir = args.input_dir
 if input_dir[-1:] == os.path.sep:
@@ -405,11 +487,31 @@ treebank_title = os.path.basename(input_dir)
 
 treebank_db = treebank_title.upper() + '_ID'
 
+# The manifest records every file that has been imported completely, so
+# that an interrupted import can be resumed
+manifest_filename = treebank_title + '_manifest.json'
+manifest = {}
+if args.resume:
+    previous_manifest = read_manifest(manifest_filename)
+    for fileobj in inputfiles:
+        entry = previous_manifest.get(fileobj.path)
+        if entry is not None and check_imported_file(fileobj, entry):
+            manifest[fileobj.path] = entry
+    logging.info(
+        'Resuming import: {} files have already been imported.'
+        .format(len(manifest))
+    )
+    write_manifest(manifest_filename)
+
 # Check if BaseX databases already exist
 all_basex_dbs = session.execute('LIST').split('\n')
 current_dbs = [x[0:x.find(' ')]
                for x in all_basex_dbs
                if x[0:len(treebank_db)] == treebank_db]
+if args.resume:
+    # Databases of files that have been imported can be kept
+    completed_dbs = set(entry['database'] for entry in manifest.values())
+    current_dbs = [x for x in current_dbs if x not in completed_dbs]
 if len(current_dbs) > 0:
     logging.error(
         '{} BaseX databases for this treebank already exist.'
@@ -471,16 +573,28 @@ for fileobj in inputfiles:
         components_child_databases[current_component] = []
         components_id[current_component] = treebank_db + '_' + \
             file_title.upper()
+    entry = manifest.get(fileobj.path)
     try:
-        output, number_of_sentences, number_of_words = process_file(
-            fileobj.path)
+        if entry is not None:
+            output = None
+            number_of_sentences = entry['sentences']
+            number_of_words = entry['words']
+        else:
+            output, number_of_sentences, number_of_words = process_file(
+                fileobj.path)
     except InputError:
         logging.error('Cannot read file {}.'.format(fileobj.name))
     else:
-        logging.info(
-            'Extracted file {}: {} sentences, {} words.'
-            .format(fileobj.name, number_of_sentences, number_of_words)
-        )
+        if entry is not None:
+            logging.info(
+                'File {} has already been imported: {} sentences, {} words.'
+                .format(fileobj.name, number_of_sentences, number_of_words)
+            )
+        else:
+            logging.info(
+                'Extracted file {}: {} sentences, {} words.'
+                .format(fileobj.name, number_of_sentences, number_of_words)
+            )
         if args.group_by:
             basex_db = treebank_db + '_' + file_title.upper()
             components_number_of_sentences[current_component] += \
@@ -494,7 +608,17 @@ for fileobj in inputfiles:
                 number_of_sentences
         # Add to BaseX and wrap up if this succeeds
         try:
-            session.create(basex_db, output)
+            if entry is None:
+                # Index structures are built according to the options set
+                # when opening the session
+                session.create(basex_db, output)
+                manifest[fileobj.path] = {
+                    'sha256': get_file_hash(fileobj.path),
+                    'database': basex_db,
+                    'sentences': number_of_sentences,
+                    'words': number_of_words,
+                }
+                write_manifest(manifest_filename)
         except OSError as err:
             logging.error(
                 'Adding file {} to BaseX failed: {}.'